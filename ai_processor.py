@@ -1,27 +1,126 @@
-from openai import OpenAI
 import re
+import copy
+import inspect
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional
 import json
 import os
-from dotenv import load_dotenv
+import threading
 
-# Charger les variables d'environnement
-load_dotenv()
+import metrics
+from cache import ResultCache, make_key
+from document_processor import MAX_SECTION_CHARS, DocumentProcessor
+from singleflight import SingleFlight
+
+# Résumés de sections partagés par tous les Summarizer du processus
+_section_cache = ResultCache('sections', max_entries=2048, ttl=24 * 3600)
+
+# Résultats complets des méthodes (résumé, mots-clés...), alimentés aussi par le précalcul
+_result_cache = ResultCache('results', max_entries=512, ttl=3600)
+
+# Appels identiques simultanés (double-clic, document partagé): un seul appel OpenAI
+_inflight = SingleFlight('summarizer')
+
+# Compteur de tokens du thread courant, actif dans un bloc Summarizer.tokens_used()
+_thread_usage = threading.local()
+
+
+def _is_success(result: dict) -> bool:
+    return bool(result.get("success")) and result.get("method") != "fallback"
+
+
+def cached_result(method: str, cacheable=_is_success):
+    """
+    Met en cache le résultat d'une méthode du Summarizer, clé = méthode + modèle + arguments
+    normalisés (un appel positionnel et un appel nommé partagent la même entrée).
+    Seuls les résultats jugés `cacheable` sont conservés (pas les fallbacks ni les erreurs).
+    En cas de miss, les appels simultanés de même clé sont coalescés (SingleFlight).
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = {name: value for name, value in bound.arguments.items() if name != 'self'}
+            key = make_key(method, self.model, arguments)
+            
+            cached = _result_cache.get(key)
+            if cached is not None:
+                return copy.deepcopy(cached)
+            
+            result = _inflight.do(key, lambda: func(self, *args, **kwargs), cacheable)
+            if cacheable(result):
+                _result_cache.set(key, copy.deepcopy(result))
+            return result
+        return wrapper
+    return decorator
 
 
 class Summarizer:
     """Classe pour générer des résumés et analyses avec OpenAI GPT-4o-mini"""
     
+    # Nombre d'appels OpenAI simultanés pour le résumé par sections
+    SECTION_WORKERS = int(os.environ.get('SECTION_WORKERS', 4))
+    # Délai maximal d'une tentative d'appel OpenAI (secondes)
+    TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 60))
+    
     def __init__(self):
         self.api_key = os.environ.get('OPENAI_API_KEY')
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY non définie dans les variables d'environnement")
-        self.client = OpenAI(api_key=self.api_key)
+        self._client = None
+        self._client_lock = threading.Lock()
         self.model = "gpt-4o-mini"
         print(f"Summarizer initialisé avec {self.model}")
     
+    @property
+    def client(self):
+        """Client OpenAI, créé au premier appel (l'import du SDK est coûteux au démarrage)"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    # Partagé par tous les threads du worker (pool de connexions httpx); un appel
+                    # bloqué ne retient son thread que OPENAI_TIMEOUT secondes
+                    self._client = OpenAI(api_key=self.api_key, timeout=self.TIMEOUT)
+        return self._client
+    
+    @client.setter
+    def client(self, value):
+        self._client = value
+    
+    def _chat(self, method: str, **kwargs):
+        """Appelle l'API Chat Completions et enregistre tokens et coût de la réponse"""
+        response = self.client.chat.completions.create(model=self.model, **kwargs)
+        usage = getattr(response, 'usage', None)
+        metrics.record_usage(method, self.model, usage)
+        counter = getattr(_thread_usage, 'counter', None)
+        if counter is not None and usage is not None:
+            counter[0] += getattr(usage, 'total_tokens', 0) or 0
+        return response
+    
+    @staticmethod
+    @contextmanager
+    def tokens_used():
+        """
+        Tokens facturés (prompt + réponse) des appels OpenAI faits par le thread courant dans le
+        bloc: [total], rempli au fil des appels (0 pour un résultat servi par le cache)
+        """
+        counter = _thread_usage.counter = [0]
+        try:
+            yield counter
+        finally:
+            _thread_usage.counter = None
+    
     # ==================== RÉSUMÉ ====================
     
+    @metrics.track_ai('summarize')
+    @cached_result('summarize', cacheable=lambda result: result["method"] != "extractive")
     def summarize(self, text: str, target_words: int = 100, style: str = "paragraph") -> dict:
         """Génère un résumé du texte"""
         if not text or len(text.strip()) == 0:
@@ -36,6 +135,8 @@ class Summarizer:
             return {"summary": summary, "method": "openai", "model": self.model}
         except Exception as e:
             print(f"Erreur OpenAI: {e}")
+            metrics.AI_ERRORS.labels('summarize').inc()
+            metrics.AI_FALLBACKS.labels('summarize').inc()
             summary = self._summarize_extractive(text, target_words)
             return {"summary": summary, "method": "extractive", "model": None}
     
@@ -49,8 +150,8 @@ class Summarizer:
             "simple": "Écris le résumé dans un langage simple et accessible, comme si tu expliquais à un débutant."
         }
         
-        response = self.client.chat.completions.create(
-            model=self.model,
+        response = self._chat(
+            'summarize',
             messages=[
                 {
                     "role": "system",
@@ -119,6 +220,8 @@ TEXTE:
     
     # ==================== TRADUCTION ====================
     
+    @metrics.track_ai('translate')
+    @cached_result('translate')
     def translate(self, text: str, target_language: str) -> dict:
         """Traduit le texte dans la langue cible"""
         languages = {
@@ -137,8 +240,8 @@ TEXTE:
         lang_name = languages.get(target_language, target_language)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'translate',
                 messages=[
                     {
                         "role": "system",
@@ -158,15 +261,18 @@ TEXTE:
                 "success": True
             }
         except Exception as e:
+            metrics.AI_ERRORS.labels('translate').inc()
             return {"error": str(e), "success": False}
     
     # ==================== MOTS-CLÉS ====================
     
+    @metrics.track_ai('extract_keywords')
+    @cached_result('extract_keywords')
     def extract_keywords(self, text: str, count: int = 10) -> dict:
         """Extrait les mots-clés importants du texte"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'extract_keywords',
                 messages=[
                     {
                         "role": "system",
@@ -195,6 +301,8 @@ TEXTE:
             result = json.loads(content)
             return {"keywords": result.get("keywords", []), "success": True}
         except Exception as e:
+            metrics.AI_ERRORS.labels('extract_keywords').inc()
+            metrics.AI_FALLBACKS.labels('extract_keywords').inc()
             # Fallback: extraction basique
             words = re.findall(r'\b[a-zA-ZÀ-ÿ]{4,}\b', text.lower())
             stop_words = {'le', 'la', 'les', 'un', 'une', 'des', 'que', 'qui', 'dans', 'pour', 'avec', 'sur', 'par'}
@@ -204,11 +312,13 @@ TEXTE:
     
     # ==================== ANALYSE DE SENTIMENT ====================
     
+    @metrics.track_ai('analyze_sentiment')
+    @cached_result('analyze_sentiment')
     def analyze_sentiment(self, text: str) -> dict:
         """Analyse le sentiment/ton du texte"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'analyze_sentiment',
                 messages=[
                     {
                         "role": "system",
@@ -243,15 +353,17 @@ TEXTE:
             result["success"] = True
             return result
         except Exception as e:
+            metrics.AI_ERRORS.labels('analyze_sentiment').inc()
             return {"sentiment": "neutre", "score": 0, "emotions": [], "tone": "Non déterminé", "success": False}
     
     # ==================== GÉNÉRATION DE TITRE ====================
     
+    @metrics.track_ai('generate_title')
     def generate_title(self, text: str, count: int = 3) -> dict:
         """Génère des suggestions de titres pour le texte"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'generate_title',
                 messages=[
                     {
                         "role": "system",
@@ -279,15 +391,18 @@ TEXTE:
             result = json.loads(content)
             return {"titles": result.get("titles", []), "success": True}
         except Exception as e:
+            metrics.AI_ERRORS.labels('generate_title').inc()
             return {"titles": [], "success": False, "error": str(e)}
     
     # ==================== QUESTIONS-RÉPONSES ====================
     
+    @metrics.track_ai('answer_question')
+    @cached_result('answer_question')
     def answer_question(self, text: str, question: str) -> dict:
         """Répond à une question basée sur le texte"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'answer_question',
                 messages=[
                     {
                         "role": "system",
@@ -312,56 +427,102 @@ Réponds de manière précise et concise."""
                 "success": True
             }
         except Exception as e:
+            metrics.AI_ERRORS.labels('answer_question').inc()
             return {"answer": "", "success": False, "error": str(e)}
     
     # ==================== RÉSUMÉ PAR SECTIONS ====================
     
-    def summarize_by_sections(self, text: str, target_words_per_section: int = 50) -> dict:
-        """Découpe le texte en sections et résume chaque section"""
+    @metrics.track_ai('summarize_by_sections')
+    def summarize_by_sections(self, text: str, target_words_per_section: int = 50,
+                              outline: Optional[List[Dict]] = None, sections: Optional[List[Dict]] = None,
+                              workers: Optional[int] = None) -> dict:
+        """
+        Découpe le texte en sections (plan du document ou titres détectés localement), sauf si
+        sections (split_sections) est fourni, et résume chaque section en parallèle, dans l'ordre
+        du document, sur workers threads au plus (SECTION_WORKERS par défaut)
+        """
+        try:
+            if sections is None:
+                sections = DocumentProcessor().split_sections(text, outline)
+            if not sections:
+                return {"sections": [], "total_sections": 0, "success": True}
+            
+            workers = min(workers or self.SECTION_WORKERS, len(sections))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                summaries = list(pool.map(
+                    lambda item: self._summarize_section(item[0], item[1], target_words_per_section),
+                    enumerate(sections, 1)
+                ))
+            
+            return {"sections": summaries, "total_sections": len(summaries), "success": True}
+        except Exception as e:
+            metrics.AI_ERRORS.labels('summarize_by_sections').inc()
+            return {"sections": [], "success": False, "error": str(e)}
+    
+    def _summarize_section(self, index: int, section: dict, target_words: int) -> dict:
+        """Résume une section, avec cache par section (titre + contenu + longueur visée)"""
+        title = section["title"]
+        body = section["text"]
+        base = {"title": title or f"Partie {index}", "level": section["level"],
+                "word_count": len(body.split())}
+        
+        if len(body.split()) <= target_words:
+            return {**base, "summary": body, "method": "original"}
+        
+        key = make_key("section", self.model, title, body, target_words)
+        cached = _section_cache.get(key)
+        if cached is not None:
+            return {**base, **cached}
+        
+        # Section regroupée plus longue qu'une requête: condensée localement (phrases les plus
+        # représentatives, dans l'ordre) avant l'appel
+        if len(body) > MAX_SECTION_CHARS:
+            body = self._summarize_extractive(body, MAX_SECTION_CHARS // 8) or body[:MAX_SECTION_CHARS]
+        
+        title_instruction = (
+            f"La section s'intitule « {title} »." if title else
+            "Cette partie n'a pas de titre: commence ta réponse par une ligne \"TITRE: <titre court>\"."
+        )
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'summarize_by_sections',
                 messages=[
                     {
                         "role": "system",
-                        "content": "Tu analyses et résumes des documents section par section."
+                        "content": "Tu résumes fidèlement une section d'un document plus long."
                     },
                     {
                         "role": "user",
-                        "content": f"""Analyse ce texte et crée un résumé structuré par sections.
-Identifie les parties principales et résume chacune en environ {target_words_per_section} mots.
+                        "content": f"""Résume cette section en environ {target_words} mots.
+{title_instruction}
+Écris dans la même langue que le texte. Réponds UNIQUEMENT avec le résumé.
 
-Réponds en JSON:
-{{
-    "sections": [
-        {{"title": "Titre section 1", "summary": "Résumé..."}},
-        {{"title": "Titre section 2", "summary": "Résumé..."}}
-    ],
-    "total_sections": nombre
-}}
-
-TEXTE:
-{text[:12000]}"""
+SECTION:
+{body}"""
                     }
                 ],
                 temperature=0.3,
-                max_tokens=2000
+                max_tokens=target_words * 4
             )
-            
-            content = response.choices[0].message.content.strip()
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0]
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0]
-            
-            result = json.loads(content)
-            result["success"] = True
-            return result
+            summary = response.choices[0].message.content.strip()
+            result = {"summary": summary, "method": "openai"}
+            if not title:
+                match = re.match(r'^\s*TITRE\s*:\s*(.+?)\s*\n+(.*)$', summary, re.DOTALL | re.IGNORECASE)
+                if match:
+                    result = {"title": match.group(1).strip(' *"«»'), "summary": match.group(2).strip(),
+                              "method": "openai"}
+            _section_cache.set(key, result)
+            return {**base, **result}
         except Exception as e:
-            return {"sections": [], "success": False, "error": str(e)}
+            print(f"Erreur OpenAI (section {index}): {e}")
+            metrics.AI_ERRORS.labels('summarize_by_sections').inc()
+            metrics.AI_FALLBACKS.labels('summarize_by_sections').inc()
+            return {**base, "summary": self._summarize_extractive(body, target_words), "method": "extractive"}
     
     # ==================== NUAGE DE MOTS (données) ====================
     
+    @metrics.track_ai('get_word_cloud_data')
+    @cached_result('get_word_cloud_data')
     def get_word_cloud_data(self, text: str, max_words: int = 50) -> dict:
         """Génère les données pour un nuage de mots"""
         stop_words = {
@@ -393,6 +554,8 @@ TEXTE:
     
     # ==================== STATISTIQUES AVANCÉES ====================
     
+    @metrics.track_ai('get_advanced_stats')
+    @cached_result('get_advanced_stats')
     def get_advanced_stats(self, text: str) -> dict:
         """Calcule des statistiques avancées sur le texte"""
         words = text.split()
@@ -1,34 +1,309 @@
-from flask import Flask, render_template, request, jsonify, send_file, session
+import click
+from flask import Blueprint, Flask, current_app, make_response, render_template, request, jsonify, session, Response
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 from functools import wraps
 import os
+import shutil
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv
 import json
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from batch_processor import BatchProcessor
+from chunked_upload import ChunkedUploads, UploadError
 from document_processor import DocumentProcessor
-from ai_processor import Summarizer
+from history_export import HistoryExport
+import assets
 import database as db
+import metrics
+import ratelimit
 
-# Charger les variables d'environnement
-load_dotenv()
+bp = Blueprint('nectar', __name__)
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'docx', 'txt'}
-app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'fallback-secret-key')
-
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+doc_processor = DocumentProcessor()
 
-# Variable pour stocker le nom du fichier courant
-current_filename = None
 
-doc_processor = DocumentProcessor()
-ai_processor = Summarizer()
+class Services:
+    """Clients lourds (OpenAI...) créés au premier usage puis partagés par toutes les requêtes"""
+    
+    def __init__(self, config):
+        self._config = config
+        self._lock = threading.Lock()
+        self._summarizer = None
+        self._precomputer = None
+        self._history_cleaner = None
+        self._write_behind = None
+        self._rate_limiter = None
+        self._chunked_uploads = None
+    
+    @property
+    def summarizer(self):
+        if self._summarizer is None:
+            with self._lock:
+                if self._summarizer is None:
+                    from ai_processor import Summarizer
+                    self._summarizer = Summarizer()
+        return self._summarizer
+    
+    @property
+    def precomputer(self):
+        if self._precomputer is None:
+            # Lu avant de prendre le verrou (non réentrant) que rate_limiter prend aussi
+            rate_limiter = self.rate_limiter
+            with self._lock:
+                if self._precomputer is None:
+                    from precompute import Precomputer
+                    self._precomputer = Precomputer(
+                        token_budget_per_hour=self._config['PRECOMPUTE_TOKEN_BUDGET'],
+                        rate_limiter=rate_limiter
+                    )
+        return self._precomputer
+    
+    @property
+    def history_cleaner(self):
+        if self._history_cleaner is None:
+            with self._lock:
+                if self._history_cleaner is None:
+                    from history_jobs import HistoryCleaner
+                    self._history_cleaner = HistoryCleaner()
+        return self._history_cleaner
+    
+    @property
+    def write_behind(self):
+        """File d'écriture différée de l'historique (None si désactivée)"""
+        # Écritures SQLite locales: déjà de l'ordre de la milliseconde
+        if not self._config['WRITE_BEHIND_ENABLED'] or self._config['STORAGE_BACKEND'] != 'firestore':
+            return None
+        if self._write_behind is None:
+            with self._lock:
+                if self._write_behind is None:
+                    from write_behind import WriteBehindQueue
+                    self._write_behind = WriteBehindQueue(max_pending=self._config['WRITE_BEHIND_MAX_PENDING'])
+        return self._write_behind
+    
+    @property
+    def rate_limiter(self):
+        """Limites de débit par utilisateur ou IP (None si désactivées)"""
+        if not self._config['RATE_LIMIT_ENABLED']:
+            return None
+        if self._rate_limiter is None:
+            with self._lock:
+                if self._rate_limiter is None:
+                    self._rate_limiter = ratelimit.RateLimiter()
+        return self._rate_limiter
+    
+    @property
+    def chunked_uploads(self):
+        """Uploads par morceaux en cours, dans UPLOAD_FOLDER/chunked (partagés entre workers)"""
+        if self._chunked_uploads is None:
+            with self._lock:
+                if self._chunked_uploads is None:
+                    self._chunked_uploads = ChunkedUploads(os.path.join(self._config['UPLOAD_FOLDER'], 'chunked'))
+        return self._chunked_uploads
+
+
+def create_app(config=None):
+    """Fabrique de l'application: aucune connexion Firestore/OpenAI n'est ouverte ici"""
+    # Charger les variables d'environnement
+    load_dotenv()
+    
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'docx', 'txt'}
+    app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'fallback-secret-key')
+    # Stockage: firestore (défaut) ou sqlite (fichier local SQLITE_PATH)
+    app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'firestore')
+    app.config['SQLITE_PATH'] = os.environ.get('SQLITE_PATH', 'nectar.db')
+    # Traitement par lot: documents par requête et appels OpenAI simultanés
+    app.config['BATCH_MAX_FILES'] = int(os.environ.get('BATCH_MAX_FILES', 50))
+    app.config['BATCH_AI_WORKERS'] = int(os.environ.get('BATCH_AI_WORKERS', 4))
+    # Précalcul spéculatif après upload (désactivé par défaut) et budget horaire par utilisateur
+    app.config['PRECOMPUTE_ENABLED'] = os.environ.get('PRECOMPUTE_ENABLED', '0') == '1'
+    app.config['PRECOMPUTE_TOKEN_BUDGET'] = int(os.environ.get('PRECOMPUTE_TOKEN_BUDGET', 100000))
+    # Au-delà de ce nombre de documents, l'effacement de l'historique passe en arrière-plan
+    app.config['CLEAR_SYNC_LIMIT'] = int(os.environ.get('CLEAR_SYNC_LIMIT', 500))
+    # Historique écrit en arrière-plan (réponse immédiate) et taille maximale de la file
+    app.config['WRITE_BEHIND_ENABLED'] = os.environ.get('WRITE_BEHIND_ENABLED', '1') == '1'
+    app.config['WRITE_BEHIND_MAX_PENDING'] = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 1000))
+    # Durée de validité du profil copié dans la session (cookie signé) pour /auth/me; 0 désactive
+    app.config['USER_SNAPSHOT_TTL'] = int(os.environ.get('USER_SNAPSHOT_TTL', 3600))
+    # Limites de débit et de requêtes en cours par utilisateur ou IP (voir ratelimit.RATE_LIMITS)
+    app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    # Proxys de confiance devant l'application (Render, Vercel: 1): l'adresse du client est lue dans
+    # X-Forwarded-For, sinon tous les visiteurs partageraient l'adresse du proxy (et ses quotas)
+    app.config['PROXY_FIX_X_FOR'] = int(os.environ.get('PROXY_FIX_X_FOR', 1))
+    if config:
+        app.config.update(config)
+    
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    db.configure(app.config['STORAGE_BACKEND'], app.config['SQLITE_PATH'])
+    
+    app.extensions['nectar'] = Services(app.config)
+    app.register_blueprint(bp)
+    # Logos et ressources versionnées (/assets/...), réponses compressées selon Accept-Encoding
+    app.register_blueprint(assets.bp)
+    app.jinja_env.globals['asset_url'] = assets.asset_url
+    app.after_request(assets.compress_response)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(backfill_user_keys_command)
+    app.cli.add_command(blob_stats_command)
+    app.cli.add_command(gc_blobs_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(compact_rollups_command)
+    app.cli.add_command(archive_history_command)
+    app.cli.add_command(set_plan_command)
+    return app
+
+
+@click.command('rebuild-stats')
+@click.option('--user', 'user_ids', multiple=True, help="ID d'utilisateur (répétable); tous par défaut")
+def rebuild_stats_command(user_ids):
+    """Recalcule les agrégats user_stats et les statistiques par jour depuis les collections (flask --app app rebuild-stats)"""
+    failures = 0
+    for user_id in user_ids or db.iter_user_ids():
+        stats = db.rebuild_user_stats(user_id)
+        rollups = db.rebuild_rollups(user_id) if stats is not None else None
+        if rollups is None:
+            failures += 1
+            click.echo(f"{user_id}: échec")
+        else:
+            click.echo(f"{user_id}: {stats['total_summaries']} résumés, {stats['total_translations']} traductions, "
+                       f"{rollups['days']} jour(s) d'activité")
+    if failures:
+        raise click.ClickException(f"{failures} utilisateur(s) en échec")
+
+
+@click.command('backfill-user-keys')
+def backfill_user_keys_command():
+    """Crée les clés uniques email / nom d'utilisateur des comptes existants (flask --app app backfill-user-keys)"""
+    result = db.backfill_user_keys()
+    click.echo(f"{result['users']} utilisateur(s) traité(s)")
+    for conflict in result['conflicts']:
+        click.echo(f"Doublon existant: {conflict}")
+
+
+@click.command('rebuild-search-index')
+@click.option('--user', 'user_ids', multiple=True, help="ID d'utilisateur (répétable); tous par défaut")
+def rebuild_search_index_command(user_ids):
+    """Reconstruit l'index de recherche de l'historique (flask --app app rebuild-search-index)"""
+    failures = 0
+    for user_id in user_ids or db.iter_user_ids():
+        indexed = db.rebuild_search_index(user_id)
+        if indexed is None:
+            failures += 1
+            click.echo(f"{user_id}: échec")
+        else:
+            click.echo(f"{user_id}: {indexed} entrée(s) indexée(s)")
+    if failures:
+        raise click.ClickException(f"{failures} utilisateur(s) en échec")
+
+
+@click.command('compact-rollups')
+@click.option('--keep-days', type=int, default=None, help="Jours gardés au détail (ROLLUP_KEEP_DAYS, 90 par défaut)")
+@click.option('--user', 'user_ids', multiple=True, help="ID d'utilisateur (répétable); tous par défaut")
+def compact_rollups_command(keep_days, user_ids):
+    """Cumule par mois les statistiques par jour anciennes (flask --app app compact-rollups), à lancer chaque jour"""
+    before = (date.today() - timedelta(days=db.ROLLUP_KEEP_DAYS if keep_days is None else keep_days)).isoformat()
+    failures = folded = 0
+    for user_id in user_ids or db.iter_user_ids():
+        count = db.compact_rollups(user_id, before)
+        if count is None:
+            failures += 1
+            click.echo(f"{user_id}: échec")
+        else:
+            folded += count
+    click.echo(f"{folded} jour(s) antérieur(s) au {before} cumulé(s) par mois")
+    if failures:
+        raise click.ClickException(f"{failures} utilisateur(s) en échec")
+
+
+@click.command('archive-history')
+@click.option('--dry-run', is_flag=True, help="Affiche ce qui serait archivé, sans rien modifier")
+@click.option('--batch-size', type=int, default=None, help="Entrées déplacées par transaction (200 par défaut)")
+@click.option('--user', 'user_ids', multiple=True, help="ID d'utilisateur (répétable); tous par défaut")
+def archive_history_command(dry_run, batch_size, user_ids):
+    """Archive par mois l'historique plus ancien que la durée de conservation de chaque offre (flask --app app archive-history)"""
+    from history_jobs import HistoryArchiver
+
+    def progress(user_id, collection, archived):
+        click.echo(f"{user_id}: {collection}, {archived} entrée(s) archivée(s)")
+
+    archiver = HistoryArchiver(batch_size or db.ARCHIVE_BATCH_SIZE, dry_run, progress)
+    failures = total = 0
+    for user_id in user_ids or db.iter_user_ids():
+        report = archiver.archive_user(user_id)
+        if report is None:
+            click.echo(f"{user_id}: utilisateur introuvable")
+            continue
+        for collection, result in report['collections'].items():
+            total += result['entries']
+            if result['entries']:
+                months = ', '.join(f"{month}: {count}" for month, count in sorted(result['months'].items()))
+                verb = 'à archiver' if dry_run else 'archivée(s)'
+                click.echo(f"{user_id} ({report['plan']}): {collection} avant le {result['before']}, "
+                           f"{result['entries']} entrée(s) {verb} ({months})")
+        if report['error']:
+            failures += 1
+            click.echo(f"{user_id}: échec ({report['error']})")
+    if dry_run:
+        click.echo(f"{total} entrée(s) à archiver (simulation: rien n'a été modifié)")
+    else:
+        click.echo(f"{total} entrée(s) archivée(s)")
+    if failures:
+        raise click.ClickException(f"{failures} utilisateur(s) en échec")
+
+
+@click.command('set-plan')
+@click.argument('user_id')
+@click.argument('plan')
+def set_plan_command(user_id, plan):
+    """Change l'offre d'un utilisateur, qui fixe ses durées de conservation (flask --app app set-plan ID pro)"""
+    if plan not in db.RETENTION_POLICIES:
+        raise click.ClickException(f"Offre inconnue: {plan} (attendu: {', '.join(db.RETENTION_POLICIES)})")
+    if not db.set_user_plan(user_id, plan):
+        raise click.ClickException(f"Utilisateur introuvable ou erreur: {user_id}")
+    click.echo(f"{user_id}: offre {plan}")
+
+
+@click.command('blob-stats')
+def blob_stats_command():
+    """Taux de compression et gain de déduplication des textes complets (flask --app app blob-stats)"""
+    report = db.get_blob_stats()
+    if report is None:
+        raise click.ClickException("Lecture des blobs impossible")
+    click.echo(f"{report['blobs']} texte(s) distinct(s), {report['references']} référence(s)")
+    click.echo(f"Brut: {report['raw_bytes']} octets, stocké: {report['stored_bytes']} octets "
+               f"(compression x{report['compression_ratio']})")
+    click.echo(f"Économisé par la déduplication: {report['dedup_saved_bytes']} octets")
+    click.echo(f"Économisé au total (vs une copie brute par entrée): {report['total_saved_bytes']} octets")
+
+
+@click.command('gc-blobs')
+def gc_blobs_command():
+    """Supprime les textes complets qui ne sont plus référencés (flask --app app gc-blobs)"""
+    deleted = db.gc_blobs()
+    if deleted is None:
+        raise click.ClickException("Nettoyage des blobs impossible")
+    click.echo(f"{deleted} blob(s) supprimé(s)")
+
+
+def get_ai_processor():
+    """Summarizer partagé de l'application courante"""
+    return current_app.extensions['nectar'].summarizer
+
+
+def get_history_writer():
+    """File d'écriture différée à passer aux database.save_* (None: écriture synchrone)"""
+    return current_app.extensions['nectar'].write_behind
 
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 
 def login_required(f):
@@ -46,15 +321,167 @@ def get_current_user_id():
     return session.get('user_id')
 
 
-# Route pour servir le logo N.svg
-@app.route('/N.svg')
-def serve_logo():
-    return send_file('N.svg', mimetype='image/svg+xml')
+PROFILE_FIELDS = ('id', 'username', 'email', 'created_at')
+
+
+def remember_profile(user):
+    """Copie le profil dans la session: le cookie est signé (SECRET_KEY), le client ne peut pas le modifier"""
+    if current_app.config['USER_SNAPSHOT_TTL'] > 0:
+        session['profile'] = {**{field: user.get(field) for field in PROFILE_FIELDS}, 'saved_at': time.time()}
+
+
+def get_session_profile():
+    """Profil de la session s'il correspond à l'utilisateur connecté et n'a pas expiré"""
+    profile = session.get('profile')
+    if not profile or profile.get('id') != session.get('user_id'):
+        return None
+    if time.time() - profile.get('saved_at', 0) > current_app.config['USER_SNAPSHOT_TTL']:
+        return None
+    return {field: profile.get(field) for field in PROFILE_FIELDS}
+
+
+def get_page_limit(default, maximum=100):
+    """Taille de page demandée (?limit=), bornée pour garder un coût de lecture constant"""
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, maximum))
+
+
+def revalidated(response, etag=None):
+    """
+    Réponse revalidée à chaque affichage (no-cache) avec un ETag donné ou calculé sur son contenu:
+    un navigateur dont la copie est à jour reçoit 304 Not Modified, sans corps
+    """
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if etag:
+        response.set_etag(etag)
+    else:
+        response.add_etag()
+    return response.make_conditional(request)
+
+
+def first_page_etag(collection, user_id, limit):
+    """
+    ETag de la première page d'une collection, tiré de la version partagée (db.page_version):
+    None pour les pages suivantes ou si la version est indisponible
+    """
+    if request.args.get('cursor'):
+        return None
+    version = db.page_version(collection, user_id)
+    return f'{collection}-{version}-{limit}' if version else None
+
+
+def not_modified(etag):
+    """304 si la copie du navigateur porte déjà cet ETag (à tester avant de lire la page), sinon None"""
+    # Comparaison faible: compress_response rend l'ETag faible (W/"...") dès que la page est compressée
+    if not etag or not request.if_none_match.contains_weak(etag):
+        return None
+    response = make_response('', 304)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(etag)
+    return response
+
+
+def get_quota_owner():
+    """Identifiant utilisé pour les quotas: l'utilisateur connecté, sinon l'adresse IP"""
+    user_id = get_current_user_id()
+    return f"user:{user_id}" if user_id else f"ip:{request.remote_addr}"
+
+
+def rate_limited(*limits, cost=None, metered=False):
+    """
+    Décorateur: la requête consomme cost() jetons (1 par défaut) et une place en cours dans
+    chaque classe de limits (ratelimit.RATE_LIMITS), sinon 429 avec Retry-After.
+    La place est rendue quand la réponse est entièrement envoyée (flux compris).
+    metered: endpoint OpenAI à réponse non différée; servi sans appel facturé (cache de résultats,
+    ou calcul identique déjà en cours, précalcul compris), il rend ses jetons.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            limiter = current_app.extensions['nectar'].rate_limiter
+            if limiter is None:
+                return f(*args, **kwargs)
+            owner, tokens = get_quota_owner(), cost() if cost else 1
+            ticket, retry_after = limiter.acquire(limits, owner, tokens)
+            if ticket is None:
+                return too_many_requests(retry_after)
+            try:
+                if metered:
+                    from ai_processor import Summarizer
+                    with Summarizer.tokens_used() as used:
+                        response = make_response(f(*args, **kwargs))
+                    if not used[0]:
+                        limiter.refund(limits, owner, tokens)
+                else:
+                    response = make_response(f(*args, **kwargs))
+            except BaseException:
+                limiter.release(ticket)
+                raise
+            response.call_on_close(lambda: limiter.release(ticket))
+            return response
+        return decorated_function
+    return decorator
+
+
+def too_many_requests(retry_after):
+    """Réponse 429, avec Retry-After en secondes entières"""
+    seconds = ratelimit.retry_after_seconds(retry_after)
+    response = jsonify({'error': f'Trop de requêtes. Réessayez dans {seconds} s.',
+                        'success': False, 'retry_after': seconds})
+    response.headers['Retry-After'] = str(seconds)
+    return response, 429
+
+
+def reserve_llm(calls, workers):
+    """
+    Pour les endpoints qui font plusieurs appels OpenAI en parallèle, une fois leur nombre connu:
+    réserve un jeton llm par appel et une place en cours par thread, threads bornés au plafond
+    de la classe. Retourne (ticket, threads accordés, None), sinon (None, 0, réponse 429).
+    Le ticket est à rendre avec release_llm.
+    """
+    limiter = current_app.extensions['nectar'].rate_limiter
+    if limiter is None:
+        return [], workers, None
+    workers = limiter.slots_for('llm', workers)
+    ticket, retry_after = limiter.acquire(['llm'], get_quota_owner(), calls, slots=workers)
+    if ticket is None:
+        return None, 0, too_many_requests(retry_after)
+    return ticket, workers, None
+
+
+def release_llm(ticket, response=None):
+    """Rend les places réservées par reserve_llm: tout de suite, ou une fois response envoyée"""
+    limiter = current_app.extensions['nectar'].rate_limiter
+    if limiter is None:
+        return response
+    if response is None:
+        limiter.release(ticket)
+        return None
+    response.call_on_close(lambda: limiter.release(ticket))
+    return response
+
+
+@bp.route('/health')
+def health():
+    """Vérification de disponibilité: ne touche ni Firestore ni OpenAI"""
+    return jsonify({'status': 'ok'})
+
+
+# ==================== MÉTRIQUES ====================
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    """Expose les métriques au format Prometheus (agrégées sur tous les workers gunicorn)"""
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Non autorisé'}), 401
+    payload, content_type = metrics.render_latest()
+    return Response(payload, content_type=content_type)
 
 
 # ==================== AUTHENTIFICATION ====================
 
-@app.route('/auth/register', methods=['POST'])
+@bp.route('/auth/register', methods=['POST'])
 def register():
     """Inscription d'un nouvel utilisateur"""
     try:
@@ -92,7 +519,7 @@ def register():
         return jsonify({'error': str(e), 'success': False}), 500
 
 
-@app.route('/auth/login', methods=['POST'])
+@bp.route('/auth/login', methods=['POST'])
 def login():
     """Connexion d'un utilisateur"""
     try:
@@ -109,6 +536,7 @@ def login():
         if result['success']:
             session['user_id'] = result['user']['id']
             session['username'] = result['user']['username']
+            remember_profile(result['user'])
             return jsonify({
                 'success': True,
                 'message': 'Connexion réussie',
@@ -121,18 +549,22 @@ def login():
         return jsonify({'error': str(e), 'success': False}), 500
 
 
-@app.route('/auth/logout', methods=['POST'])
+@bp.route('/auth/logout', methods=['POST'])
 def logout():
     """Déconnexion"""
     session.clear()
     return jsonify({'success': True, 'message': 'Déconnexion réussie'})
 
 
-@app.route('/auth/me', methods=['GET'])
+@bp.route('/auth/me', methods=['GET'])
 def get_current_user():
-    """Récupère l'utilisateur actuellement connecté"""
+    """Récupère l'utilisateur connecté: profil de la session, sinon cache des profils (database)"""
     if 'user_id' in session:
-        user = db.get_user_by_id(session['user_id'])
+        user = get_session_profile()
+        if user is None:
+            user = db.get_user_by_id(session['user_id'])
+            if user:
+                remember_profile(user)
         if user:
             return jsonify({'success': True, 'user': user, 'logged_in': True})
     return jsonify({'success': True, 'user': None, 'logged_in': False})
@@ -140,36 +572,37 @@ def get_current_user():
 
 # ==================== PAGES ====================
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
 
-@app.route('/login')
+@bp.route('/login')
 def login_page():
     return render_template('login.html')
 
 
-@app.route('/history')
+@bp.route('/history')
 def history_page():
     return render_template('history.html')
 
 
-@app.route('/statistics')
+@bp.route('/statistics')
 def statistics_page():
     return render_template('statistics.html')
 
 
-@app.route('/documentation')
+@bp.route('/documentation')
 def documentation():
     return render_template('documentation.html')
 
 
 # ==================== UPLOAD ====================
 
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
+@rate_limited('upload')
 def upload_file():
-    global current_filename
+    workdir = None
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'Aucun fichier fourni'}), 400
@@ -182,32 +615,179 @@ def upload_file():
         if not allowed_file(file.filename):
             return jsonify({'error': 'Type de fichier non autorisé'}), 400
         
+        target_words = upload_target_words(request.form.get('target_words', 150))
+        if target_words is None:
+            return jsonify({'error': TARGET_WORDS_ERROR}), 400
+        
         filename = secure_filename(file.filename)
-        current_filename = filename
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        # Un répertoire par requête: deux envois simultanés du même nom ne s'écrasent pas
+        workdir = tempfile.mkdtemp(prefix='upload-', dir=current_app.config['UPLOAD_FOLDER'])
+        filepath = os.path.join(workdir, filename)
         file.save(filepath)
         
-        text = doc_processor.extract_text(filepath)
-        stats = doc_processor.get_text_stats(text)
-        
-        os.remove(filepath)
-        
-        return jsonify({
-            'success': True,
-            'text': text,
-            'stats': stats,
-            'filename': filename
-        })
+        return extracted_document(
+            filepath,
+            filename,
+            precompute=request.form.get('precompute') == '1',
+            target_words=target_words,
+            style=request.form.get('style', 'paragraph')
+        )
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+TARGET_WORDS_ERROR = 'target_words doit être un entier entre 1 et 1000'
+
+
+def upload_target_words(value):
+    """Longueur de résumé demandée pour le précalcul d'un upload (formulaire ou JSON): entier de 1 à 1000, sinon None"""
+    try:
+        target_words = int(value)
+    except (TypeError, ValueError):
+        return None
+    return target_words if 0 < target_words <= 1000 else None
+
+
+def extracted_document(filepath, filename, precompute=False, target_words=150, style='paragraph'):
+    """Texte, statistiques et plan d'un document reçu (upload simple ou par morceaux)"""
+    # Nom du document courant, repris par /summarize: propre à l'utilisateur (session), pas au worker
+    session['filename'] = filename
+    
+    # Texte et plan en une seule lecture du fichier
+    text, outline = doc_processor.extract_document(filepath)
+    stats = doc_processor.get_text_stats(text)
+    
+    # Précalcul spéculatif des étapes suivantes (résumé, analyses) si demandé
+    precompute_id = None
+    if current_app.config['PRECOMPUTE_ENABLED'] and precompute:
+        precompute_id = current_app.extensions['nectar'].precomputer.schedule(
+            get_quota_owner(),
+            get_ai_processor(),
+            text,
+            target_words=target_words,
+            style=style
+        )
+    
+    return jsonify({
+        'success': True,
+        'text': text,
+        'stats': stats,
+        'outline': outline,
+        'filename': filename,
+        'precompute_id': precompute_id
+    })
+
+
+# ==================== UPLOAD PAR MORCEAUX ====================
+# Documents au-delà de MAX_CONTENT_LENGTH: POST /upload/init, PUT /upload/<id>/chunk par morceau
+# (en-têtes Upload-Offset et X-Chunk-SHA256), GET /upload/<id> pour reprendre après une coupure,
+# puis POST /upload/<id>/finalize qui extrait le texte comme /upload
+
+def upload_error(error):
+    """Réponse JSON d'une UploadError, avec la position où reprendre si elle est connue"""
+    body = {'error': str(error), 'success': False}
+    if error.offset is not None:
+        body['offset'] = error.offset
+    return jsonify(body), error.status
+
+
+@bp.route('/upload/init', methods=['POST'])
+@rate_limited('upload')
+def init_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Type de fichier non autorisé', 'success': False}), 400
+    try:
+        size = int(data.get('size') or 0)
+        upload = current_app.extensions['nectar'].chunked_uploads.start(
+            get_quota_owner(), filename, size, (data.get('sha256') or '').lower() or None
+        )
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Taille invalide', 'success': False}), 400
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True, **upload}), 201
+
+
+@bp.route('/upload/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Position validée de l'upload: le client reprend l'envoi à partir de là"""
+    try:
+        upload = current_app.extensions['nectar'].chunked_uploads.status(upload_id)
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True, **upload})
+
+
+@bp.route('/upload/<upload_id>/chunk', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Corps brut du morceau, écrit par blocs sans le garder en mémoire"""
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'En-tête Upload-Offset manquant', 'success': False}), 400
+    try:
+        offset = current_app.extensions['nectar'].chunked_uploads.append(
+            upload_id, offset, request.stream, request.headers.get('X-Chunk-SHA256', '').lower()
+        )
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True, 'offset': offset})
+
+
+@bp.route('/upload/<upload_id>/finalize', methods=['POST'])
+@rate_limited('upload')
+def finalize_chunked_upload(upload_id):
+    data = request.get_json(silent=True) or {}
+    # Validé avant la finalisation: une requête refusée peut être renvoyée, l'upload reste entier
+    target_words = upload_target_words(data.get('target_words', 150))
+    if target_words is None:
+        return jsonify({'error': TARGET_WORDS_ERROR}), 400
+    workdir = tempfile.mkdtemp(prefix='upload-', dir=current_app.config['UPLOAD_FOLDER'])
+    try:
+        filepath, filename = current_app.extensions['nectar'].chunked_uploads.finish(upload_id, workdir)
+        return extracted_document(
+            filepath,
+            filename,
+            precompute=data.get('precompute') in (True, '1'),
+            target_words=target_words,
+            style=data.get('style', 'paragraph')
+        )
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@bp.route('/upload/<upload_id>', methods=['DELETE'])
+def cancel_chunked_upload(upload_id):
+    try:
+        current_app.extensions['nectar'].chunked_uploads.discard(upload_id)
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True})
+
+
+@bp.route('/precompute/<job_id>/cancel', methods=['POST'])
+def cancel_precompute(job_id):
+    """Annule un précalcul (appelé par navigator.sendBeacon quand l'utilisateur quitte la page)"""
+    if not current_app.config['PRECOMPUTE_ENABLED']:
+        return jsonify({'success': False}), 404
+    cancelled = current_app.extensions['nectar'].precomputer.cancel(job_id, get_quota_owner())
+    return jsonify({'success': cancelled})
 
 
 # ==================== RÉSUMÉ ====================
 
-@app.route('/summarize', methods=['POST'])
+@bp.route('/summarize', methods=['POST'])
+@rate_limited('llm', metered=True)
 def summarize_text():
-    global current_filename
     try:
         data = request.get_json()
         user_id = get_current_user_id()  # None si non connecté
@@ -218,9 +798,9 @@ def summarize_text():
         text = data['text']
         target_words = data.get('target_words', 100)
         style = data.get('style', 'paragraph')
-        filename = data.get('filename', current_filename or 'Sans titre')
+        filename = data.get('filename', session.get('filename') or 'Sans titre')
         
-        result = ai_processor.summarize(text, target_words, style)
+        result = get_ai_processor().summarize(text, target_words, style)
         summary_stats = doc_processor.get_text_stats(result['summary'])
         
         # Sauvegarder dans la base de données SEULEMENT si connecté
@@ -236,7 +816,8 @@ def summarize_text():
                 target_words=target_words,
                 style=style,
                 method=result['method'],
-                model=result['model']
+                model=result['model'],
+                batch=get_history_writer()
             )
         
         return jsonify({
@@ -253,9 +834,109 @@ def summarize_text():
         return jsonify({'error': str(e)}), 500
 
 
+# ==================== TRAITEMENT PAR LOT ====================
+
+@bp.route('/batch', methods=['POST'])
+# Un jeton upload par fichier envoyé; les appels OpenAI sont comptés après l'ouverture des archives
+@rate_limited('upload', cost=lambda: len(request.files.getlist('files') + request.files.getlist('file')))
+def batch_process():
+    """
+    Traite plusieurs documents (fichiers multiples et/ou archives zip) en pipeline.
+    Réponse NDJSON: une ligne par document dès qu'il est prêt, puis une ligne de bilan.
+    """
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    if not uploads:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
+    
+    user_id = get_current_user_id()  # None si non connecté
+    target_words = request.form.get('target_words', 100, type=int)
+    style = request.form.get('style', 'paragraph')
+    keyword_count = request.form.get('keyword_count', 10, type=int)
+    
+    processor = BatchProcessor(
+        doc_processor,
+        get_ai_processor(),
+        current_app.config['ALLOWED_EXTENSIONS'],
+        ai_workers=current_app.config['BATCH_AI_WORKERS'],
+        max_files=current_app.config['BATCH_MAX_FILES']
+    )
+    
+    # Les fichiers doivent être écrits sur disque avant la fin de la requête
+    workdir = tempfile.mkdtemp(prefix='batch-', dir=current_app.config['UPLOAD_FOLDER'])
+    try:
+        items = processor.collect_files(uploads, workdir)
+    except Exception as e:
+        shutil.rmtree(workdir, ignore_errors=True)
+        return jsonify({'error': str(e)}), 500
+    
+    # Appels OpenAI facturés par document extrait (une archive en contient jusqu'à BATCH_MAX_FILES),
+    # threads d'analyse comptés dans les requêtes llm en cours
+    documents = sum(1 for item in items if 'path' in item)
+    ticket, processor.ai_workers, refused = reserve_llm(
+        documents * BatchProcessor.CALLS_PER_DOCUMENT, processor.ai_workers
+    )
+    if refused:
+        shutil.rmtree(workdir, ignore_errors=True)
+        return refused
+    
+    def generate():
+        succeeded = 0
+        # Résumés mis dans le lot mais pas encore validés: leur ID n'est envoyé qu'après l'écriture,
+        # dans une ligne 'saved' ({index du document: summary_id})
+        unsaved = {}
+        saved = False
+        try:
+            # Sauvegarde SEULEMENT si connecté, par lots de 20 résumés
+            with db.BatchWriter(size=20) as writer:
+                for result in processor.run(items, target_words, style, keyword_count):
+                    text = result.pop('text', None)
+                    written = writer.written
+                    if result['success']:
+                        succeeded += 1
+                        if user_id:
+                            unsaved[result['index']] = db.save_summary(
+                                user_id=user_id,
+                                filename=result['filename'],
+                                original_text=text,
+                                summary=result['summary'],
+                                original_words=result['stats']['word_count'],
+                                summary_words=result['summary_stats']['word_count'],
+                                target_words=target_words,
+                                style=style,
+                                method=result['method'],
+                                model=result['model'],
+                                batch=writer
+                            )
+                    yield json.dumps({'type': 'result', **result}, ensure_ascii=False) + '\n'
+                    # Un flush valide tout ce qui était en attente, y compris les lots retentés
+                    if writer.written > written and unsaved:
+                        yield json.dumps({'type': 'saved', 'summary_ids': unsaved}) + '\n'
+                        unsaved = {}
+            # Reliquat validé à la sortie du bloc
+            if unsaved:
+                yield json.dumps({'type': 'saved', 'summary_ids': unsaved}) + '\n'
+            saved = user_id is not None
+        except Exception as e:
+            yield json.dumps({'type': 'error', 'error': str(e)}, ensure_ascii=False) + '\n'
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        
+        yield json.dumps({
+            'type': 'done',
+            'total': len(items),
+            'succeeded': succeeded,
+            'failed': len(items) - succeeded,
+            'saved': saved
+        }) + '\n'
+    
+    return release_llm(ticket, Response(generate(), mimetype='application/x-ndjson',
+                                        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'}))
+
+
 # ==================== TRADUCTION ====================
 
-@app.route('/translate', methods=['POST'])
+@bp.route('/translate', methods=['POST'])
+@rate_limited('llm', metered=True)
 def translate_text():
     try:
         data = request.get_json()
@@ -267,11 +948,11 @@ def translate_text():
         text = data['text']
         target_language = data.get('target_language', 'en')
         
-        result = ai_processor.translate(text, target_language)
+        result = get_ai_processor().translate(text, target_language)
         
         # Sauvegarder la traduction SEULEMENT si connecté
         if result.get('success') and user_id:
-            db.save_translation(user_id, text, result['translation'], target_language)
+            db.save_translation(user_id, text, result['translation'], target_language, batch=get_history_writer())
         
         return jsonify(result)
         
@@ -281,7 +962,8 @@ def translate_text():
 
 # ==================== MOTS-CLÉS ====================
 
-@app.route('/keywords', methods=['POST'])
+@bp.route('/keywords', methods=['POST'])
+@rate_limited('llm', metered=True)
 def extract_keywords():
     try:
         data = request.get_json()
@@ -293,11 +975,11 @@ def extract_keywords():
         text = data['text']
         count = data.get('count', 10)
         
-        result = ai_processor.extract_keywords(text, count)
+        result = get_ai_processor().extract_keywords(text, count)
         
         # Sauvegarder l'analyse SEULEMENT si connecté
         if result.get('success') and user_id:
-            db.save_analysis(user_id, 'keywords', text, result)
+            db.save_analysis(user_id, 'keywords', text, result, batch=get_history_writer())
         
         return jsonify(result)
         
@@ -307,7 +989,8 @@ def extract_keywords():
 
 # ==================== SENTIMENT ====================
 
-@app.route('/sentiment', methods=['POST'])
+@bp.route('/sentiment', methods=['POST'])
+@rate_limited('llm', metered=True)
 def analyze_sentiment():
     try:
         data = request.get_json()
@@ -317,11 +1000,11 @@ def analyze_sentiment():
             return jsonify({'error': 'Texte manquant'}), 400
         
         text = data['text']
-        result = ai_processor.analyze_sentiment(text)
+        result = get_ai_processor().analyze_sentiment(text)
         
         # Sauvegarder l'analyse SEULEMENT si connecté
         if result.get('success') and user_id:
-            db.save_analysis(user_id, 'sentiment', text, result)
+            db.save_analysis(user_id, 'sentiment', text, result, batch=get_history_writer())
         
         return jsonify(result)
         
@@ -331,7 +1014,8 @@ def analyze_sentiment():
 
 # ==================== TITRES ====================
 
-@app.route('/generate-title', methods=['POST'])
+@bp.route('/generate-title', methods=['POST'])
+@rate_limited('llm', metered=True)
 def generate_title():
     try:
         data = request.get_json()
@@ -343,11 +1027,11 @@ def generate_title():
         text = data['text']
         count = data.get('count', 3)
         
-        result = ai_processor.generate_title(text, count)
+        result = get_ai_processor().generate_title(text, count)
         
         # Sauvegarder l'analyse SEULEMENT si connecté
         if result.get('success') and user_id:
-            db.save_analysis(user_id, 'titles', text, result)
+            db.save_analysis(user_id, 'titles', text, result, batch=get_history_writer())
         
         return jsonify(result)
         
@@ -357,7 +1041,8 @@ def generate_title():
 
 # ==================== Q&A ====================
 
-@app.route('/ask', methods=['POST'])
+@bp.route('/ask', methods=['POST'])
+@rate_limited('llm', metered=True)
 def ask_question():
     try:
         data = request.get_json()
@@ -369,11 +1054,11 @@ def ask_question():
         text = data['text']
         question = data['question']
         
-        result = ai_processor.answer_question(text, question)
+        result = get_ai_processor().answer_question(text, question)
         
         # Sauvegarder la Q&A SEULEMENT si connecté
         if result.get('success') and user_id:
-            db.save_qa(user_id, text, question, result['answer'])
+            db.save_qa(user_id, text, question, result['answer'], batch=get_history_writer())
         
         return jsonify(result)
         
@@ -383,7 +1068,7 @@ def ask_question():
 
 # ==================== RÉSUMÉ PAR SECTIONS ====================
 
-@app.route('/summarize-sections', methods=['POST'])
+@bp.route('/summarize-sections', methods=['POST'])
 def summarize_sections():
     try:
         data = request.get_json()
@@ -393,8 +1078,21 @@ def summarize_sections():
         
         text = data['text']
         words_per_section = data.get('words_per_section', 50)
-        
-        result = ai_processor.summarize_by_sections(text, words_per_section)
+        # Longueur visée par section: entier positif (max_tokens de chaque appel en dépend)
+        if type(words_per_section) is not int or not 0 < words_per_section <= 1000:
+            return jsonify({'error': 'words_per_section doit être un entier entre 1 et 1000', 'success': False}), 400
+        outline = data.get('outline')  # Plan renvoyé par /upload (titres DOCX/PDF)
+        
+        # Un appel OpenAI par section, SECTION_WORKERS à la fois: découpage fait avant la réservation
+        sections = doc_processor.split_sections(text, outline)
+        ticket, workers, refused = reserve_llm(max(len(sections), 1), get_ai_processor().SECTION_WORKERS)
+        if refused:
+            return refused
+        try:
+            result = get_ai_processor().summarize_by_sections(text, words_per_section, sections=sections,
+                                                              workers=workers)
+        finally:
+            release_llm(ticket)
         return jsonify(result)
         
     except Exception as e:
@@ -403,7 +1101,8 @@ def summarize_sections():
 
 # ==================== NUAGE DE MOTS ====================
 
-@app.route('/wordcloud', methods=['POST'])
+@bp.route('/wordcloud', methods=['POST'])
+@rate_limited('analytics')
 def get_wordcloud():
     try:
         data = request.get_json()
@@ -414,7 +1113,7 @@ def get_wordcloud():
         text = data['text']
         max_words = data.get('max_words', 50)
         
-        result = ai_processor.get_word_cloud_data(text, max_words)
+        result = get_ai_processor().get_word_cloud_data(text, max_words)
         return jsonify(result)
         
     except Exception as e:
@@ -423,7 +1122,8 @@ def get_wordcloud():
 
 # ==================== STATISTIQUES AVANCÉES ====================
 
-@app.route('/advanced-stats', methods=['POST'])
+@bp.route('/advanced-stats', methods=['POST'])
+@rate_limited('analytics')
 def get_advanced_stats():
     try:
         data = request.get_json()
@@ -432,7 +1132,7 @@ def get_advanced_stats():
             return jsonify({'error': 'Texte manquant'}), 400
         
         text = data['text']
-        result = ai_processor.get_advanced_stats(text)
+        result = get_ai_processor().get_advanced_stats(text)
         return jsonify(result)
         
     except Exception as e:
@@ -441,16 +1141,24 @@ def get_advanced_stats():
 
 # ==================== HISTORIQUE ====================
 
-@app.route('/api/history', methods=['GET'])
+@bp.route('/api/history', methods=['GET'])
 def get_history():
-    """Récupère l'historique des résumés de l'utilisateur"""
+    """Récupère l'historique des résumés de l'utilisateur (première page en cache, ETag)"""
     try:
         user_id = get_current_user_id()
         if not user_id:
-            return jsonify({'history': [], 'success': True})
-        summaries = db.get_summaries(user_id, limit=20)
-        print(f"Historique récupéré pour user {user_id}: {len(summaries)} résumés")
-        return jsonify({'history': summaries, 'success': True})
+            return jsonify({'history': [], 'next_cursor': None, 'success': True})
+        limit = get_page_limit(20)
+        # Version lue avant la page: un ETag ne peut désigner un contenu plus ancien que le sien
+        etag = first_page_etag('summaries', user_id, limit)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        page = db.get_summaries(user_id, limit=limit, cursor=request.args.get('cursor'))
+        return revalidated(jsonify({'history': page['items'], 'next_cursor': page['next_cursor'], 'success': True}),
+                           etag)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
     except Exception as e:
         print(f"Erreur get_history: {e}")
         import traceback
@@ -458,7 +1166,45 @@ def get_history():
         return jsonify({'error': str(e), 'success': False}), 500
 
 
-@app.route('/api/history/<summary_id>', methods=['GET'])
+@bp.route('/api/history/search', methods=['GET'])
+def search_history():
+    """Recherche classée dans l'historique (?q=, ?type=summaries|analyses|qa_history, répétable)"""
+    try:
+        user_id = get_current_user_id()
+        if not user_id:
+            return jsonify({'error': 'Non connecté', 'success': False}), 401
+        query = request.args.get('q', '').strip()
+        collections = [name for name in request.args.getlist('type') if name in db.SEARCH_COLLECTIONS] or None
+        result = db.search_history(user_id, query, collections=collections, limit=get_page_limit(20, maximum=50))
+        return jsonify({'results': result['items'], 'query': query, 'success': True})
+    except Exception as e:
+        print(f"Erreur search_history: {e}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+
+@bp.route('/api/history/export', methods=['GET'])
+def export_history():
+    """
+    Export complet de l'historique en flux (?format=ndjson|csv|zip, ?type= répétable).
+    Chaque document exporté porte un curseur: ?cursor= reprend l'export juste après lui.
+    """
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Non connecté', 'success': False}), 401
+    try:
+        export = HistoryExport(user_id, request.args.get('format', 'ndjson'),
+                               request.args.getlist('type') or None, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
+    
+    return Response(export.stream(), mimetype=export.mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{export.filename}"',
+        'X-Accel-Buffering': 'no',
+        'Cache-Control': 'no-cache'
+    })
+
+
+@bp.route('/api/history/<summary_id>', methods=['GET'])
 def get_history_item(summary_id):
     """Récupère un résumé spécifique"""
     try:
@@ -473,7 +1219,7 @@ def get_history_item(summary_id):
         return jsonify({'error': str(e), 'success': False}), 500
 
 
-@app.route('/api/history/<summary_id>', methods=['DELETE'])
+@bp.route('/api/history/<summary_id>', methods=['DELETE'])
 def delete_history_item(summary_id):
     """Supprime un résumé de l'historique"""
     try:
@@ -487,32 +1233,71 @@ def delete_history_item(summary_id):
         return jsonify({'error': str(e), 'success': False}), 500
 
 
-@app.route('/api/history/clear', methods=['POST'])
+@bp.route('/api/history/clear', methods=['POST'])
 def clear_history():
-    """Efface tout l'historique de l'utilisateur"""
+    """
+    Efface tout l'historique de l'utilisateur.
+    Les petits historiques sont effacés immédiatement; au-delà de CLEAR_SYNC_LIMIT documents,
+    un job d'arrière-plan est lancé (202) et sa progression se suit via GET /api/history/clear.
+    """
     try:
         user_id = get_current_user_id()
-        db.clear_all_history(user_id)
-        return jsonify({'success': True})
+        if not user_id:
+            return jsonify({'error': 'Non connecté', 'success': False}), 401
+        cleaner = current_app.extensions['nectar'].history_cleaner
+        
+        job = cleaner.status(user_id)
+        if job and job.get('status') == 'running':
+            return jsonify({'success': True, 'job': job}), 202
+        
+        counts = db.count_history(user_id)
+        if counts is None:
+            return jsonify({'error': "Impossible de compter l'historique", 'success': False}), 500
+        
+        if sum(counts.values()) > current_app.config['CLEAR_SYNC_LIMIT']:
+            return jsonify({'success': True, 'job': cleaner.start(user_id, counts)}), 202
+        
+        deleted = db.clear_all_history(user_id)
+        if deleted is None:
+            return jsonify({'error': "Échec de l'effacement", 'success': False}), 500
+        return jsonify({'success': True, 'deleted': sum(deleted.values())})
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
 
 
+@bp.route('/api/history/clear', methods=['GET'])
+def clear_history_status():
+    """Progression de l'effacement en arrière-plan"""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Non connecté', 'success': False}), 401
+    job = current_app.extensions['nectar'].history_cleaner.status(user_id)
+    return jsonify({'success': True, 'job': job})
+
+
 # ==================== FAVORIS ====================
 
-@app.route('/favorites', methods=['GET'])
+@bp.route('/favorites', methods=['GET'])
 @login_required
 def get_favorites():
     """Récupère les favoris de l'utilisateur"""
     try:
         user_id = get_current_user_id()
-        favorites = db.get_favorites(user_id)
-        return jsonify({'favorites': favorites, 'success': True})
+        limit = get_page_limit(50)
+        etag = first_page_etag('favorites', user_id, limit)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        page = db.get_favorites(user_id, limit=limit, cursor=request.args.get('cursor'))
+        return revalidated(jsonify({'favorites': page['items'], 'next_cursor': page['next_cursor'], 'success': True}),
+                           etag)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
 
 
-@app.route('/favorites', methods=['POST'])
+@bp.route('/favorites', methods=['POST'])
 @login_required
 def add_favorite():
     """Ajoute un favori"""
@@ -529,7 +1314,7 @@ def add_favorite():
         return jsonify({'error': str(e), 'success': False}), 500
 
 
-@app.route('/favorites/<int:favorite_id>', methods=['DELETE'])
+@bp.route('/favorites/<int:favorite_id>', methods=['DELETE'])
 @login_required
 def delete_favorite(favorite_id):
     """Supprime un favori"""
@@ -544,7 +1329,7 @@ def delete_favorite(favorite_id):
 
 # ==================== STATISTIQUES GLOBALES ====================
 
-@app.route('/stats', methods=['GET'])
+@bp.route('/stats', methods=['GET'])
 @login_required
 def get_global_stats():
     """Récupère les statistiques d'utilisation de l'utilisateur"""
@@ -556,23 +1341,65 @@ def get_global_stats():
         return jsonify({'error': str(e), 'success': False}), 500
 
 
+def parse_date_arg(name):
+    """Date AAAA-MM-JJ du paramètre de requête name (None si absent, ValueError si invalide)"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Date invalide pour {name}: {value} (attendu AAAA-MM-JJ)")
+
+
+@bp.route('/api/stats/timeseries', methods=['GET'])
+@login_required
+def get_stats_timeseries():
+    """
+    Séries d'usage lues en une fois dans les statistiques par jour (?granularity=day|month).
+    ?from= et ?to= (AAAA-MM-JJ): par défaut les 30 derniers jours, ou depuis la première activité en month.
+    """
+    try:
+        user_id = get_current_user_id()
+        granularity = request.args.get('granularity', 'day')
+        end = parse_date_arg('to') or date.today()
+        start = parse_date_arg('from')
+        if start is None and granularity == 'day':
+            start = end - timedelta(days=29)
+        start = start.isoformat() if start else None
+        
+        rollups = db.get_rollups(user_id, start, end.isoformat())
+        if rollups is None:
+            return jsonify({'error': 'Statistiques indisponibles', 'success': False}), 500
+        series = db.rollup_series(rollups, start, end.isoformat(), granularity)
+        return jsonify({'series': series, 'success': True})
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
+    except Exception as e:
+        print(f"Erreur get_stats_timeseries: {e}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+
 # ==================== Q&A HISTORY ====================
 
-@app.route('/qa-history', methods=['GET'])
+@bp.route('/qa-history', methods=['GET'])
 @login_required
 def get_qa_history():
     """Récupère l'historique des Q&A de l'utilisateur"""
     try:
         user_id = get_current_user_id()
-        qa_list = db.get_qa_history(user_id)
-        return jsonify({'history': qa_list, 'success': True})
+        page = db.get_qa_history(user_id, limit=get_page_limit(20), cursor=request.args.get('cursor'))
+        return jsonify({'history': page['items'], 'next_cursor': page['next_cursor'], 'success': True})
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
 
 
 # ==================== EXPORT ====================
 
-@app.route('/export-pdf', methods=['POST'])
+@bp.route('/export-pdf', methods=['POST'])
+@rate_limited('analytics')
 def export_pdf():
     # Pour l'export PDF, on retourne un HTML formaté que le front peut imprimer
     try:
@@ -606,5 +1433,8 @@ def export_pdf():
         return jsonify({'error': str(e), 'success': False}), 500
 
 
+app = create_app()
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
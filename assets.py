@@ -0,0 +1,161 @@
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import Blueprint, abort, current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli facultatif: réponses en gzip seulement
+    brotli = None
+
+# Compression des réponses (gzip, brotli) et ressources statiques versionnées par empreinte
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Réponses dynamiques compressées à partir de cette taille (en dessous, le gain ne couvre pas l'en-tête)
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESSIBLE_TYPES = frozenset({
+    'application/json', 'application/javascript', 'text/javascript', 'text/css', 'text/html',
+    'text/plain', 'text/csv', 'image/svg+xml',
+})
+
+# Niveaux rapides pour les réponses calculées à chaque requête, maximaux pour les ressources
+# statiques (compressées une seule fois par worker)
+DYNAMIC_LEVELS = {'br': 4, 'gzip': 6}
+STATIC_LEVELS = {'br': 11, 'gzip': 9}
+
+# Ressources versionnées: nom public -> fichier servi (les logos dans leur variante allégée,
+# voir scripts/optimize_logos.py)
+ASSETS = {
+    'style.css': 'static/style.css',
+    'script.js': 'static/script.js',
+    'N.svg': 'N.min.svg',
+    'N_blanc.svg': 'N_blanc.min.svg',
+    'N_noire.svg': 'N_noire.min.svg',
+}
+MIMETYPES = {'.css': 'text/css', '.js': 'text/javascript', '.svg': 'image/svg+xml'}
+
+# URL versionnée: le contenu ne change jamais, le navigateur la garde un an sans revalider
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# URL fixe (/N.svg...): gardée un jour, puis revalidée par ETag
+REVALIDATE = 'public, max-age=86400'
+
+bp = Blueprint('assets', __name__)
+
+
+def encodings():
+    """Encodages proposés par le client, du préféré au moins préféré (br avant gzip à qualité égale)"""
+    offered = [name for name in ('br', 'gzip') if name != 'br' or brotli is not None]
+    accepted = [(request.accept_encodings.quality(name), -rank, name) for rank, name in enumerate(offered)]
+    return [name for quality, _, name in sorted(accepted, reverse=True) if quality > 0]
+
+
+def compress(data, encoding, levels=DYNAMIC_LEVELS):
+    if encoding == 'br':
+        return brotli.compress(data, quality=levels['br'])
+    return gzip.compress(data, compresslevel=levels['gzip'], mtime=0)
+
+
+def compress_response(response):
+    """
+    Compresse une réponse texte/JSON (after_request) selon Accept-Encoding. Les réponses en flux
+    (export, lots), déjà encodées ou envoyées par fichier ne sont pas modifiées.
+    """
+    response.vary.add('Accept-Encoding')
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    accepted = encodings()
+    if not accepted:
+        return response
+
+    response.set_data(compress(data, accepted[0]))
+    response.headers['Content-Encoding'] = accepted[0]
+    # L'ETag désigne le contenu non compressé: il devient faible (même ressource, autre encodage)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# ==================== RESSOURCES STATIQUES ====================
+
+class Asset:
+    """Contenu d'une ressource, son empreinte et ses versions compressées (calculées à la demande)"""
+
+    def __init__(self, name, path):
+        with open(os.path.join(ROOT, path), 'rb') as source:
+            self.data = source.read()
+        self.digest = hashlib.sha256(self.data).hexdigest()[:12]
+        stem, extension = os.path.splitext(name)
+        self.filename = f'{stem}.{self.digest}{extension}'
+        self.mimetype = MIMETYPES[extension]
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        """Contenu dans cet encodage (None: identité), compressé une fois au niveau maximal"""
+        if encoding is None:
+            return self.data
+        with self._lock:
+            if encoding not in self._encoded:
+                self._encoded[encoding] = compress(self.data, encoding, STATIC_LEVELS)
+            return self._encoded[encoding]
+
+
+_assets = None
+_assets_lock = threading.Lock()
+
+
+def get_assets():
+    """Ressources lues au premier accès (empreintes recalculées à chaque démarrage du worker)"""
+    global _assets
+    if _assets is None:
+        with _assets_lock:
+            if _assets is None:
+                _assets = {name: Asset(name, path) for name, path in ASSETS.items()}
+    return _assets
+
+
+def asset_url(name):
+    """URL versionnée d'une ressource (fonction des templates): /assets/style.<empreinte>.css"""
+    return f"/assets/{get_assets()[name].filename}"
+
+
+def send_asset(asset, cache_control):
+    """Ressource dans l'encodage préféré du client, avec son ETag (par encodage) et 304 si inchangée"""
+    encoding = next((name for name in encodings() if len(asset.encoded(name)) < len(asset.data)), None)
+    response = current_app.response_class(asset.encoded(encoding), mimetype=asset.mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(asset.digest + (f'-{encoding}' if encoding else ''))
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+
+@bp.route('/assets/<filename>')
+def versioned_asset(filename):
+    """/assets/<nom>.<empreinte>.<ext>: une empreinte périmée (page en cache) reçoit le contenu actuel, non figé"""
+    parts = filename.split('.')
+    if len(parts) != 3:
+        abort(404)
+    asset = get_assets().get(f'{parts[0]}.{parts[2]}')
+    if asset is None:
+        abort(404)
+    return send_asset(asset, IMMUTABLE if parts[1] == asset.digest else 'no-cache')
+
+
+# Logos à URL fixe (favicons, liens externes), servis dans leur variante allégée
+@bp.route('/N.svg')
+@bp.route('/N_blanc.svg')
+@bp.route('/N_noire.svg')
+def logo():
+    return send_asset(get_assets()[request.path.lstrip('/')], REVALIDATE)
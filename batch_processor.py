@@ -0,0 +1,176 @@
+import os
+import queue
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+from werkzeug.utils import secure_filename
+
+# Taille des blocs copiés depuis une archive zip
+COPY_BLOCK = 1024 * 1024
+
+
+class BatchProcessor:
+    """
+    Pipeline d'ingestion en lot: extraction → statistiques → résumé → mots-clés.
+    L'extraction (CPU) et les appels OpenAI (réseau) ont chacun leur pool borné:
+    un document passe à l'étape IA dès que son texte est extrait, et chaque
+    résultat est rendu dès qu'il est prêt, dans l'ordre d'achèvement.
+    """
+
+    # Appels OpenAI par document (_analyze: résumé puis mots-clés)
+    CALLS_PER_DOCUMENT = 2
+
+    def __init__(self, doc_processor, summarizer, allowed_extensions,
+                 extract_workers: int = 2, ai_workers: int = 4,
+                 max_files: int = 50, max_unzipped_bytes: int = 200 * 1024 * 1024):
+        self.doc_processor = doc_processor
+        self.summarizer = summarizer
+        self.allowed_extensions = allowed_extensions
+        self.extract_workers = extract_workers
+        self.ai_workers = ai_workers
+        self.max_files = max_files
+        self.max_unzipped_bytes = max_unzipped_bytes
+
+    # ==================== COLLECTE DES FICHIERS ====================
+
+    def collect_files(self, uploads, workdir: str) -> List[Dict]:
+        """
+        Enregistre les fichiers envoyés (et le contenu des archives zip) dans workdir.
+        Retourne des {"filename", "path"} ou {"filename", "error"} pour les fichiers refusés.
+        """
+        items = []
+        for upload in uploads:
+            filename = secure_filename(upload.filename or '')
+            if not filename:
+                continue
+            if filename.lower().endswith('.zip'):
+                archive_path = os.path.join(workdir, f"archive-{len(items)}.zip")
+                upload.save(archive_path)
+                items.extend(self._expand_zip(archive_path, workdir, len(items)))
+            else:
+                items.append(self._store(filename, workdir, len(items), upload.save))
+            if len(items) >= self.max_files:
+                break
+        return items[:self.max_files]
+
+    def _expand_zip(self, archive_path: str, workdir: str, offset: int) -> List[Dict]:
+        """Extrait les documents d'une archive en bornant le nombre et la taille décompressée"""
+        items = []
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                budget = self.max_unzipped_bytes
+                for member in archive.infolist():
+                    if member.is_dir() or member.filename.startswith('__MACOSX/'):
+                        continue
+                    filename = secure_filename(os.path.basename(member.filename))
+                    if not filename:
+                        continue
+                    if member.file_size > budget:
+                        items.append({'filename': filename, 'error': 'Archive trop volumineuse une fois décompressée'})
+                        break
+                    budget -= member.file_size
+
+                    def save(path, member=member):
+                        # Copie par blocs, bornée à la taille déclarée (mémoire constante)
+                        with archive.open(member) as source, open(path, 'wb') as target:
+                            remaining = member.file_size
+                            while remaining:
+                                block = source.read(min(COPY_BLOCK, remaining))
+                                if not block:
+                                    break
+                                target.write(block)
+                                remaining -= len(block)
+
+                    items.append(self._store(filename, workdir, offset + len(items), save))
+                    if offset + len(items) >= self.max_files:
+                        break
+        except zipfile.BadZipFile:
+            items.append({'filename': os.path.basename(archive_path), 'error': 'Archive zip invalide'})
+        finally:
+            os.remove(archive_path)
+        return items
+
+    def _store(self, filename: str, workdir: str, index: int, save) -> Dict:
+        extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+        if extension not in self.allowed_extensions:
+            return {'filename': filename, 'error': 'Type de fichier non autorisé'}
+        # Préfixe d'index: deux fichiers de même nom ne s'écrasent pas
+        path = os.path.join(workdir, f"{index:04d}-{filename}")
+        save(path)
+        return {'filename': filename, 'path': path}
+
+    # ==================== PIPELINE ====================
+
+    def run(self, items: List[Dict], target_words: int = 100, style: str = 'paragraph',
+            keyword_count: int = 10) -> Iterator[Dict]:
+        """Traite les documents et produit un résultat par document dès qu'il est prêt"""
+        results = queue.Queue()
+        extract_pool = ThreadPoolExecutor(max_workers=self.extract_workers, thread_name_prefix='batch-extract')
+        ai_pool = ThreadPoolExecutor(max_workers=self.ai_workers, thread_name_prefix='batch-ai')
+
+        def on_extracted(index, item, future):
+            try:
+                text, stats = future.result()
+            except Exception as e:
+                results.put(self._error(index, item, f"Extraction impossible: {e}"))
+                return
+            try:
+                ai_future = ai_pool.submit(self._analyze, text, target_words, style, keyword_count)
+            except RuntimeError:
+                # Pool arrêté: le client s'est déconnecté
+                return
+            ai_future.add_done_callback(lambda f: results.put(self._result(index, item, text, stats, f)))
+
+        try:
+            for index, item in enumerate(items):
+                if 'error' in item:
+                    results.put(self._error(index, item, item['error']))
+                    continue
+                future = extract_pool.submit(self._extract, item['path'])
+                future.add_done_callback(lambda f, index=index, item=item: on_extracted(index, item, f))
+
+            for _ in range(len(items)):
+                yield results.get()
+        finally:
+            # Sur déconnexion du client, les documents non commencés sont abandonnés
+            extract_pool.shutdown(wait=False, cancel_futures=True)
+            ai_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _extract(self, path: str) -> Tuple[str, Dict]:
+        try:
+            text = self.doc_processor.extract_text(path)
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if not text or not text.strip():
+            raise ValueError("aucun texte trouvé")
+        return text, self.doc_processor.get_text_stats(text)
+
+    def _analyze(self, text: str, target_words: int, style: str, keyword_count: int) -> Tuple[Dict, Dict]:
+        summary = self.summarizer.summarize(text, target_words, style)
+        keywords = self.summarizer.extract_keywords(text, keyword_count)
+        return summary, keywords
+
+    def _result(self, index: int, item: Dict, text: str, stats: Dict, future) -> Dict:
+        try:
+            summary, keywords = future.result()
+        except Exception as e:
+            return self._error(index, item, str(e))
+        return {
+            'index': index,
+            'filename': item['filename'],
+            'success': True,
+            'text': text,
+            'stats': stats,
+            'summary': summary['summary'],
+            'method': summary['method'],
+            'model': summary['model'],
+            'summary_stats': self.doc_processor.get_text_stats(summary['summary']),
+            'keywords': keywords.get('keywords', [])
+        }
+
+    def _error(self, index: int, item: Dict, error: str) -> Dict:
+        return {'index': index, 'filename': item.get('filename'), 'success': False, 'error': error}
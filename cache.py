@@ -0,0 +1,105 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+
+
+def make_key(*parts) -> str:
+    """Construit une clé de cache stable (SHA-256) à partir de valeurs sérialisables en JSON"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Cache LRU en mémoire avec expiration, partagé entre les threads d'un worker"""
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl: float = 3600):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Retourne la valeur en cache ou None si absente/expirée"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.record_cache(self.name, entry is not None)
+        return entry[1] if entry is not None else None
+
+    def set(self, key: str, value) -> None:
+        """Ajoute ou remplace une valeur, en évinçant la moins récemment utilisée si besoin"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class VersionStore:
+    """
+    Versions partagées entre les workers gunicorn d'une même machine, dans un petit fichier
+    SQLite (comme les limites de débit): chaque clé porte un jeton aléatoire, remplacé par bump().
+    Un jeton n'est jamais réutilisé, même si le fichier est perdu: une version (ou un ETag qui en
+    dérive) ancienne ne désigne jamais un contenu plus récent. En cas d'erreur du fichier, get()
+    retourne None: l'appelant relit alors la source sans cache.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version TEXT NOT NULL) WITHOUT ROWID'
+            )
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str):
+        """Version courante de key (créée au premier appel), ou None si le fichier est indisponible"""
+        try:
+            connection = self._connection()
+            row = connection.execute('SELECT version FROM versions WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                connection.execute('INSERT OR IGNORE INTO versions (key, version) VALUES (?, ?)',
+                                   (key, uuid.uuid4().hex))
+                row = connection.execute('SELECT version FROM versions WHERE key = ?', (key,)).fetchone()
+            return row[0]
+        except Exception as e:
+            print(f"Erreur VersionStore.get: {e}")
+            return None
+
+    def bump(self, keys) -> None:
+        """Donne une nouvelle version à chaque clé de keys"""
+        try:
+            self._connection().executemany('INSERT OR REPLACE INTO versions (key, version) VALUES (?, ?)',
+                                           [(key, uuid.uuid4().hex) for key in keys])
+        except Exception as e:
+            print(f"Erreur VersionStore.bump: {e}")
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: un seul morceau à la fois dans le processus, tous uploads confondus
+    fcntl = None
+
+# Envoi de gros fichiers par morceaux: init, morceaux successifs (chacun vérifié par SHA-256),
+# reprise à la dernière position validée après une coupure, puis finalisation
+
+# Taille maximale d'un document envoyé par morceaux et taille d'un morceau (sous MAX_CONTENT_LENGTH)
+MAX_SIZE = int(os.environ.get('CHUNKED_UPLOAD_MAX_SIZE', 512 * 1024 * 1024))
+CHUNK_SIZE = int(os.environ.get('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+# Uploads inachevés supprimés après ce délai sans nouveau morceau (secondes)
+TTL = int(os.environ.get('CHUNKED_UPLOAD_TTL', 24 * 3600))
+# Uploads inachevés simultanés par utilisateur ou IP
+MAX_ACTIVE = int(os.environ.get('CHUNKED_UPLOAD_MAX_ACTIVE', 3))
+
+# Lecture du corps de la requête par blocs: mémoire bornée quelle que soit la taille du morceau
+READ_BLOCK = 1024 * 1024
+CLEANUP_INTERVAL = 300
+
+BUSY = 'Un morceau de cet upload est déjà en cours d\'envoi'
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    """Requête refusée: status HTTP et, si utile, position validée à partir de laquelle reprendre"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class ChunkedUploads:
+    """
+    Uploads par morceaux, partagés entre workers gunicorn: un répertoire par upload dans root,
+    avec le fichier en cours d'assemblage (data) et son état (meta.json, remplacé atomiquement).
+    L'identifiant (128 bits aléatoires, connu du seul client) suffit pour reprendre: l'envoi
+    survit à un changement d'adresse IP ou à une connexion en cours de route.
+    Un verrou fichier (flock) par upload empêche deux morceaux de s'écrire en même temps.
+    La position enregistrée ne progresse qu'une fois le morceau écrit et sa somme vérifiée:
+    des octets reçus au-delà (coupure, somme fausse) sont tronqués au morceau suivant.
+    """
+
+    def __init__(self, root: str, max_size: int = MAX_SIZE, chunk_size: int = CHUNK_SIZE,
+                 ttl: int = TTL, max_active: int = MAX_ACTIVE):
+        self.root = root
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.max_active = max_active
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        os.makedirs(root, exist_ok=True)
+
+    # ==================== ÉTAT ====================
+
+    def _dir(self, upload_id):
+        if not _UPLOAD_ID.match(upload_id or ''):
+            raise UploadError('Upload inconnu', 404)
+        return os.path.join(self.root, upload_id)
+
+    def _read_meta(self, upload_id):
+        try:
+            with open(os.path.join(self._dir(upload_id), 'meta.json'), encoding='utf-8') as source:
+                return json.load(source)
+        except (OSError, ValueError):
+            raise UploadError('Upload inconnu ou expiré', 404)
+
+    def _write_meta(self, meta):
+        directory = self._dir(meta['id'])
+        temp_path = os.path.join(directory, 'meta.json.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as output:
+            json.dump(meta, output)
+        os.replace(temp_path, os.path.join(directory, 'meta.json'))
+
+    @contextmanager
+    def _locked(self, upload_id):
+        """Verrou exclusif non bloquant sur l'upload: un seul morceau à la fois, tous workers confondus"""
+        if fcntl is None:
+            if not self._lock.acquire(blocking=False):
+                raise UploadError(BUSY, 409)
+            try:
+                yield
+            finally:
+                self._lock.release()
+            return
+        try:
+            lock_file = open(os.path.join(self._dir(upload_id), 'lock'), 'a+b')
+        except FileNotFoundError:
+            raise UploadError('Upload inconnu ou expiré', 404)
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError(BUSY, 409)
+            yield
+
+    def status(self, upload_id: str) -> dict:
+        """Position validée: le prochain morceau commence là"""
+        meta = self._read_meta(upload_id)
+        return {'upload_id': upload_id, 'filename': meta['filename'], 'size': meta['size'],
+                'offset': meta['offset'], 'chunk_size': self.chunk_size}
+
+    # ==================== PROTOCOLE ====================
+
+    def start(self, owner: str, filename: str, size: int, sha256: str = None) -> dict:
+        """
+        Réserve un upload de size octets pour owner (compte dans ses uploads en cours).
+        sha256 facultatif: vérifié sur le fichier complet à la finalisation.
+        """
+        self._maybe_cleanup()
+        if size <= 0 or size > self.max_size:
+            raise UploadError(f'Taille invalide (maximum {self.max_size // (1024 * 1024)} Mo)', 413)
+        if sha256 is not None and not _SHA256.match(sha256):
+            raise UploadError('Somme SHA-256 invalide')
+        if self._active_count(owner) >= self.max_active:
+            raise UploadError('Trop d\'uploads en cours: terminez ou annulez les précédents', 429)
+        if shutil.disk_usage(self.root).free < size * 2:
+            raise UploadError('Espace disque insuffisant sur le serveur', 507)
+
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root, upload_id))
+        open(os.path.join(self.root, upload_id, 'data'), 'wb').close()
+        meta = {'id': upload_id, 'owner': owner, 'filename': filename, 'size': size, 'sha256': sha256,
+                'offset': 0, 'updated_at': time.time()}
+        self._write_meta(meta)
+        return self.status(upload_id)
+
+    def append(self, upload_id: str, offset: int, stream, sha256: str) -> int:
+        """
+        Écrit le morceau lu dans stream à la position offset (qui doit être la position validée)
+        et retourne la nouvelle position. Le morceau est rejeté, sans rien garder, si sa somme
+        SHA-256 ne correspond pas.
+        """
+        if not _SHA256.match(sha256 or ''):
+            raise UploadError('Somme SHA-256 du morceau manquante ou invalide')
+        with self._locked(upload_id):
+            meta = self._read_meta(upload_id)
+            if offset != meta['offset']:
+                raise UploadError('Position inattendue: reprendre à la position indiquée', 409, meta['offset'])
+            limit = min(self.chunk_size, meta['size'] - offset)
+
+            digest = hashlib.sha256()
+            written = 0
+            with open(os.path.join(self._dir(upload_id), 'data'), 'r+b') as output:
+                # Octets d'un morceau précédent interrompu ou rejeté
+                output.truncate(offset)
+                output.seek(offset)
+                while True:
+                    block = stream.read(READ_BLOCK)
+                    if not block:
+                        break
+                    written += len(block)
+                    if written > limit:
+                        output.truncate(offset)
+                        raise UploadError(f'Morceau trop grand (maximum {limit} octets ici)', 413, offset)
+                    digest.update(block)
+                    output.write(block)
+                if written == 0 or digest.hexdigest() != sha256:
+                    output.truncate(offset)
+                    raise UploadError('Morceau incomplet ou corrompu (somme SHA-256 différente)', 400, offset)
+                output.flush()
+                os.fsync(output.fileno())
+
+            meta['offset'] = offset + written
+            meta['updated_at'] = time.time()
+            self._write_meta(meta)
+            return meta['offset']
+
+    def finish(self, upload_id: str, target_dir: str) -> tuple:
+        """
+        Vérifie que le fichier est complet (et sa somme si donnée à l'init), puis le déplace dans
+        target_dir sous son nom. Retourne (chemin, nom). L'upload n'existe plus ensuite.
+        """
+        with self._locked(upload_id):
+            meta = self._read_meta(upload_id)
+            if meta['offset'] != meta['size']:
+                raise UploadError('Upload incomplet', 409, meta['offset'])
+            data_path = os.path.join(self._dir(upload_id), 'data')
+            if meta['sha256'] and _file_sha256(data_path) != meta['sha256']:
+                self.discard(upload_id)
+                raise UploadError('Fichier corrompu (somme SHA-256 différente): upload annulé', 422)
+            path = os.path.join(target_dir, meta['filename'])
+            shutil.move(data_path, path)
+            os.remove(os.path.join(self._dir(upload_id), 'meta.json'))
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+        return path, meta['filename']
+
+    def discard(self, upload_id: str):
+        """Annule un upload et supprime les morceaux reçus"""
+        self._read_meta(upload_id)
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    # ==================== NETTOYAGE ====================
+
+    def _uploads(self):
+        """(répertoire, état ou None) des uploads présents"""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            if not _UPLOAD_ID.match(name):
+                continue
+            directory = os.path.join(self.root, name)
+            try:
+                with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as source:
+                    yield directory, json.load(source)
+            except (OSError, ValueError):
+                yield directory, None
+
+    def _active_count(self, owner):
+        now = time.time()
+        return sum(1 for _, meta in self._uploads()
+                   if meta and meta['owner'] == owner and now - meta['updated_at'] < self.ttl)
+
+    def _maybe_cleanup(self):
+        """Supprime les uploads abandonnés (au plus une fois toutes les 5 minutes par worker)"""
+        now = time.time()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        for directory, meta in self._uploads():
+            try:
+                updated_at = meta['updated_at'] if meta else os.path.getmtime(directory)
+            except OSError:
+                continue
+            if now - updated_at > self.ttl:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(READ_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -1,507 +1,585 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+"""
+Accès aux données.
+
+Les fonctions de données (create_user, save_*, get_*, delete_*, statistiques...) sont
+fournies par le backend choisi par configuration (STORAGE_BACKEND):
+  - firestore (défaut): storage_firestore, Google Cloud Firestore
+  - sqlite: storage_sqlite, fichier local en mode WAL (SQLITE_PATH)
+Elles s'appellent toujours via ce module (db.save_summary(...)); les utilitaires
+communs aux backends sont définis ici, ainsi que le cache des profils utilisateur
+(get_user_by_id) et celui des premières pages (get_summaries, get_favorites).
+"""
+import base64
+import hashlib
+import importlib
 import json
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
-from dotenv import load_dotenv
-
-# Charger les variables d'environnement
-load_dotenv()
-
-# Initialisation Firebase
-def get_firebase_credentials():
-    """Récupère les credentials Firebase depuis fichier ou variables d'environnement"""
-    
-    # 1. Essayer avec le fichier local
-    if os.path.exists('firebase-credentials.json'):
-        return credentials.Certificate('firebase-credentials.json'), "fichier local"
-    
-    # 2. Essayer avec FIREBASE_CREDENTIALS (JSON complet)
-    firebase_creds_json = os.environ.get("FIREBASE_CREDENTIALS")
-    if firebase_creds_json:
-        try:
-            creds_dict = json.loads(firebase_creds_json)
-            return credentials.Certificate(creds_dict), "FIREBASE_CREDENTIALS JSON"
-        except json.JSONDecodeError:
-            print("Erreur: FIREBASE_CREDENTIALS n'est pas un JSON valide")
-    
-    # 3. Fallback: variables individuelles
-    firebase_config = {
-        "type": "service_account",
-        "project_id": os.environ.get("FIREBASE_PROJECT_ID", ""),
-        "private_key_id": os.environ.get("FIREBASE_PRIVATE_KEY_ID", ""),
-        "private_key": os.environ.get("FIREBASE_PRIVATE_KEY", "").replace('\\n', '\n'),
-        "client_email": os.environ.get("FIREBASE_CLIENT_EMAIL", ""),
-        "client_id": os.environ.get("FIREBASE_CLIENT_ID", ""),
-        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-        "token_uri": "https://oauth2.googleapis.com/token",
-        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-        "client_x509_cert_url": os.environ.get("FIREBASE_CERT_URL", "")
-    }
-    return credentials.Certificate(firebase_config), "variables individuelles"
+import secrets
+import string
+import tempfile
+import threading
+import zlib
+from datetime import date, datetime, timedelta
+
+from cache import ResultCache, VersionStore
+
+
+# Fonctions (et classe BatchWriter) que chaque backend doit fournir
+INTERFACE = (
+    'init_db',
+    'create_user', 'authenticate_user', 'get_user_by_id', 'backfill_user_keys',
+    'save_summary', 'get_summaries', 'get_summary_by_id', 'delete_summary',
+    'save_translation', 'get_translations',
+    'save_analysis', 'get_analyses', 'get_analysis_by_id',
+    'save_qa', 'get_qa_history',
+    'save_favorite', 'get_favorites', 'delete_favorite',
+    'get_global_stats', 'rebuild_user_stats', 'iter_user_ids',
+    'count_history', 'clear_all_history', 'get_clear_job', 'save_clear_job',
+    'put_blob', 'get_blob', 'release_blob', 'get_blob_stats', 'gc_blobs',
+    'search_history', 'rebuild_search_index',
+    'export_page',
+    'get_rollups', 'compact_rollups', 'rebuild_rollups',
+    'set_user_plan', 'archive_history', 'preview_archive', 'get_archives',
+    'BatchWriter',
+)
+
+BACKENDS = {
+    'firestore': 'storage_firestore',
+    'sqlite': 'storage_sqlite',
+}
+
+backend_name = os.environ.get('STORAGE_BACKEND', 'firestore')
+sqlite_path = os.environ.get('SQLITE_PATH', 'nectar.db')
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def configure(backend=None, path=None):
+    """Choisit le backend avant le premier accès aux données (aucune connexion n'est ouverte ici)"""
+    global backend_name, sqlite_path, _backend
+    backend = backend or backend_name
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de stockage inconnu: {backend} (attendu: {', '.join(BACKENDS)})")
+    with _backend_lock:
+        backend_name = backend
+        sqlite_path = path or sqlite_path
+        _backend = None
+
+
+def get_backend():
+    """Module du backend configuré, importé au premier accès"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                module = importlib.import_module(BACKENDS[backend_name])
+                missing = [name for name in INTERFACE if not hasattr(module, name)]
+                if missing:
+                    raise NotImplementedError(f"{module.__name__} ne fournit pas: {', '.join(missing)}")
+                _backend = module
+    return _backend
+
+
+def __getattr__(name):
+    # db.<fonction>: déléguée au backend configuré
+    if name in INTERFACE:
+        return getattr(get_backend(), name)
+    raise AttributeError(f"module 'database' has no attribute '{name}'")
+
+
+# ==================== CACHE DES PROFILS ====================
+
+# Profils lus à chaque chargement de page (/auth/me): cache par processus, borné dans le temps
+# (USER_CACHE_TTL) pour que les autres workers voient une modification sans invalidation croisée
+_user_cache = ResultCache(
+    'users',
+    max_entries=int(os.environ.get('USER_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 300))
+)
+
+
+def get_user_by_id(user_id):
+    """Profil d'un utilisateur (id, username, email, created_at, plan), lu dans le cache si possible"""
+    user = _user_cache.get(user_id)
+    if user is None:
+        user = get_backend().get_user_by_id(user_id)
+        if user is not None:
+            _user_cache.set(user_id, user)
+    return dict(user) if user is not None else None
+
+
+def invalidate_user(user_id):
+    """À appeler après toute modification d'un utilisateur (profil, désactivation)"""
+    _user_cache.delete(user_id)
+
+
+# ==================== CACHE DES PREMIÈRES PAGES ====================
+
+# Première page des résumés et des favoris, relue à chaque affichage: cache par processus.
+# Les clés portent une version par (collection, utilisateur), partagée entre les workers de la
+# machine (PAGE_VERSIONS_DB) et renouvelée par les backends après chaque écriture validée
+# (invalidate_pages): aucun worker ne resert une page après une modification faite par un autre.
+# La même version donne l'ETag de la première page: un 304 se décide sans lire la base.
+PAGE_CACHE_COLLECTIONS = ('summaries', 'favorites')
+
+_page_cache = ResultCache(
+    'pages',
+    max_entries=int(os.environ.get('PAGE_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('PAGE_CACHE_TTL', 60))
+)
+_page_versions = VersionStore(os.environ.get(
+    'PAGE_VERSIONS_DB', os.path.join(tempfile.gettempdir(), 'nectar-page-versions.db')
+))
+
+
+def page_version(collection, user_id):
+    """Version de la première page de collection pour l'utilisateur (None si indisponible)"""
+    return _page_versions.get(f'{collection}:{user_id}')
+
 
-try:
-    cred, source = get_firebase_credentials()
-    firebase_admin.initialize_app(cred)
-    print(f"Firebase initialisé avec {source}")
-except ValueError:
-    # App déjà initialisée
-    pass
-except Exception as e:
-    print(f"Erreur initialisation Firebase: {e}")
+def invalidate_pages(user_id, collections=PAGE_CACHE_COLLECTIONS):
+    """À appeler une fois validée toute écriture de l'utilisateur dans ces collections"""
+    _page_versions.bump([f'{collection}:{user_id}' for collection in collections
+                         if collection in PAGE_CACHE_COLLECTIONS])
 
-# Référence Firestore
-db = firestore.client()
 
+def _cached_page(collection, user_id, limit, cursor):
+    """Première page (sans curseur) lue dans le cache si possible, pages suivantes lues au backend"""
+    read = getattr(get_backend(), f'get_{collection}')
+    version = None if cursor else page_version(collection, user_id)
+    if version is None:
+        return read(user_id, limit=limit, cursor=cursor)
+    # Version lue avant la requête: une écriture concurrente rend la page obsolète dès sa mise en cache
+    key = f'{collection}:{user_id}:{version}:{limit}'
+    page = _page_cache.get(key)
+    if page is None:
+        page = read(user_id, limit=limit)
+        if page['items']:
+            # Une page vide peut masquer une erreur de lecture: elle n'est pas gardée
+            _page_cache.set(key, page)
+    return {'items': [dict(item) for item in page['items']], 'next_cursor': page['next_cursor']}
 
-def _get_timestamp():
+
+def get_summaries(user_id, limit=20, cursor=None):
+    """Page de l'historique des résumés ({'items', 'next_cursor'}); la première est mise en cache"""
+    return _cached_page('summaries', user_id, limit, cursor)
+
+
+def get_favorites(user_id, limit=50, cursor=None):
+    """Page des favoris ({'items', 'next_cursor'}); la première est mise en cache"""
+    return _cached_page('favorites', user_id, limit, cursor)
+
+
+def get_timestamp():
     """Retourne le timestamp actuel"""
     return datetime.now().isoformat()
 
 
-# ==================== USERS ====================
+_ID_ALPHABET = string.ascii_letters + string.digits
 
-def create_user(username, email, password):
-    """Crée un nouvel utilisateur"""
-    password_hash = generate_password_hash(password)
-    
-    try:
-        # Vérifier si l'email existe déjà
-        users_ref = db.collection('users')
-        email_query = users_ref.where('email', '==', email).limit(1).get()
-        if len(list(email_query)) > 0:
-            return {'success': False, 'error': 'Cet email est déjà utilisé'}
-        
-        # Vérifier si le username existe déjà
-        username_query = users_ref.where('username', '==', username).limit(1).get()
-        if len(list(username_query)) > 0:
-            return {'success': False, 'error': 'Ce nom d\'utilisateur est déjà pris'}
-        
-        # Créer l'utilisateur
-        user_data = {
-            'username': username,
-            'email': email,
-            'password_hash': password_hash,
-            'is_active': True,
-            'created_at': _get_timestamp()
-        }
-        
-        doc_ref = users_ref.add(user_data)
-        return {'success': True, 'user_id': doc_ref[1].id}
-    
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur lors de la création du compte: {str(e)}'}
 
+def new_doc_id():
+    """ID de document au format Firestore (20 caractères aléatoires), généré sans client"""
+    return ''.join(secrets.choice(_ID_ALPHABET) for _ in range(20))
 
-def authenticate_user(email, password):
-    """Authentifie un utilisateur"""
-    try:
-        users_ref = db.collection('users')
-        query = users_ref.where('email', '==', email).where('is_active', '==', True).limit(1).get()
-        
-        users = list(query)
-        if users:
-            user_doc = users[0]
-            user = user_doc.to_dict()
-            
-            if check_password_hash(user['password_hash'], password):
-                return {
-                    'success': True,
-                    'user': {
-                        'id': user_doc.id,
-                        'username': user['username'],
-                        'email': user['email'],
-                        'created_at': user['created_at']
-                    }
-                }
-        
-        return {'success': False, 'error': 'Email ou mot de passe incorrect'}
-    
-    except Exception as e:
-        return {'success': False, 'error': f'Erreur d\'authentification: {str(e)}'}
 
+# ==================== PAGINATION ====================
 
-def get_user_by_id(user_id):
-    """Récupère un utilisateur par son ID"""
-    try:
-        doc = db.collection('users').document(user_id).get()
-        if doc.exists:
-            user = doc.to_dict()
-            return {
-                'id': doc.id,
-                'username': user['username'],
-                'email': user['email'],
-                'created_at': user['created_at']
-            }
+def encode_cursor(created_at, doc_id):
+    """Curseur opaque: position (created_at, id) du dernier document de la page"""
+    payload = json.dumps([created_at, doc_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Décode un curseur de encode_cursor (None si absent, ValueError s'il est invalide)"""
+    if not cursor:
         return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(created_at, str) or not isinstance(doc_id, str):
+            raise ValueError
+        return created_at, doc_id
     except Exception:
-        return None
+        raise ValueError('Curseur de pagination invalide')
 
 
-# ==================== SUMMARIES ====================
+# ==================== APERÇUS ====================
 
-def save_summary(user_id, filename, original_text, summary, original_words, summary_words, 
-                 target_words, style, method, model):
-    """Sauvegarde un résumé dans Firestore"""
-    compression_rate = round((1 - summary_words / original_words) * 100, 1) if original_words > 0 else 0
-    
-    try:
-        summary_data = {
-            'user_id': user_id,
-            'filename': filename,
-            'original_text': original_text[:5000],
-            'summary': summary,
-            'original_words': original_words,
-            'summary_words': summary_words,
-            'target_words': target_words,
-            'style': style,
-            'method': method,
-            'model': model,
-            'compression_rate': compression_rate,
-            'created_at': _get_timestamp()
-        }
-        
-        doc_ref = db.collection('summaries').add(summary_data)
-        return doc_ref[1].id
-    except Exception as e:
-        print(f"Erreur save_summary: {e}")
-        return None
+PREVIEW_CHARS = 200
 
+# Champs des listes d'historique: ni original_text ni summary complet
+SUMMARY_LIST_FIELDS = ['filename', 'preview', 'original_words', 'summary_words', 'style', 'method', 'compression_rate']
 
-def get_summaries(user_id, limit=20, offset=0):
-    """Récupère l'historique des résumés d'un utilisateur"""
-    try:
-        summaries_ref = db.collection('summaries')
-        # Requête simple sans order_by pour éviter le besoin d'index composite
-        query = summaries_ref.where('user_id', '==', user_id).get()
-        
-        results = []
-        for doc in query:
-            data = doc.to_dict()
-            results.append({
-                'id': doc.id,
-                'created_at': data.get('created_at'),
-                'filename': data.get('filename'),
-                'summary': data.get('summary'),
-                'original_words': data.get('original_words'),
-                'summary_words': data.get('summary_words'),
-                'style': data.get('style'),
-                'method': data.get('method'),
-                'compression_rate': data.get('compression_rate')
-            })
-        
-        # Trier côté Python par date décroissante
-        results.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        
-        # Appliquer limit et offset
-        return results[offset:offset + limit]
-    except Exception as e:
-        print(f"Erreur get_summaries: {e}")
-        import traceback
-        traceback.print_exc()
-        return []
-
-
-def get_summary_by_id(summary_id, user_id):
-    """Récupère un résumé par son ID"""
-    try:
-        doc = db.collection('summaries').document(summary_id).get()
-        if doc.exists:
-            data = doc.to_dict()
-            if data.get('user_id') == user_id:
-                data['id'] = doc.id
-                return data
-        return None
-    except Exception:
-        return None
 
+def make_preview(text, length=PREVIEW_CHARS):
+    """Aperçu court stocké à l'écriture: les listes n'ont pas à lire le contenu complet"""
+    text = ' '.join((text or '').split())
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0] + '…'
 
-def delete_summary(summary_id, user_id):
-    """Supprime un résumé"""
-    try:
-        doc_ref = db.collection('summaries').document(summary_id)
-        doc = doc_ref.get()
-        
-        if doc.exists and doc.to_dict().get('user_id') == user_id:
-            doc_ref.delete()
-            return True
-        return False
-    except Exception:
-        return False
 
+def analysis_preview(result):
+    """Aperçu d'un résultat d'analyse: mots-clés, titres ou sentiment"""
+    if not isinstance(result, dict):
+        return ''
+    if result.get('keywords'):
+        return make_preview(', '.join(map(str, result['keywords'])))
+    if result.get('titles'):
+        return make_preview(' / '.join(map(str, result['titles'])))
+    if result.get('sentiment'):
+        return make_preview(f"{result['sentiment']} ({result.get('score', 0)}) - {result.get('tone', '')}")
+    return ''
 
-# ==================== TRANSLATIONS ====================
 
-def save_translation(user_id, source_text, translated_text, target_language):
-    """Sauvegarde une traduction"""
-    try:
-        translation_data = {
-            'user_id': user_id,
-            'source_text': source_text[:5000],
-            'translated_text': translated_text,
-            'target_language': target_language,
-            'created_at': _get_timestamp()
-        }
-        
-        doc_ref = db.collection('translations').add(translation_data)
-        return doc_ref[1].id
-    except Exception as e:
-        print(f"Erreur save_translation: {e}")
-        return None
+# ==================== RECHERCHE ====================
 
+# Collections indexées pour /api/history/search
+SEARCH_COLLECTIONS = ('summaries', 'analyses', 'qa_history')
 
-def get_translations(user_id, limit=20):
-    """Récupère l'historique des traductions"""
-    try:
-        translations_ref = db.collection('translations')
-        query = translations_ref.where('user_id', '==', user_id).get()
-        
-        results = []
-        for doc in query:
-            data = doc.to_dict()
-            results.append({
-                'id': doc.id,
-                'created_at': data.get('created_at'),
-                'source_text': data.get('source_text'),
-                'translated_text': data.get('translated_text'),
-                'target_language': data.get('target_language')
-            })
-        
-        # Trier côté Python
-        results.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        return results[:limit]
-    except Exception as e:
-        print(f"Erreur get_translations: {e}")
-        return []
-
-
-# ==================== ANALYSES ====================
-
-def save_analysis(user_id, analysis_type, source_text, result):
-    """Sauvegarde une analyse"""
-    try:
-        analysis_data = {
-            'user_id': user_id,
-            'analysis_type': analysis_type,
-            'source_text_preview': source_text[:200],
-            'result': result,
-            'created_at': _get_timestamp()
-        }
-        
-        doc_ref = db.collection('analyses').add(analysis_data)
-        return doc_ref[1].id
-    except Exception as e:
-        print(f"Erreur save_analysis: {e}")
-        return None
 
+def search_text(collection, data):
+    """Texte indexé d'une entrée: nom de fichier et résumé, mots-clés d'analyse, question et réponse"""
+    if collection == 'summaries':
+        return f"{data.get('filename') or ''} {data.get('summary') or ''}"
+    if collection == 'analyses':
+        return analysis_preview(data.get('result')) or data.get('preview') or ''
+    if collection == 'qa_history':
+        return f"{data.get('question') or ''} {data.get('answer') or ''}"
+    return ''
 
-def get_analyses(user_id, analysis_type=None, limit=20):
-    """Récupère l'historique des analyses"""
-    try:
-        analyses_ref = db.collection('analyses')
-        query = analyses_ref.where('user_id', '==', user_id).get()
-        
-        results = []
-        for doc in query:
-            data = doc.to_dict()
-            # Filtrer par type si spécifié
-            if analysis_type and data.get('analysis_type') != analysis_type:
-                continue
-            results.append({
-                'id': doc.id,
-                'created_at': data.get('created_at'),
-                'analysis_type': data.get('analysis_type'),
-                'source_text_preview': data.get('source_text_preview'),
-                'result': data.get('result')
-            })
-        
-        # Trier côté Python
-        results.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        return results[:limit]
-    except Exception as e:
-        print(f"Erreur get_analyses: {e}")
-        return []
-
-
-# ==================== Q&A ====================
-
-def save_qa(user_id, document_preview, question, answer):
-    """Sauvegarde une Q&A"""
-    try:
-        qa_data = {
-            'user_id': user_id,
-            'document_preview': document_preview[:200],
-            'question': question,
-            'answer': answer,
-            'created_at': _get_timestamp()
-        }
-        
-        doc_ref = db.collection('qa_history').add(qa_data)
-        return doc_ref[1].id
-    except Exception as e:
-        print(f"Erreur save_qa: {e}")
-        return None
 
+def search_item(collection, data):
+    """Champs d'un résultat de recherche: ceux des listes d'historique de la collection"""
+    if collection == 'summaries':
+        return {field: data.get(field) for field in SUMMARY_LIST_FIELDS}
+    if collection == 'analyses':
+        return {'analysis_type': data.get('analysis_type'), 'source_text_preview': data.get('source_text_preview'),
+                'preview': data.get('preview') or analysis_preview(data.get('result'))}
+    if collection == 'qa_history':
+        return {'question': data.get('question'), 'preview': make_preview(data.get('answer'))}
+    return {}
 
-def get_qa_history(user_id, limit=20):
-    """Récupère l'historique des Q&A"""
-    try:
-        qa_ref = db.collection('qa_history')
-        query = qa_ref.where('user_id', '==', user_id).get()
-        
-        results = []
-        for doc in query:
-            data = doc.to_dict()
-            results.append({
-                'id': doc.id,
-                'created_at': data.get('created_at'),
-                'document_preview': data.get('document_preview'),
-                'question': data.get('question'),
-                'answer': data.get('answer')
-            })
-        
-        # Trier côté Python
-        results.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        return results[:limit]
-    except Exception as e:
-        print(f"Erreur get_qa_history: {e}")
-        return []
-
-
-# ==================== FAVORITES ====================
-
-def save_favorite(user_id, title, content, content_type='summary'):
-    """Sauvegarde un favori"""
-    try:
-        favorite_data = {
-            'user_id': user_id,
-            'title': title,
-            'content': content,
-            'content_type': content_type,
-            'created_at': _get_timestamp()
-        }
-        
-        doc_ref = db.collection('favorites').add(favorite_data)
-        return doc_ref[1].id
-    except Exception as e:
-        print(f"Erreur save_favorite: {e}")
-        return None
 
+# ==================== EXPORT ====================
 
-def get_favorites(user_id, limit=50):
-    """Récupère les favoris"""
-    try:
-        favorites_ref = db.collection('favorites')
-        query = favorites_ref.where('user_id', '==', user_id).get()
-        
-        results = []
-        for doc in query:
-            data = doc.to_dict()
-            results.append({
-                'id': doc.id,
-                'created_at': data.get('created_at'),
-                'title': data.get('title'),
-                'content': data.get('content'),
-                'content_type': data.get('content_type')
-            })
-        
-        # Trier côté Python
-        results.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        return results[:limit]
-        
-        return results
-    except Exception as e:
-        print(f"Erreur get_favorites: {e}")
-        return []
-
-
-def delete_favorite(favorite_id, user_id):
-    """Supprime un favori"""
-    try:
-        doc_ref = db.collection('favorites').document(favorite_id)
-        doc = doc_ref.get()
-        
-        if doc.exists and doc.to_dict().get('user_id') == user_id:
-            doc_ref.delete()
-            return True
-        return False
-    except Exception:
-        return False
+# Collections exportées par /api/history/export, dans l'ordre de l'export
+EXPORT_COLLECTIONS = ('summaries', 'translations', 'analyses', 'qa_history', 'favorites')
 
+# Champ qui reçoit le texte complet (blob) des documents qui en référencent un
+ORIGINAL_TEXT_FIELDS = {'summaries': 'original_text', 'translations': 'source_text'}
 
-# ==================== STATISTICS ====================
 
-def get_global_stats(user_id):
-    """Récupère les statistiques d'utilisation"""
-    try:
-        # Nombre total de résumés
-        summaries = list(db.collection('summaries').where('user_id', '==', user_id).get())
-        total_summaries = len(summaries)
-        
-        # Calculs sur les résumés
-        total_words = 0
-        total_compression = 0
-        style_counts = {}
-        
-        for doc in summaries:
-            data = doc.to_dict()
-            total_words += data.get('original_words', 0)
-            total_compression += data.get('compression_rate', 0)
-            style = data.get('style', 'paragraph')
-            style_counts[style] = style_counts.get(style, 0) + 1
-        
-        avg_compression = round(total_compression / total_summaries, 1) if total_summaries > 0 else 0
-        favorite_style = max(style_counts, key=style_counts.get) if style_counts else 'paragraph'
-        
-        # Nombre de traductions
-        translations = list(db.collection('translations').where('user_id', '==', user_id).get())
-        total_translations = len(translations)
-        
-        # Nombre de Q&A
-        qa = list(db.collection('qa_history').where('user_id', '==', user_id).get())
-        total_qa = len(qa)
-        
-        return {
-            'total_summaries': total_summaries,
-            'total_words_processed': total_words,
-            'total_translations': total_translations,
-            'total_qa': total_qa,
-            'avg_compression_rate': avg_compression,
-            'favorite_style': favorite_style
-        }
-    except Exception as e:
-        print(f"Erreur get_global_stats: {e}")
-        return {
-            'total_summaries': 0,
-            'total_words_processed': 0,
-            'total_translations': 0,
-            'total_qa': 0,
-            'avg_compression_rate': 0,
-            'favorite_style': 'paragraph'
+def export_item(doc_id, data):
+    """Document exporté: tous ses champs sauf les références internes (user_id, blob_id)"""
+    return {'id': doc_id, **{key: value for key, value in data.items() if key not in ('id', 'user_id', 'blob_id')}}
+
+
+# ==================== TEXTES COMPLETS ====================
+
+# Taille maximale d'un morceau de texte compressé par document (limite Firestore: 1 Mio)
+BLOB_CHUNK_BYTES = 900 * 1024
+
+
+def pack_text(text):
+    """Retourne (empreinte SHA-256, taille brute en octets, contenu compressé zlib) d'un texte"""
+    raw = (text or '').encode('utf-8')
+    return hashlib.sha256(raw).hexdigest(), len(raw), zlib.compress(raw, 6)
+
+
+def unpack_text(data):
+    """Inverse de pack_text"""
+    return zlib.decompress(data).decode('utf-8')
+
+
+def split_chunks(data, size=BLOB_CHUNK_BYTES):
+    """Découpe un contenu compressé en morceaux d'au plus size octets"""
+    return [data[i:i + size] for i in range(0, len(data), size)] or [b'']
+
+
+def blob_report(blobs):
+    """
+    Bilan du stockage des textes à partir de (taille brute, taille stockée, références) par blob:
+    taux de compression et octets économisés par la déduplication.
+    """
+    report = {'blobs': 0, 'references': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+    referenced_raw = referenced_stored = 0
+    for size, stored_size, refs in blobs:
+        size, stored_size, refs = size or 0, stored_size or 0, max(refs or 0, 0)
+        report['blobs'] += 1
+        report['references'] += refs
+        report['raw_bytes'] += size
+        report['stored_bytes'] += stored_size
+        referenced_raw += size * refs
+        referenced_stored += stored_size * refs
+    report['compression_ratio'] = round(report['raw_bytes'] / report['stored_bytes'], 2) if report['stored_bytes'] else 0
+    # Sans déduplication, chaque référence stockerait sa propre copie compressée
+    report['dedup_saved_bytes'] = max(referenced_stored - report['stored_bytes'], 0)
+    # Par rapport à une copie brute du texte dans chaque document d'historique
+    report['total_saved_bytes'] = max(referenced_raw - report['stored_bytes'], 0)
+    return report
+
+
+# ==================== AGRÉGATS PAR UTILISATEUR ====================
+
+HISTORY_COLLECTIONS = ['summaries', 'translations', 'analyses', 'qa_history']
+
+# Compteur des agrégats user_stats associé à chaque collection
+STATS_COUNTERS = {
+    'summaries': 'total_summaries',
+    'translations': 'total_translations',
+    'analyses': 'total_analyses',
+    'qa_history': 'total_qa',
+    'favorites': 'total_favorites',
+}
+
+
+def compute_compression_rate(original_words, summary_words):
+    """Taux de compression en % (0 pour un texte vide)"""
+    return round((1 - summary_words / original_words) * 100, 1) if original_words > 0 else 0
+
+
+def summary_delta(data, sign=1):
+    """Contribution d'un résumé aux agrégats (sign=-1 pour une suppression)"""
+    return {
+        'total_summaries': sign,
+        'total_words_processed': sign * (data.get('original_words') or 0),
+        'compression_sum': sign * (data.get('compression_rate') or 0),
+        'style_counts': {data.get('style') or 'paragraph': sign},
+    }
+
+
+def merge_delta(total, delta):
+    """Additionne delta dans total (style_counts est un dictionnaire imbriqué)"""
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            merge_delta(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def format_stats(stats):
+    """Statistiques exposées par /stats à partir des agrégats user_stats"""
+    total_summaries = stats.get('total_summaries', 0)
+    style_counts = {k: v for k, v in (stats.get('style_counts') or {}).items() if v > 0}
+    return {
+        'total_summaries': total_summaries,
+        'total_words_processed': stats.get('total_words_processed', 0),
+        'total_translations': stats.get('total_translations', 0),
+        'total_qa': stats.get('total_qa', 0),
+        'avg_compression_rate': round(stats.get('compression_sum', 0) / total_summaries, 1) if total_summaries > 0 else 0,
+        'favorite_style': max(style_counts, key=style_counts.get) if style_counts else 'paragraph'
+    }
+
+
+# ==================== STATISTIQUES PAR JOUR ====================
+
+# Collections comptées par jour (user_rollups), avec les champs lus pour les recalculer
+ROLLUP_FIELDS = {
+    'summaries': ['created_at', 'original_words', 'summary_words', 'compression_rate', 'style'],
+    'translations': ['created_at', 'target_language'],
+    'analyses': ['created_at'],
+    'qa_history': ['created_at'],
+}
+
+ROLLUP_COUNTERS = ('summaries', 'words_processed', 'summary_words', 'translations', 'analyses', 'qa')
+
+# Jours gardés tels quels par la compaction (compact-rollups): les plus anciens sont cumulés par mois
+ROLLUP_KEEP_DAYS = int(os.environ.get('ROLLUP_KEEP_DAYS', 90))
+
+MAX_SERIES_POINTS = 400
+
+
+def rollup_delta(collection, data, sign=1):
+    """Contribution d'un document aux statistiques de son jour: {'AAAA-MM-JJ': {métrique: valeur}}"""
+    if collection == 'summaries':
+        values = {
+            'summaries': sign,
+            'words_processed': sign * (data.get('original_words') or 0),
+            'summary_words': sign * (data.get('summary_words') or 0),
+            'compression_sum': sign * (data.get('compression_rate') or 0),
+            'styles': {data.get('style') or 'paragraph': sign},
         }
+    elif collection == 'translations':
+        values = {'translations': sign, 'languages': {data.get('target_language') or 'inconnue': sign}}
+    elif collection == 'analyses':
+        values = {'analyses': sign}
+    elif collection == 'qa_history':
+        values = {'qa': sign}
+    else:
+        return {}
+    return {(data.get('created_at') or get_timestamp())[:10]: values}
+
+
+def fold_rollups(days, months, before):
+    """Compaction: cumule dans leur mois les jours antérieurs à before (AAAA-MM-JJ); retourne leur nombre"""
+    folded = [day for day in days if day < before]
+    for day in folded:
+        merge_delta(months.setdefault(day[:7], {}), days.pop(day))
+    return len(folded)
+
+
+def rollup_point(period, values):
+    """Point d'une série: compteurs, compression moyenne, répartitions par langue et par style"""
+    values = values or {}
+    summaries = values.get('summaries', 0)
+    point = {'period': period, **{name: values.get(name, 0) for name in ROLLUP_COUNTERS}}
+    point['avg_compression'] = round(values.get('compression_sum', 0) / summaries, 1) if summaries > 0 else 0
+    for breakdown in ('languages', 'styles'):
+        point[breakdown] = {key: count for key, count in (values.get(breakdown) or {}).items() if count > 0}
+    return point
+
+
+def _days_between(start, end):
+    first, last = date.fromisoformat(start), date.fromisoformat(end)
+    return [(first + timedelta(days=offset)).isoformat() for offset in range((last - first).days + 1)]
+
+
+def _months_between(start, end):
+    months, (year, month) = [], map(int, start.split('-'))
+    while f'{year:04d}-{month:02d}' <= end:
+        months.append(f'{year:04d}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def rollup_series(rollups, start, end, granularity='day'):
+    """
+    Série temporelle sur [start, end] (AAAA-MM-JJ; start None: depuis la première activité)
+    à partir de get_rollups:
+      day    un point par jour, zéros compris; les jours compactés n'existent plus qu'en cumul
+             mensuel: la série commence alors à daily_from
+      month  un point par mois touché par l'intervalle (cumul compacté + jours restants)
+    ValueError si la granularité est inconnue ou l'intervalle trop long.
+    """
+    days, months = rollups.get('days') or {}, rollups.get('months') or {}
+    daily_from = rollups.get('compacted_before')
+    start = start or min([*days, *(f'{month}-01' for month in months)], default=end)
+    if start > end:
+        raise ValueError("Intervalle invalide: début postérieur à la fin")
+
+    if granularity == 'day':
+        first = max(start, daily_from) if daily_from else start
+        count = (date.fromisoformat(end) - date.fromisoformat(first)).days + 1
+    elif granularity == 'month':
+        count = (int(end[:4]) - int(start[:4])) * 12 + int(end[5:7]) - int(start[5:7]) + 1
+    else:
+        raise ValueError(f"Granularité inconnue: {granularity} (attendu: day, month)")
+    if count > MAX_SERIES_POINTS:
+        raise ValueError(f"Intervalle trop long (au plus {MAX_SERIES_POINTS} points)")
+
+    if granularity == 'day':
+        periods = _days_between(first, end)
+        raw = {day: days.get(day) or {} for day in periods}
+    else:
+        periods = _months_between(start[:7], end[:7])
+        raw = {month: merge_delta({}, months.get(month) or {}) for month in periods}
+        for day, values in days.items():
+            if day[:7] in raw:
+                merge_delta(raw[day[:7]], values)
+
+    total = {}
+    for values in raw.values():
+        merge_delta(total, values)
+    return {
+        'from': start,
+        'to': end,
+        'granularity': granularity,
+        'daily_from': daily_from,
+        'points': [rollup_point(period, raw[period]) for period in periods],
+        'total': rollup_point(None, total)
+    }
 
 
-def clear_all_history(user_id):
-    """Efface tout l'historique d'un utilisateur"""
-    try:
-        collections = ['summaries', 'translations', 'analyses', 'qa_history']
-        
-        for collection_name in collections:
-            docs = db.collection(collection_name).where('user_id', '==', user_id).get()
-            for doc in docs:
-                doc.reference.delete()
-        
-        return True
-    except Exception as e:
-        print(f"Erreur clear_all_history: {e}")
-        return False
-
-
-def init_db():
-    """Fonction de compatibilité - Firebase n'a pas besoin d'initialisation de schéma"""
-    print("Firebase Firestore prêt - pas besoin d'initialisation de schéma")
-
-
-# Initialiser (pour compatibilité)
-init_db()
+# ==================== ARCHIVES ====================
+
+# Collections archivées: au-delà de la durée de conservation de l'offre de l'utilisateur, leurs
+# entrées quittent la collection pour des archives mensuelles compressées, hors des requêtes
+# courantes (listes d'historique) mais toujours trouvées par la recherche, l'export et le détail
+ARCHIVE_COLLECTIONS = ('summaries', 'analyses', 'qa_history')
+
+DEFAULT_PLAN = 'free'
+
+# Jours de conservation par offre (champ plan de l'utilisateur) et par collection; None: jamais
+# archivé. RETENTION_POLICIES (JSON, même forme) remplace les offres qu'il définit
+RETENTION_POLICIES = {
+    'free': {'summaries': 365, 'analyses': 180, 'qa_history': 90},
+    'pro': {'summaries': None, 'analyses': 730, 'qa_history': 365},
+}
+RETENTION_POLICIES.update(json.loads(os.environ.get('RETENTION_POLICIES') or '{}'))
+
+ARCHIVE_BATCH_SIZE = 200           # entrées déplacées par transaction
+ARCHIVE_PART_BYTES = 512 * 1024    # taille compressée d'une part d'archive (limite Firestore: 1 Mio)
+ARCHIVE_PART_ENTRIES = 2000        # entrées par part (liste des IDs comprise dans le document)
+
+
+def retention_cutoffs(plan, today=None):
+    """Date limite (AAAA-MM-JJ) par collection archivée: les entrées plus anciennes sont archivées"""
+    policy = RETENTION_POLICIES.get(plan or DEFAULT_PLAN, RETENTION_POLICIES[DEFAULT_PLAN])
+    today = today or date.today()
+    return {
+        collection: (today - timedelta(days=days)).isoformat()
+        for collection, days in policy.items()
+        if collection in ARCHIVE_COLLECTIONS and days is not None
+    }
+
+
+def archive_entry(doc_id, data):
+    """Entrée d'archive: le document sans user_id (blob_id reste: le texte complet est conservé)"""
+    return {'id': doc_id, **{key: value for key, value in data.items() if key not in ('id', 'user_id')}}
+
+
+def pack_archive(entries):
+    return zlib.compress(json.dumps(entries, ensure_ascii=False, default=str).encode('utf-8'), 6)
+
+
+def unpack_archive(data):
+    return json.loads(zlib.decompress(data).decode('utf-8')) if data else []
+
+
+def pack_archive_parts(entries):
+    """
+    Compresse des entrées d'un mois en parts d'au plus ARCHIVE_PART_BYTES octets et
+    ARCHIVE_PART_ENTRIES entrées: [(entrées, contenu compressé)]
+    """
+    data = pack_archive(entries)
+    if len(entries) <= 1 or (len(data) <= ARCHIVE_PART_BYTES and len(entries) <= ARCHIVE_PART_ENTRIES):
+        return [(entries, data)]
+    middle = len(entries) // 2
+    return pack_archive_parts(entries[:middle]) + pack_archive_parts(entries[middle:])
+
+
+def group_by_month(entries):
+    """{AAAA-MM: [entrées]} selon created_at"""
+    months = {}
+    for entry in entries:
+        months.setdefault(entry['created_at'][:7], []).append(entry)
+    return months
+
+
+def archive_page(months, limit, start_after=None):
+    """
+    Suite d'une liste paginée dans les archives, du plus récent au plus ancien, après la position
+    start_after ((created_at, id) ou None). months: [(AAAA-MM, entrées)] du mois le plus récent au
+    plus ancien, lu au fur et à mesure (un mois n'est décompressé que si la page n'est pas pleine).
+    Les archives ne contiennent que des entrées plus anciennes que celles restées en collection:
+    elles prolongent la pagination de la collection. Retourne (entrées, curseur suivant ou None).
+    """
+    items = []
+    for _, entries in months:
+        items.extend(entry for entry in entries
+                     if not start_after or (entry['created_at'], entry['id']) < tuple(start_after))
+        if len(items) > limit:
+            break
+    items.sort(key=lambda entry: (entry['created_at'], entry['id']), reverse=True)
+    if len(items) <= limit:
+        return items, None
+    if not limit:
+        # Page déjà remplie par la collection: les archives commencent à la page suivante
+        return [], encode_cursor(*start_after)
+    items = items[:limit]
+    return items, encode_cursor(items[-1]['created_at'], items[-1]['id'])
@@ -1,6 +1,104 @@
+import math
 import os
 import re
-from typing import Dict
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+
+# Taille max d'une section envoyée au modèle (au-delà, la section est découpée)
+MAX_SECTION_CHARS = 12000
+# Taille visée des parties quand le document n'a aucun titre détectable
+FALLBACK_SECTION_CHARS = 6000
+# Nombre max de sections (un appel OpenAI chacune): au-delà, les sections voisines sont regroupées
+MAX_SECTIONS = int(os.environ.get('MAX_SECTIONS', 40))
+
+# Titres numérotés: "1. Introduction", "2.3 Résultats", "IV. Discussion", "Chapitre 2 - ...", "# Titre"
+NUMBERED_HEADING = re.compile(
+    r'^(?:(?P<num>\d{1,2}(?:\.\d{1,2}){0,3})[.)]?'
+    r'|(?P<roman>[IVXLC]{1,6})[.)]'
+    r'|(?P<word>(?:chapitre|chapter|partie|part|section|annexe|appendix)\s+[\dIVXLC]+[.:)-]?)'
+    r'|(?P<hash>#{1,4}))'
+    r'\s+(?P<title>[A-ZÀ-Ý«"\'(].{0,100})$',
+    re.IGNORECASE
+)
+
+
+def release_pdf_page(pdf, page):
+    """Libère les objets lus pour une page pdfplumber (mémoire bornée sur les gros PDF)"""
+    page.close()
+    # Cache d'objets de pdfminer: garde sinon toutes les images déjà décodées du document
+    cached = getattr(pdf.doc, '_cached_objs', None)
+    if cached is not None:
+        cached.clear()
+
+
+# ==================== PLAN (STRUCTURE DU FICHIER) ====================
+
+def _docx_heading(paragraph) -> Optional[Dict]:
+    """Titre DOCX: paragraphe de style Heading N / Titre N / Title"""
+    title = paragraph.text.strip()
+    if not title:
+        return None
+    style = ((paragraph.style.name if paragraph.style is not None else '') or '').strip()
+    match = re.match(r'^(?:heading|titre)\s*(\d)$', style, re.IGNORECASE)
+    if match:
+        return {'title': title, 'level': int(match.group(1))}
+    if style.lower() in ('title', 'titre'):
+        return {'title': title, 'level': 1}
+    return None
+
+
+def _pdf_fragment(text, cm, tm, font, font_size):
+    """(taille affichée, position verticale, texte) d'un fragment vu par PyPDF2, None si vide"""
+    if not text.strip():
+        return None
+    # Taille de police mise à l'échelle par les matrices de texte et de transformation
+    scale = math.hypot(tm[2] * cm[0] + tm[3] * cm[2], tm[2] * cm[1] + tm[3] * cm[3]) or 1
+    top = -(tm[4] * cm[1] + tm[5] * cm[3] + cm[5])
+    return round(font_size * scale, 1), top, text
+
+
+def _group_lines(fragments) -> List[List[Tuple[str, float]]]:
+    """Regroupe des (taille, position verticale, texte) successifs en lignes de (mot, taille)"""
+    lines = []
+    current_top, current_words = None, []
+    for size, top, text in fragments:
+        if current_top is not None and abs(top - current_top) > 2 and current_words:
+            lines.append(current_words)
+            current_words = []
+        current_top = top
+        current_words.extend((word, size) for word in text.split())
+    if current_words:
+        lines.append(current_words)
+    return lines
+
+
+def _outline_from_lines(lines) -> List[Dict]:
+    """Titres PDF: lignes courtes dont la police est nettement plus grande que le corps du texte"""
+    size_weights = Counter()
+    for words in lines:
+        for word, size in words:
+            size_weights[size] += len(word)
+    if not size_weights:
+        return []
+    body_size = size_weights.most_common(1)[0][0]
+    
+    candidates = []
+    for words in lines:
+        size = max(size for _, size in words)
+        title = ' '.join(word for word, _ in words).strip()
+        if size >= body_size * 1.15 and len(words) <= 15 and re.search(r'[A-Za-zÀ-ÿ]', title):
+            candidates.append((title, size))
+    
+    # Les tailles de titre les plus grandes donnent les niveaux les plus hauts
+    heading_sizes = sorted({size for _, size in candidates}, reverse=True)
+    return [
+        {'title': title, 'level': min(heading_sizes.index(size) + 1, 3)}
+        for title, size in candidates
+    ]
 
 
 class DocumentProcessor:
@@ -10,19 +108,37 @@ class DocumentProcessor:
         """
         Extrait le texte d'un document (PDF, DOCX, TXT)
         """
+        return self._extract(filepath)[0]
+    
+    def extract_document(self, filepath: str) -> Tuple[str, List[Dict]]:
+        """
+        Extrait le texte et le plan d'un document en une seule lecture du fichier.
+        Le plan vient de la structure réelle: styles de titre DOCX, sauts de taille de police PDF.
+        C'est une liste ordonnée de {"title", "level"} (vide pour un TXT ou en cas d'échec).
+        """
+        return self._extract(filepath, with_outline=True)
+    
+    def _extract(self, filepath: str, with_outline: bool = False) -> Tuple[str, List[Dict]]:
         extension = os.path.splitext(filepath)[1].lower()
+        label = extension.lstrip('.') or 'inconnu'
         
-        if extension == '.pdf':
-            return self._extract_from_pdf(filepath)
-        elif extension == '.docx':
-            return self._extract_from_docx(filepath)
-        elif extension == '.txt':
-            return self._extract_from_txt(filepath)
-        else:
-            raise ValueError(f"Format non supporté: {extension}")
+        with metrics.EXTRACTION_LATENCY.labels(label).time():
+            try:
+                if extension == '.pdf':
+                    return self._extract_from_pdf(filepath, with_outline)
+                elif extension == '.docx':
+                    return self._extract_from_docx(filepath, with_outline)
+                elif extension == '.txt':
+                    return self._extract_from_txt(filepath), []
+                else:
+                    raise ValueError(f"Format non supporté: {extension}")
+            except Exception:
+                metrics.EXTRACTION_ERRORS.labels(label).inc()
+                raise
     
-    def _extract_from_pdf(self, filepath: str) -> str:
-        """Extrait le texte d'un fichier PDF"""
+    def _extract_from_pdf(self, filepath: str, with_outline: bool = False) -> Tuple[str, List[Dict]]:
+        """Extrait le texte d'un fichier PDF (et les lignes avec leur taille de police pour le plan)"""
+        lines = []
         try:
             import PyPDF2
             
@@ -30,9 +146,15 @@ class DocumentProcessor:
             with open(filepath, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
                 for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+                    fragments = []
+                    visitor = (lambda *args: fragments.append(_pdf_fragment(*args))) if with_outline else None
+                    text += page.extract_text(visitor_text=visitor) + "\n"
+                    lines.extend(_group_lines(fragment for fragment in fragments if fragment))
+                    # Objets lus (images d'un PDF scanné...) oubliés après chaque page: la mémoire
+                    # reste celle d'une page, quelle que soit la taille du fichier
+                    pdf_reader.resolved_objects.clear()
             
-            return text.strip()
+            return text.strip(), _outline_from_lines(lines)
         except ImportError:
             # Fallback avec pdfplumber si PyPDF2 échoue
             try:
@@ -44,21 +166,32 @@ class DocumentProcessor:
                         page_text = page.extract_text()
                         if page_text:
                             text += page_text + "\n"
+                        if with_outline:
+                            lines.extend(_group_lines(
+                                (round(word['size'], 1), word['top'], word['text'])
+                                for word in page.extract_words(extra_attrs=['size'])
+                            ))
+                        release_pdf_page(pdf, page)
                 
-                return text.strip()
+                return text.strip(), _outline_from_lines(lines)
             except ImportError:
                 raise ImportError("Installez PyPDF2 ou pdfplumber: pip install PyPDF2 pdfplumber")
     
-    def _extract_from_docx(self, filepath: str) -> str:
-        """Extrait le texte d'un fichier DOCX"""
+    def _extract_from_docx(self, filepath: str, with_outline: bool = False) -> Tuple[str, List[Dict]]:
+        """Extrait le texte d'un fichier DOCX (et les titres: styles Heading N / Titre N / Title)"""
         try:
             from docx import Document
             
             doc = Document(filepath)
             text = ""
+            outline = []
             
             for paragraph in doc.paragraphs:
                 text += paragraph.text + "\n"
+                if with_outline:
+                    heading = _docx_heading(paragraph)
+                    if heading:
+                        outline.append(heading)
             
             # Extraire aussi le texte des tableaux
             for table in doc.tables:
@@ -67,7 +200,7 @@ class DocumentProcessor:
                         text += cell.text + " "
                     text += "\n"
             
-            return text.strip()
+            return text.strip(), outline
         except ImportError:
             raise ImportError("Installez python-docx: pip install python-docx")
     
@@ -84,6 +217,154 @@ class DocumentProcessor:
         
         raise ValueError("Impossible de décoder le fichier texte")
     
+    # ==================== STRUCTURE ====================
+    
+    def detect_outline(self, text: str) -> List[Dict]:
+        """Détecte les titres numérotés ("1.", "2.3", "IV.", "Chapitre 2", "#") dans un texte brut"""
+        outline = []
+        for line in text.split('\n'):
+            line = line.strip()
+            if not line or len(line.split()) > 15 or line.endswith((',', ';')):
+                continue
+            match = NUMBERED_HEADING.match(line)
+            if not match:
+                continue
+            if match.group('num'):
+                level = match.group('num').count('.') + 1
+            elif match.group('hash'):
+                level = len(match.group('hash'))
+            else:
+                level = 1
+            # Une phrase complète numérotée est plus probablement un élément de liste
+            if match.group('num') and line.endswith('.') and len(line.split()) > 6:
+                continue
+            outline.append({'title': line, 'level': level})
+        return outline
+    
+    def split_sections(self, text: str, outline: Optional[List[Dict]] = None,
+                       max_sections: int = MAX_SECTIONS) -> List[Dict]:
+        """
+        Découpe le texte en sections couvrant tout le document, dans l'ordre.
+        Utilise le plan fourni (structure du fichier), sinon les titres numérotés,
+        sinon des parties de taille régulière. Retourne des {"title", "level", "text"},
+        au plus max_sections (sections voisines regroupées au-delà).
+        """
+        headings = self._locate_headings(text, outline) if outline else []
+        if not headings:
+            headings = self._locate_headings(text, self.detect_outline(text))
+        
+        sections = []
+        if headings:
+            preamble = text[:headings[0][0]].strip()
+            if preamble:
+                sections.append({'title': 'Introduction', 'level': 1, 'text': preamble})
+            for i, (offset, title, level) in enumerate(headings):
+                end = headings[i + 1][0] if i + 1 < len(headings) else len(text)
+                body = text[offset + len(title):end].strip()
+                # Un titre sans contenu propre (chapitre suivi d'un sous-titre) est ignoré
+                if body:
+                    sections.append({'title': title, 'level': level, 'text': body})
+        else:
+            for chunk in self._chunk_paragraphs(text, FALLBACK_SECTION_CHARS):
+                sections.append({'title': None, 'level': 1, 'text': chunk})
+        
+        # Découper les sections trop longues pour tenir dans une requête
+        result = []
+        for section in sections:
+            if len(section['text']) <= MAX_SECTION_CHARS:
+                result.append(section)
+                continue
+            parts = self._chunk_paragraphs(section['text'], MAX_SECTION_CHARS)
+            for i, part in enumerate(parts, 1):
+                title = f"{section['title']} ({i}/{len(parts)})" if section['title'] else None
+                result.append({'title': title, 'level': section['level'], 'text': part})
+        if len(result) > max_sections:
+            result = self._group_sections(result, max_sections)
+        return result
+    
+    def _group_sections(self, sections: List[Dict], max_sections: int) -> List[Dict]:
+        """
+        Regroupe des sections voisines, dans l'ordre, en au plus max_sections parties de taille
+        comparable. Les titres intérieurs restent dans le texte du groupe.
+        """
+        budget = sum(len(section['text']) for section in sections) / max_sections
+        while True:
+            groups = []
+            size = 0
+            for section in sections:
+                if groups and size + len(section['text']) <= budget:
+                    groups[-1].append(section)
+                    size += len(section['text'])
+                else:
+                    groups.append([section])
+                    size = len(section['text'])
+            if len(groups) <= max_sections:
+                break
+            budget *= 1.25
+        
+        result = []
+        for group in groups:
+            if len(group) == 1:
+                result.append(group[0])
+                continue
+            titles = [section['title'] for section in group if section['title']]
+            result.append({
+                'title': f"{titles[0]} – {titles[-1]}" if len(titles) > 1 else (titles[0] if titles else None),
+                'level': min(section['level'] for section in group),
+                'text': '\n\n'.join(
+                    f"{section['title']}\n{section['text']}" if section['title'] else section['text']
+                    for section in group
+                )
+            })
+        return result
+    
+    def _locate_headings(self, text: str, outline: List[Dict]) -> List[tuple]:
+        """Retrouve, dans l'ordre, la position de chaque titre du plan au début d'une ligne du texte"""
+        line_offsets = []
+        positions_by_line = {}
+        offset = 0
+        for line in text.split('\n'):
+            normalized = ' '.join(line.split()).lower()
+            if normalized:
+                positions_by_line.setdefault(normalized, []).append(len(line_offsets))
+                line_offsets.append((offset + len(line) - len(line.lstrip()), line.strip()))
+            offset += len(line) + 1
+        
+        headings = []
+        next_line = 0
+        for entry in outline:
+            normalized = ' '.join(str(entry.get('title', '')).split()).lower()
+            candidates = positions_by_line.get(normalized, [])
+            index = bisect_left(candidates, next_line)
+            if index == len(candidates):
+                continue
+            line_index = candidates[index]
+            line_offset, line_text = line_offsets[line_index]
+            headings.append((line_offset, line_text, int(entry.get('level') or 1)))
+            next_line = line_index + 1
+        return headings
+    
+    def _chunk_paragraphs(self, text: str, max_chars: int) -> List[str]:
+        """Regroupe les paragraphes en morceaux d'au plus max_chars caractères"""
+        paragraphs = [p for p in re.split(r'\n\s*\n|\n', text) if p.strip()]
+        chunks, current = [], ''
+        for paragraph in paragraphs:
+            while len(paragraph) > max_chars:
+                if current:
+                    chunks.append(current.strip())
+                    current = ''
+                cut = paragraph.rfind(' ', 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                chunks.append(paragraph[:cut].strip())
+                paragraph = paragraph[cut:]
+            if current and len(current) + len(paragraph) + 1 > max_chars:
+                chunks.append(current.strip())
+                current = ''
+            current += paragraph + '\n'
+        if current.strip():
+            chunks.append(current.strip())
+        return chunks
+    
     def get_text_stats(self, text: str) -> Dict:
         """
         Calcule les statistiques du texte
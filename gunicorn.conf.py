@@ -0,0 +1,34 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Les métriques Prometheus de chaque worker sont écrites dans ce répertoire
+# puis agrégées par /metrics (mode multiprocess de prometheus_client).
+# Doit être défini avant que les workers n'importent prometheus_client.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'nectar-prometheus'))
+
+# Modèle de workers: une requête passe l'essentiel de son temps à attendre OpenAI (5 à 30 s)
+# ou Firestore. Chaque worker (processus) sert GUNICORN_THREADS requêtes à la fois (workers
+# gthread): une attente ne bloque plus qu'un thread. Les clients partagés du worker (Summarizer
+# et client OpenAI, clients Firestore, caches, file d'écriture différée) sont sûrs entre threads.
+# GUNICORN_WORKER_CLASS=sync et GUNICORN_THREADS=1 reviennent à une requête par processus.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+# Au-delà, le worker est considéré bloqué et redémarré (doit couvrir un appel OpenAI, voir OPENAI_TIMEOUT)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = 5
+
+
+def on_starting(server):
+    """Repart d'un répertoire de métriques vide à chaque démarrage du master"""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Libère les fichiers de métriques d'un worker terminé"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,220 @@
+import csv
+import io
+import json
+import zipfile
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import database as db
+
+
+# Documents lus par page: la mémoire de l'export ne dépend que de cette taille
+EXPORT_PAGE_SIZE = 100
+
+MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'zip': 'application/zip',
+}
+
+# Colonnes CSV de chaque collection (dict et listes écrits en JSON), suivies de cursor
+CSV_FIELDS = {
+    'summaries': ['id', 'created_at', 'filename', 'style', 'method', 'model', 'original_words', 'summary_words',
+                  'target_words', 'compression_rate', 'summary', 'original_text'],
+    'translations': ['id', 'created_at', 'target_language', 'source_text', 'translated_text'],
+    'analyses': ['id', 'created_at', 'analysis_type', 'source_text_preview', 'result'],
+    'qa_history': ['id', 'created_at', 'document_preview', 'question', 'answer'],
+    'favorites': ['id', 'created_at', 'title', 'content_type', 'content'],
+}
+
+
+class ExportError(Exception):
+    """Une page n'a pas pu être lue: l'export s'arrête après le dernier document écrit"""
+
+
+def encode_position(collection: str, item: Dict) -> str:
+    """Curseur de reprise de l'export juste après ce document"""
+    return f"{collection}.{db.encode_cursor(item['created_at'], item['id'])}"
+
+
+def decode_position(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(collection, curseur de page) d'un curseur d'export (ValueError s'il est invalide)"""
+    if not cursor:
+        return None
+    collection, _, page_cursor = cursor.partition('.')
+    if collection not in db.EXPORT_COLLECTIONS:
+        raise ValueError("Curseur d'export invalide")
+    db.decode_cursor(page_cursor)
+    return collection, page_cursor
+
+
+class HistoryExport:
+    """
+    Export complet de l'historique d'un utilisateur, produit en flux.
+
+    Les collections sont parcourues dans l'ordre de db.EXPORT_COLLECTIONS, page par page
+    (db.export_page); chaque page est écrite puis libérée. Chaque document exporté porte
+    son curseur: relancer l'export avec ce curseur reprend juste après lui.
+    - ndjson: une ligne par document ({'type': 'record', ...}), puis une ligne 'done' ou 'error'
+    - csv: une seule collection; en cas d'erreur la réponse est interrompue
+    - zip: un CSV par collection et manifest.json (décomptes, complet ou non, curseur de reprise)
+    """
+
+    def __init__(self, user_id: str, fmt: str = 'ndjson', collections: Optional[List[str]] = None,
+                 cursor: Optional[str] = None):
+        if fmt not in MIMETYPES:
+            raise ValueError(f"Format d'export inconnu: {fmt} (attendu: {', '.join(MIMETYPES)})")
+        unknown = [name for name in collections or [] if name not in db.EXPORT_COLLECTIONS]
+        if unknown:
+            raise ValueError(f"Collection inconnue: {', '.join(unknown)}")
+        self.collections = [name for name in db.EXPORT_COLLECTIONS if not collections or name in collections]
+        if fmt == 'csv' and len(self.collections) != 1:
+            raise ValueError("L'export CSV porte sur une seule collection (?type=), ou utiliser format=zip")
+
+        self.start = decode_position(cursor)
+        if self.start and self.start[0] not in self.collections:
+            raise ValueError("Le curseur ne correspond à aucune des collections exportées")
+        self.user_id = user_id
+        self.format = fmt
+        self.cursor = cursor
+        self.counts = {}
+
+    @property
+    def mimetype(self) -> str:
+        return MIMETYPES[self.format]
+
+    @property
+    def filename(self) -> str:
+        name = self.collections[0] if self.format == 'csv' else 'historique'
+        return f"nectar-{name}-{datetime.now().strftime('%Y%m%d')}.{self.format}"
+
+    def stream(self) -> Iterator[bytes]:
+        return {'ndjson': self._ndjson, 'csv': self._csv, 'zip': self._zip}[self.format]()
+
+    # ==================== LECTURE ====================
+
+    def _pages(self) -> Iterator[Tuple[str, List[Dict]]]:
+        """(collection, documents) page par page, à partir de la position de reprise"""
+        collections = self.collections
+        if self.start:
+            collections = collections[collections.index(self.start[0]):]
+        for collection in collections:
+            page_cursor = self.start[1] if self.start and collection == self.start[0] else None
+            while True:
+                page = db.export_page(collection, self.user_id, limit=EXPORT_PAGE_SIZE, cursor=page_cursor)
+                if page is None:
+                    raise ExportError(f"Lecture de {collection} impossible")
+                if page['items']:
+                    self.counts[collection] = self.counts.get(collection, 0) + len(page['items'])
+                    yield collection, page['items']
+                page_cursor = page['next_cursor']
+                if not page_cursor:
+                    break
+
+    # ==================== FORMATS ====================
+
+    def _ndjson(self) -> Iterator[bytes]:
+        last = self.cursor
+        try:
+            for collection, items in self._pages():
+                lines = []
+                for item in items:
+                    last = encode_position(collection, item)
+                    lines.append(json.dumps({'type': 'record', 'collection': collection, 'cursor': last, 'item': item},
+                                            ensure_ascii=False, default=str))
+                yield ('\n'.join(lines) + '\n').encode('utf-8')
+        except ExportError as e:
+            print(f"Erreur export ({self.user_id}): {e}")
+            yield (json.dumps({'type': 'error', 'error': str(e), 'cursor': last}, ensure_ascii=False) + '\n').encode('utf-8')
+            return
+        yield (json.dumps({'type': 'done', 'counts': self.counts}) + '\n').encode('utf-8')
+
+    def _csv(self) -> Iterator[bytes]:
+        collection = self.collections[0]
+        buffer = io.StringIO()
+        writer = _csv_writer(buffer, collection)
+        yield buffer.getvalue().encode('utf-8')
+        try:
+            for _, items in self._pages():
+                buffer.seek(0)
+                buffer.truncate()
+                for item in items:
+                    writer.writerow(_csv_row(collection, item))
+                yield buffer.getvalue().encode('utf-8')
+        except ExportError as e:
+            # Pas de place pour un message dans un CSV: la réponse est coupée, la dernière ligne reçue
+            # donne le curseur de reprise
+            print(f"Erreur export ({self.user_id}): {e}")
+            raise
+
+    def _zip(self) -> Iterator[bytes]:
+        sink = _ZipSink()
+        manifest = {'exported_at': db.get_timestamp(), 'collections': self.collections, 'resumed_from': self.cursor}
+        last = self.cursor
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            entry = current = None
+            try:
+                for collection, items in self._pages():
+                    if collection != current:
+                        if entry:
+                            entry.close()
+                        current = collection
+                        entry = io.TextIOWrapper(archive.open(f'{collection}.csv', 'w', force_zip64=True),
+                                                 encoding='utf-8', newline='')
+                        writer = _csv_writer(entry, collection)
+                    for item in items:
+                        writer.writerow(_csv_row(collection, item))
+                    last = encode_position(collection, items[-1])
+                    entry.flush()
+                    yield sink.drain()
+                manifest['complete'] = True
+            except ExportError as e:
+                print(f"Erreur export ({self.user_id}): {e}")
+                manifest.update({'complete': False, 'error': str(e)})
+            finally:
+                # Aussi à l'abandon du téléchargement: l'archive ne peut être fermée avec une entrée ouverte
+                if entry:
+                    entry.close()
+            manifest.update({'counts': self.counts, 'cursor': last})
+            archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+        yield sink.drain()
+
+
+def _csv_writer(stream, collection: str) -> csv.DictWriter:
+    writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS[collection] + ['cursor'], extrasaction='ignore')
+    writer.writeheader()
+    return writer
+
+
+def _csv_row(collection: str, item: Dict) -> Dict:
+    row = {key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+           for key, value in item.items()}
+    row['cursor'] = encode_position(collection, item)
+    return row
+
+
+class _ZipSink:
+    """
+    Destination de zipfile sans seek: les entrées sont écrites avec des descripteurs de données,
+    et les octets produits sont repris par drain() au fil de l'export
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
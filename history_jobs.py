@@ -0,0 +1,135 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Callable, Dict, Optional
+
+import database as db
+
+
+# Un job "running" sans mise à jour depuis ce délai est considéré comme interrompu
+STALE_AFTER_SECONDS = 120
+
+
+class HistoryCleaner:
+    """
+    Effacement d'historique en arrière-plan pour les gros volumes.
+
+    La progression est enregistrée dans Firestore (history_jobs/{user_id}) après chaque lot:
+    elle est visible depuis n'importe quel worker, et un job interrompu (worker redémarré)
+    est relancé à la consultation suivante de son état. La suppression par requêtes étant
+    idempotente, la reprise ne fait que supprimer ce qui reste.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='history-clear')
+        self._lock = threading.Lock()
+        self._running = set()
+
+    def start(self, user_id: str, counts: Dict[str, int]) -> Dict:
+        """Lance l'effacement; counts ({collection: nombre}) sert au calcul de la progression"""
+        job = {
+            'status': 'running',
+            'total': sum(counts.values()),
+            'deleted': {name: 0 for name in counts},
+            'started_at': datetime.now().isoformat(),
+            'error': None
+        }
+        db.save_clear_job(user_id, job)
+        self._submit(user_id)
+        return job
+
+    def status(self, user_id: str) -> Optional[Dict]:
+        """État du job de l'utilisateur; reprend un job interrompu"""
+        job = db.get_clear_job(user_id)
+        if job and job.get('status') == 'running' and self._is_stale(job):
+            if self._submit(user_id):
+                job['resumed'] = True
+        return job
+
+    def _submit(self, user_id: str) -> bool:
+        with self._lock:
+            if user_id in self._running:
+                return False
+            self._running.add(user_id)
+        self._pool.submit(self._run, user_id)
+        return True
+
+    def _run(self, user_id: str):
+        try:
+            # En reprise, les lots déjà supprimés restent comptés
+            previous = (db.get_clear_job(user_id) or {}).get('deleted') or {}
+            deleted = dict(previous)
+            progress_lock = threading.Lock()
+
+            def progress(collection, count):
+                with progress_lock:
+                    deleted[collection] = previous.get(collection, 0) + count
+                    db.save_clear_job(user_id, {'deleted': dict(deleted)})
+
+            result = db.clear_all_history(user_id, progress)
+            if result is None:
+                db.save_clear_job(user_id, {'status': 'error', 'error': "Échec de l'effacement, réessayez"})
+            else:
+                db.save_clear_job(user_id, {'status': 'done', 'finished_at': datetime.now().isoformat()})
+        finally:
+            with self._lock:
+                self._running.discard(user_id)
+
+    def _is_stale(self, job: Dict) -> bool:
+        try:
+            updated_at = datetime.fromisoformat(job.get('updated_at'))
+        except (TypeError, ValueError):
+            return True
+        return (datetime.now() - updated_at).total_seconds() > STALE_AFTER_SECONDS
+
+
+class HistoryArchiver:
+    """
+    Archivage de l'historique ancien selon la durée de conservation de l'offre de chaque
+    utilisateur (database.RETENTION_POLICIES).
+
+    Chaque collection est traitée par lots de batch_size entrées, une transaction par lot
+    (db.archive_history), jusqu'à épuisement: un job interrompu reprend au lot suivant.
+    progress(user_id, collection, archivées), si fourni, est appelé après chaque lot.
+    En dry_run rien n'est écrit: le rapport donne les entrées qui seraient archivées.
+    """
+
+    def __init__(self, batch_size: int = db.ARCHIVE_BATCH_SIZE, dry_run: bool = False,
+                 progress: Optional[Callable] = None, today: Optional[date] = None):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.progress = progress
+        self.today = today
+
+    def archive_user(self, user_id: str) -> Optional[Dict]:
+        """
+        Archive l'historique ancien d'un utilisateur (None s'il n'existe pas):
+        {'plan', 'collections': {collection: {'before', 'entries', 'months': {AAAA-MM: n}}}, 'error'}
+        """
+        user = db.get_user_by_id(user_id)
+        if user is None:
+            return None
+        plan = user.get('plan') or db.DEFAULT_PLAN
+        report = {'plan': plan, 'collections': {}, 'error': None}
+        for collection, before in db.retention_cutoffs(plan, self.today).items():
+            if self.dry_run:
+                months = db.preview_archive(user_id, collection, before)
+            else:
+                months = self._archive_collection(user_id, collection, before)
+            if months is None:
+                report['error'] = f"Archivage de {collection} interrompu"
+                return report
+            report['collections'][collection] = {'before': before, 'entries': sum(months.values()), 'months': months}
+        return report
+
+    def _archive_collection(self, user_id: str, collection: str, before: str) -> Optional[Dict[str, int]]:
+        months = {}
+        while True:
+            archived = db.archive_history(user_id, collection, before, self.batch_size)
+            if archived is None:
+                return None
+            db.merge_delta(months, archived)
+            if self.progress and archived:
+                self.progress(user_id, collection, sum(months.values()))
+            if sum(archived.values()) < self.batch_size:
+                return months
@@ -0,0 +1,197 @@
+import os
+from functools import wraps
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+# Tarifs OpenAI en USD par million de tokens: (entrée, entrée en cache, sortie)
+MODEL_PRICING = {
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+}
+
+# Les appels OpenAI durent de 1 à 30 s, Firestore et l'extraction quelques ms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+# ==================== IA ====================
+
+AI_LATENCY = Histogram(
+    'nectar_ai_call_duration_seconds',
+    'Durée des méthodes du Summarizer',
+    ['method'],
+    buckets=LATENCY_BUCKETS
+)
+AI_TOKENS = Counter(
+    'nectar_ai_tokens_total',
+    'Tokens OpenAI consommés (prompt, completion, cached)',
+    ['method', 'kind']
+)
+AI_COST = Counter(
+    'nectar_ai_cost_usd_total',
+    'Coût OpenAI estimé en USD',
+    ['method', 'model']
+)
+AI_FALLBACKS = Counter(
+    'nectar_ai_fallbacks_total',
+    'Réponses produites par une méthode de secours locale',
+    ['method']
+)
+AI_ERRORS = Counter(
+    'nectar_ai_errors_total',
+    'Erreurs lors des appels OpenAI ou du parsing de leur réponse',
+    ['method']
+)
+
+# ==================== CACHES ====================
+
+CACHE_REQUESTS = Counter(
+    'nectar_cache_requests_total',
+    'Consultations de cache (hit ou miss)',
+    ['cache', 'result']
+)
+
+SINGLEFLIGHT = Counter(
+    'nectar_singleflight_calls_total',
+    'Appels coalescés: leader (calcul réel), thread_follower ou process_follower (résultat partagé)',
+    ['name', 'role']
+)
+
+# ==================== LIMITES DE DÉBIT ====================
+
+RATE_LIMITED = Counter(
+    'nectar_rate_limited_total',
+    'Requêtes refusées (429) par classe d\'endpoints et motif (rate: seau vide, in_flight: trop de requêtes en cours)',
+    ['limit', 'reason']
+)
+
+# ==================== PRÉCALCUL ====================
+
+PRECOMPUTE_JOBS = Counter(
+    'nectar_precompute_jobs_total',
+    'Jobs de précalcul spéculatif (scheduled, cancelled)',
+    ['event']
+)
+PRECOMPUTE_STEPS = Counter(
+    'nectar_precompute_steps_total',
+    'Étapes de précalcul par issue (done, error, over_budget)',
+    ['step', 'status']
+)
+
+# ==================== EXTRACTION ====================
+
+EXTRACTION_LATENCY = Histogram(
+    'nectar_extraction_duration_seconds',
+    'Durée de DocumentProcessor.extract_text',
+    ['format'],
+    buckets=LATENCY_BUCKETS
+)
+EXTRACTION_ERRORS = Counter(
+    'nectar_extraction_errors_total',
+    'Échecs d\'extraction de texte',
+    ['format']
+)
+
+# ==================== BASE DE DONNÉES ====================
+
+DB_LATENCY = Histogram(
+    'nectar_db_operation_duration_seconds',
+    'Durée des fonctions du module database',
+    ['operation'],
+    buckets=LATENCY_BUCKETS
+)
+DB_ERRORS = Counter(
+    'nectar_db_errors_total',
+    'Erreurs Firestore par opération',
+    ['operation']
+)
+WRITE_BEHIND_RECORDS = Counter(
+    'nectar_write_behind_records_total',
+    'Enregistrements d\'historique différés (queued, committed, retried, dropped, recovered, sync_fallback)',
+    ['event']
+)
+BLOB_BYTES = Counter(
+    'nectar_blob_bytes_total',
+    'Textes complets stockés: octets bruts, octets compressés écrits, octets évités par déduplication',
+    ['kind']
+)
+
+
+def _timed(histogram, errors, label):
+    """Décorateur générique: mesure la durée et compte les exceptions non gérées"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.labels(label).time():
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    errors.labels(label).inc()
+                    raise
+        return wrapper
+    return decorator
+
+
+def track_ai(method):
+    """Instrumente une méthode du Summarizer"""
+    return _timed(AI_LATENCY, AI_ERRORS, method)
+
+
+def track_db(func):
+    """Instrumente une fonction du module database (label = nom de la fonction)"""
+    return _timed(DB_LATENCY, DB_ERRORS, func.__name__)(func)
+
+
+def record_usage(method, model, usage):
+    """Enregistre les tokens et le coût d'une réponse OpenAI (response.usage)"""
+    if usage is None:
+        return
+
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+
+    AI_TOKENS.labels(method, 'prompt').inc(prompt_tokens)
+    AI_TOKENS.labels(method, 'completion').inc(completion_tokens)
+    AI_TOKENS.labels(method, 'cached').inc(cached_tokens)
+    CACHE_REQUESTS.labels('openai_prompt', 'hit' if cached_tokens else 'miss').inc()
+
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+    if cost:
+        AI_COST.labels(method, model).inc(cost)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """Calcule le coût en USD d'un appel selon MODEL_PRICING (0 si modèle inconnu)"""
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+    input_price, cached_price, output_price = pricing
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+def record_cache(cache, hit):
+    """Compte un hit ou un miss pour le cache nommé"""
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def render_latest():
+    """
+    Sérialise les métriques au format texte Prometheus.
+    Sous gunicorn (PROMETHEUS_MULTIPROC_DIR défini), agrège les fichiers de tous les workers.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
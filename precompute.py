@@ -0,0 +1,159 @@
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import metrics
+
+
+# Estimation avant l'appel: ~4 caractères par token, texte tronqué comme dans chaque prompt,
+# plus les consignes du prompt. La réservation est ensuite corrigée par les tokens facturés.
+CHARS_PER_TOKEN = 4
+PROMPT_OVERHEAD_TOKENS = 200
+SPEND_WINDOW_SECONDS = 3600
+# Propriétaires sans dépense dans la fenêtre oubliés au plus une fois par minute
+SPEND_PRUNE_INTERVAL = 60
+
+
+class Precomputer:
+    """
+    Calcul spéculatif après un upload: résumé par défaut, analyses locales (nuage de mots,
+    statistiques avancées) et analyses OpenAI (mots-clés, sentiment) sont lancés en
+    arrière-plan pour alimenter le cache de résultats du Summarizer. Les clics suivants
+    trouvent alors leur réponse immédiatement.
+
+    Les tokens dépensés de façon spéculative sont plafonnés par utilisateur et par heure;
+    un job peut être annulé (l'utilisateur quitte la page ou charge un autre document).
+    Chaque appel OpenAI spéculatif prend aussi un jeton et une place en cours dans la classe
+    precompute du propriétaire (rate_limiter), distincte de la classe llm de ses clics: il est
+    sauté plutôt que de dépasser ses limites, sans jamais retarder ni refuser une requête.
+    """
+
+    def __init__(self, max_workers: int = 2, token_budget_per_hour: int = 100_000, rate_limiter=None):
+        self.token_budget_per_hour = token_budget_per_hour
+        self.rate_limiter = rate_limiter
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='precompute')
+        self._lock = threading.Lock()
+        self._jobs = {}            # job_id -> (owner, threading.Event)
+        self._latest_by_owner = {}  # owner -> job_id
+        self._spend = {}           # owner -> deque[[timestamp, tokens]]
+        self._last_prune = time.monotonic()
+
+    def schedule(self, owner: str, summarizer, text: str, target_words: int = 150,
+                 style: str = 'paragraph') -> Optional[str]:
+        """Planifie le précalcul d'un document et retourne l'ID du job (None si texte vide)"""
+        if not text or not text.strip():
+            return None
+
+        job_id = uuid.uuid4().hex
+        cancelled = threading.Event()
+        with self._lock:
+            # Un nouveau document remplace le précédent: inutile de finir l'ancien
+            previous = self._latest_by_owner.get(owner)
+            if previous in self._jobs:
+                self._jobs[previous][1].set()
+            self._jobs[job_id] = (owner, cancelled)
+            self._latest_by_owner[owner] = job_id
+
+        self._pool.submit(self._run, job_id, owner, cancelled, summarizer, text, target_words, style)
+        metrics.PRECOMPUTE_JOBS.labels('scheduled').inc()
+        return job_id
+
+    def cancel(self, job_id: str, owner: str) -> bool:
+        """Annule un job de l'utilisateur; les étapes déjà lancées se terminent, les suivantes non"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job[0] != owner:
+                return False
+            job[1].set()
+        metrics.PRECOMPUTE_JOBS.labels('cancelled').inc()
+        return True
+
+    def _run(self, job_id, owner, cancelled, summarizer, text, target_words, style):
+        # Du moins cher au plus cher, dans l'ordre des clics habituels
+        steps = [
+            ('get_word_cloud_data', lambda: summarizer.get_word_cloud_data(text, 40), 0),
+            ('get_advanced_stats', lambda: summarizer.get_advanced_stats(text), 0),
+            # Pas d'appel pour un texte déjà plus court que le résumé demandé
+            ('summarize', lambda: summarizer.summarize(text, target_words, style),
+             self._estimate_tokens(text, 15000, target_words * 4) if len(text.split()) > target_words else 0),
+            ('extract_keywords', lambda: summarizer.extract_keywords(text, 10),
+             self._estimate_tokens(text, 10000, 500)),
+            ('analyze_sentiment', lambda: summarizer.analyze_sentiment(text),
+             self._estimate_tokens(text, 8000, 300)),
+        ]
+        try:
+            for name, step, tokens in steps:
+                if cancelled.is_set():
+                    return
+                if not tokens:
+                    self._run_step(name, step)
+                    continue
+                entry = self._reserve(owner, tokens)
+                if entry is None:
+                    metrics.PRECOMPUTE_STEPS.labels(name, 'over_budget').inc()
+                    continue
+                ticket = None
+                if self.rate_limiter is not None:
+                    ticket, _ = self.rate_limiter.acquire(['precompute'], owner)
+                    if ticket is None:
+                        metrics.PRECOMPUTE_STEPS.labels(name, 'rate_limited').inc()
+                        self._settle(entry, 0)
+                        continue
+                with summarizer.tokens_used() as used:
+                    try:
+                        self._run_step(name, step)
+                    finally:
+                        if self.rate_limiter is not None:
+                            self.rate_limiter.release(ticket)
+                # Dépense réelle: appels multiples ou nouveaux essais compris, rien si servi par le cache
+                self._settle(entry, used[0])
+        finally:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                if self._latest_by_owner.get(owner) == job_id:
+                    del self._latest_by_owner[owner]
+
+    def _run_step(self, name, step):
+        try:
+            step()
+            metrics.PRECOMPUTE_STEPS.labels(name, 'done').inc()
+        except Exception as e:
+            metrics.PRECOMPUTE_STEPS.labels(name, 'error').inc()
+            print(f"Erreur précalcul {name}: {e}")
+
+    def _estimate_tokens(self, text: str, max_chars: int, max_output_tokens: int) -> int:
+        return min(len(text), max_chars) // CHARS_PER_TOKEN + PROMPT_OVERHEAD_TOKENS + max_output_tokens
+
+    def _reserve(self, owner: str, tokens: int):
+        """
+        Réserve des tokens sur le budget horaire de l'utilisateur (fenêtre glissante).
+        Retourne l'entrée réservée, à corriger avec _settle, ou None si le budget est dépassé.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune > SPEND_PRUNE_INTERVAL:
+                self._prune(now)
+            spend = self._spend.setdefault(owner, deque())
+            while spend and spend[0][0] < now - SPEND_WINDOW_SECONDS:
+                spend.popleft()
+            if sum(t for _, t in spend) + tokens > self.token_budget_per_hour:
+                return None
+            entry = [now, tokens]
+            spend.append(entry)
+            return entry
+
+    def _settle(self, entry, tokens: int):
+        """Remplace l'estimation réservée par la dépense réelle"""
+        with self._lock:
+            entry[1] = tokens
+
+    def _prune(self, now):
+        """Oublie les propriétaires dont la fenêtre est vide (appelé sous self._lock)"""
+        self._last_prune = now
+        idle = [owner for owner, spend in self._spend.items()
+                if not spend or spend[-1][0] < now - SPEND_WINDOW_SECONDS]
+        for owner in idle:
+            del self._spend[owner]
@@ -0,0 +1,194 @@
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+import metrics
+
+# Limites par classe d'endpoints et par propriétaire (utilisateur connecté, sinon adresse IP):
+#   - per_minute  jetons rendus par minute (débit soutenu)
+#   - burst       capacité du seau (rafale autorisée après une période calme)
+#   - in_flight   requêtes de la classe en cours en même temps
+# RATE_LIMITS (JSON, même forme) remplace les classes qu'il définit
+RATE_LIMITS = {
+    # Calculs locaux (nuage de mots, statistiques, PDF): quelques ms à quelques centaines de ms
+    'analytics': {'per_minute': 120, 'burst': 30, 'in_flight': 4},
+    # Appels OpenAI: de 1 à 30 s chacun, plafonnés par la limite de débit du compte OpenAI
+    'llm': {'per_minute': 20, 'burst': 10, 'in_flight': 2},
+    # Appels OpenAI spéculatifs après un upload (precompute.Precomputer): classe à part, pour ne
+    # jamais prendre les jetons ni les places des clics de l'utilisateur
+    'precompute': {'per_minute': 10, 'burst': 5, 'in_flight': 1},
+    # Extraction de texte des fichiers envoyés (jusqu'à 16 Mo)
+    'upload': {'per_minute': 30, 'burst': 10, 'in_flight': 2},
+}
+RATE_LIMITS.update(json.loads(os.environ.get('RATE_LIMITS') or '{}'))
+
+# Requêtes en cours oubliées (worker tué avant la fin) au-delà de cette durée
+IN_FLIGHT_TTL = float(os.environ.get('RATE_LIMIT_IN_FLIGHT_TTL', 300))
+# Retry-After proposé quand seul le nombre de requêtes en cours bloque (durée typique d'un appel)
+IN_FLIGHT_RETRY_AFTER = 2
+CLEANUP_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (name, owner)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS in_flight (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS in_flight_owner ON in_flight (name, owner);
+"""
+
+
+class RateLimiter:
+    """
+    Seaux à jetons et plafonds de requêtes en cours, par classe d'endpoints et par propriétaire.
+
+    L'état est partagé entre les workers gunicorn d'une même machine par un petit fichier SQLite
+    (une transaction BEGIN IMMEDIATE par vérification: les workers passent l'un après l'autre).
+    Il n'a pas besoin de survivre à un redémarrage: pas de fsync. En cas d'erreur du fichier,
+    les requêtes passent (la limite ne doit pas rendre le service indisponible).
+    """
+
+    def __init__(self, path: str = None, limits: dict = None):
+        self.path = path or os.environ.get(
+            'RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'nectar-ratelimit.db')
+        )
+        self.limits = limits or RATE_LIMITS
+        self._local = threading.local()
+        self._last_cleanup = 0.0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def acquire(self, names, owner: str, cost: float = 1, slots: int = 1):
+        """
+        Réserve cost jetons et slots places en cours dans chaque classe de names, tout ou rien.
+        slots: threads qui appelleront le service en même temps pour cette requête, au plus le
+        plafond de la classe (voir slots_for). Retourne (ticket, None) si la requête passe, à rendre
+        avec release(ticket), sinon (None, secondes à attendre avant de réessayer).
+        """
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = self._acquire(connection, names, owner, cost, slots, now)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except Exception as e:
+            print(f"Erreur RateLimiter.acquire: {e}")
+            return [], None
+        self._maybe_cleanup(now)
+        return result
+
+    def _acquire(self, connection, names, owner, cost, slots, now):
+        buckets = {}
+        retry_after = 0
+        for name in names:
+            limit = self.limits[name]
+            rate = limit['per_minute'] / 60
+            row = connection.execute(
+                'SELECT tokens, updated_at FROM buckets WHERE name = ? AND owner = ?', (name, owner)
+            ).fetchone()
+            tokens = limit['burst'] if row is None else min(limit['burst'], row[0] + (now - row[1]) * rate)
+            # Une requête plus coûteuse que le seau entier passe quand il est plein et le laisse
+            # endetté (jetons négatifs): elle est payée en entier, le débit soutenu est respecté
+            needed = min(cost, limit['burst'])
+            if tokens < needed:
+                metrics.RATE_LIMITED.labels(name, 'rate').inc()
+                retry_after = max(retry_after, (needed - tokens) / rate)
+                continue
+            running = connection.execute(
+                'SELECT COUNT(*) FROM in_flight WHERE name = ? AND owner = ? AND expires_at > ?', (name, owner, now)
+            ).fetchone()[0]
+            if running + min(slots, limit['in_flight']) > limit['in_flight']:
+                metrics.RATE_LIMITED.labels(name, 'in_flight').inc()
+                retry_after = max(retry_after, IN_FLIGHT_RETRY_AFTER)
+                continue
+            buckets[name] = (tokens - cost, min(slots, limit['in_flight']))
+
+        if retry_after:
+            return None, retry_after
+
+        ticket = []
+        for name, (tokens, places) in buckets.items():
+            connection.execute(
+                'INSERT OR REPLACE INTO buckets (name, owner, tokens, updated_at) VALUES (?, ?, ?, ?)',
+                (name, owner, tokens, now)
+            )
+            for _ in range(places):
+                ticket.append(uuid.uuid4().hex)
+                connection.execute(
+                    'INSERT INTO in_flight (id, name, owner, expires_at) VALUES (?, ?, ?, ?)',
+                    (ticket[-1], name, owner, now + IN_FLIGHT_TTL)
+                )
+        return ticket, None
+
+    def slots_for(self, name: str, workers: int) -> int:
+        """Threads accordés à une requête qui en voudrait workers: au plus le plafond de la classe"""
+        return max(1, min(workers, self.limits[name]['in_flight']))
+
+    def refund(self, names, owner: str, cost: float = 1):
+        """Rend cost jetons pris par acquire dans chaque classe de names (requête finalement gratuite)"""
+        now = time.time()
+        try:
+            # Un seau absent est plein (ou a été oublié par le nettoyage): rien à rendre
+            self._connection().executemany(
+                'UPDATE buckets SET tokens = MIN(?, tokens + (? - updated_at) * ? + ?), updated_at = ? '
+                'WHERE name = ? AND owner = ?',
+                [(self.limits[name]['burst'], now, self.limits[name]['per_minute'] / 60, cost, now, name, owner)
+                 for name in names]
+            )
+        except Exception as e:
+            print(f"Erreur RateLimiter.refund: {e}")
+
+    def release(self, ticket):
+        """Libère les places en cours réservées par acquire"""
+        if not ticket:
+            return
+        try:
+            self._connection().executemany('DELETE FROM in_flight WHERE id = ?', [(entry,) for entry in ticket])
+        except Exception as e:
+            print(f"Erreur RateLimiter.release: {e}")
+
+    def _maybe_cleanup(self, now):
+        """Oublie les seaux redevenus pleins et les requêtes en cours expirées (au plus une fois par minute)"""
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        try:
+            connection = self._connection()
+            # Un seau redevenu plein (dette comprise) est supprimé: cela revient au même
+            connection.executemany(
+                'DELETE FROM buckets WHERE name = ? AND tokens + (? - updated_at) * ? >= ?',
+                [(name, now, limit['per_minute'] / 60, limit['burst']) for name, limit in self.limits.items()]
+            )
+            connection.execute('DELETE FROM in_flight WHERE expires_at < ?', (now,))
+        except Exception as e:
+            print(f"Erreur RateLimiter.cleanup: {e}")
+
+
+def retry_after_seconds(seconds):
+    """Délai annoncé dans Retry-After: secondes entières, arrondies au-dessus"""
+    return max(1, math.ceil(seconds))
@@ -0,0 +1,143 @@
+"""
+Compare les backends de stockage (SQLite local, Firestore) sur des historiques réalistes.
+
+Pour chaque taille d'historique, un utilisateur de test est rempli par lots, puis on mesure:
+  - save_summary           écriture d'un résumé (avec mise à jour des agrégats)
+  - get_summaries          première page de l'historique (20 éléments)
+  - parcours complet       toutes les pages de l'historique, curseur par curseur
+  - get_summary_by_id      lecture du détail d'un résumé
+  - get_global_stats       statistiques de /stats
+puis le bilan des textes complets (compression, déduplication).
+Les données de test sont supprimées à la fin.
+
+Usage: python scripts/bench_storage.py [--backends sqlite firestore] [--sizes 100 1000 5000] [--repeat 20]
+  Firestore nécessite des identifiants (voir README) ou FIRESTORE_EMULATOR_HOST; il est ignoré sinon.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database as db  # noqa: E402
+
+
+WORDS = ('analyse document résultat section important données rapport projet client marché '
+         'stratégie croissance équipe objectif performance risque budget qualité service produit').split()
+
+
+def random_text(word_count):
+    return ' '.join(random.choice(WORDS) for _ in range(word_count))
+
+
+def firestore_available():
+    return bool(
+        os.environ.get('FIRESTORE_EMULATOR_HOST')
+        or os.path.exists(os.path.join(ROOT, 'firebase-credentials.json'))
+        or os.environ.get('FIREBASE_CREDENTIALS')
+        or os.environ.get('FIREBASE_PRIVATE_KEY')
+    )
+
+
+def save(user_id, batch=None):
+    original = random_text(900)
+    return db.save_summary(
+        user_id=user_id,
+        filename=f"document-{uuid.uuid4().hex[:8]}.pdf",
+        original_text=original,
+        summary=random_text(150),
+        original_words=len(original.split()),
+        summary_words=150,
+        target_words=150,
+        style=random.choice(['paragraph', 'bullets', 'executive']),
+        method='openai',
+        model='gpt-4o-mini',
+        batch=batch
+    )
+
+
+def timed(func, repeat):
+    """Durées en ms de `repeat` appels à func()"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"p50 {statistics.median(ordered):8.2f} ms   p95 {p95:8.2f} ms"
+
+
+def walk_history(user_id):
+    cursor, pages = None, 0
+    while True:
+        page = db.get_summaries(user_id, limit=20, cursor=cursor)
+        pages += 1
+        cursor = page['next_cursor']
+        if not cursor:
+            return pages
+
+
+def bench_backend(name, sizes, repeat):
+    print(f"\n=== {name} ===")
+    for size in sizes:
+        user_id = f"bench-{size}-{uuid.uuid4().hex[:8]}"
+        start = time.perf_counter()
+        with db.BatchWriter(size=200) as writer:
+            for _ in range(size):
+                save(user_id, batch=writer)
+        fill_s = time.perf_counter() - start
+        print(f"\n{size} résumés (remplissage par lots: {fill_s:.1f} s, {size / fill_s:.0f} docs/s)")
+
+        try:
+            sample_id = db.get_summaries(user_id, limit=1)['items'][0]['id']
+            pages = []
+            results = {
+                'save_summary': timed(lambda: save(user_id), repeat),
+                'get_summaries': timed(lambda: db.get_summaries(user_id, limit=20), repeat),
+                'parcours complet': timed(lambda: pages.append(walk_history(user_id)), max(1, repeat // 10)),
+                'get_summary_by_id': timed(lambda: db.get_summary_by_id(sample_id, user_id), repeat),
+                'get_global_stats': timed(lambda: db.get_global_stats(user_id), repeat),
+            }
+            for label, durations in results.items():
+                suffix = f"  ({pages[0]} pages)" if label == 'parcours complet' else ''
+                print(f"  {label:<18} {summarize(durations)}{suffix}")
+            report = db.get_blob_stats()
+            if report:
+                print(f"  textes complets     {report['blobs']} blobs pour {report['references']} références, "
+                      f"compression x{report['compression_ratio']}, "
+                      f"{report['dedup_saved_bytes'] / 1024:.0f} Ko évités par la déduplication")
+        finally:
+            db.clear_all_history(user_id)
+            db.gc_blobs()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['sqlite', 'firestore'], choices=sorted(db.BACKENDS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for backend in args.backends:
+        if backend == 'firestore' and not firestore_available():
+            print("\n=== firestore ===\nignoré: aucun identifiant Firebase ni FIRESTORE_EMULATOR_HOST")
+            continue
+        with tempfile.TemporaryDirectory() as workdir:
+            db.configure(backend, os.path.join(workdir, 'bench.db'))
+            bench_backend(backend, args.sizes, args.repeat)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Vérifie le budget de démarrage à froid (Vercel, nouveaux workers gunicorn).
+
+Lance un interpréteur neuf qui importe l'application, puis interroge /health et /N.svg.
+Échoue (code 1) si:
+  - l'import + create_app dépasse COLD_START_BUDGET_MS (800 ms par défaut),
+  - un module lourd (SDK OpenAI, Firebase, parseurs PDF/DOCX) est chargé
+    avant la première requête qui en a réellement besoin.
+
+Usage: python scripts/check_cold_start.py [--profile N]
+  --profile N  affiche les N imports les plus coûteux (python -X importtime)
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_MS = float(os.environ.get('COLD_START_BUDGET_MS', 800))
+HEAVY_MODULES = ['openai', 'firebase_admin', 'google.cloud.firestore', 'PyPDF2', 'docx', 'pdfplumber']
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - start) * 1000
+client = app.app.test_client()
+statuses = {{path: client.get(path).status_code for path in ('/health', '/N.svg')}}
+print(json.dumps({{
+    'import_ms': import_ms,
+    'statuses': statuses,
+    'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_probe(importtime=False):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    # Aucune clé: une initialisation anticipée échouerait ou serait détectée
+    env.pop('OPENAI_API_KEY', None)
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE]
+    return subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def print_profile(stderr, top):
+    """Affiche les imports les plus lents (temps cumulé) à partir de la sortie -X importtime"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    print(f"{'cumulé (ms)':>12} {'propre (ms)':>12}  module")
+    for cumulative_us, self_us, name in rows[:top]:
+        print(f"{cumulative_us / 1000:12.1f} {self_us / 1000:12.1f}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', type=int, default=0, metavar='N')
+    args = parser.parse_args()
+
+    # Première exécution pour chauffer le cache disque, puis mesure
+    run_probe()
+    result = json.loads(run_probe().stdout.strip().splitlines()[-1])
+
+    if args.profile:
+        print_profile(run_probe(importtime=True).stderr, args.profile)
+        print()
+
+    failures = []
+    print(f"Import + create_app: {result['import_ms']:.0f} ms (budget {BUDGET_MS:.0f} ms)")
+    if result['import_ms'] > BUDGET_MS:
+        failures.append('budget de démarrage dépassé')
+    for path, status in result['statuses'].items():
+        print(f"GET {path}: {status}")
+        if status != 200:
+            failures.append(f'{path} a répondu {status}')
+    if result['loaded']:
+        failures.append(f"modules lourds chargés au démarrage: {', '.join(result['loaded'])}")
+
+    for failure in failures:
+        print(f"ÉCHEC: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
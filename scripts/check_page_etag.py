@@ -0,0 +1,101 @@
+"""
+Vérifie la revalidation de la première page de l'historique et des favoris (ETag, 304).
+
+Sur une base SQLite temporaire, pour chaque encodage (identity, gzip: l'ETag devient alors
+faible), vérifie que:
+  - la première lecture renvoie 200 avec un ETag,
+  - la revalidation (If-None-Match) renvoie 304 sans lire la page (ni cache, ni base),
+  - après une écriture, la revalidation renvoie de nouveau 200.
+Échoue (code 1) sinon.
+
+Usage: python scripts/check_page_etag.py
+"""
+import os
+import sys
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Assez de résumés pour dépasser le seuil de compression des réponses
+SUMMARIES = 20
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='check-etag-')
+    os.environ.update(
+        STORAGE_BACKEND='sqlite',
+        SQLITE_PATH=os.path.join(workdir, 'nectar.db'),
+        PAGE_VERSIONS_DB=os.path.join(workdir, 'page-versions.db'),
+        UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+        WRITE_BEHIND_ENABLED='0',
+        RATE_LIMIT_ENABLED='0',
+    )
+    sys.path.insert(0, ROOT)
+    import app
+    import database as db
+
+    backend = db.get_backend()
+    # Lectures de page demandées par les routes (cache des premières pages compris)
+    reads = {'summaries': 0, 'favorites': 0}
+
+    def counting(collection):
+        read = getattr(db, f'get_{collection}')
+
+        def counted(*args, **kwargs):
+            reads[collection] += 1
+            return read(*args, **kwargs)
+        return counted
+
+    for collection in reads:
+        setattr(db, f'get_{collection}', counting(collection))
+
+    client = app.app.test_client()
+    client.post('/auth/register', json={'username': 'etag', 'email': 'etag@example.com', 'password': 'etag-check'})
+    with client.session_transaction() as session:
+        user_id = session['user_id']
+
+    def write(collection, index):
+        if collection == 'summaries':
+            backend.save_summary(user_id=user_id, filename=f'document-{index}.txt',
+                                 original_text='texte ' * 200, summary='résumé du document ' * 10,
+                                 original_words=200, summary_words=30, target_words=30,
+                                 style='paragraph', method='openai', model='check')
+        else:
+            backend.save_favorite(user_id, f'Favori {index}', 'contenu du favori ' * 20)
+
+    for index in range(SUMMARIES):
+        write('summaries', index)
+        write('favorites', index)
+
+    failures = []
+    paths = {'summaries': '/api/history', 'favorites': '/favorites'}
+    for encoding in ('identity', 'gzip'):
+        for collection, path in paths.items():
+            label = f'{path} ({encoding})'
+            headers = {'Accept-Encoding': encoding}
+            first = client.get(path, headers=headers)
+            etag = first.headers.get('ETag')
+            print(f"{label}: {first.status_code}, ETag {etag}, {first.headers.get('Content-Encoding', 'identity')}")
+            if first.status_code != 200 or not etag:
+                failures.append(f'{label}: première lecture sans ETag')
+                continue
+
+            before = reads[collection]
+            again = client.get(path, headers=dict(headers, **{'If-None-Match': etag}))
+            print(f"{label}: revalidation {again.status_code}, {reads[collection] - before} lecture(s)")
+            if again.status_code != 304 or reads[collection] != before:
+                failures.append(f'{label}: revalidation sans 304 avant lecture')
+
+            write(collection, encoding)
+            changed = client.get(path, headers=dict(headers, **{'If-None-Match': etag}))
+            print(f"{label}: après écriture {changed.status_code}")
+            if changed.status_code != 200:
+                failures.append(f'{label}: page obsolète resservie après écriture')
+
+    for failure in failures:
+        print(f"ÉCHEC: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+Mesure la capacité de service en requêtes simultanées selon le modèle de workers gunicorn.
+
+Un faux serveur OpenAI local répond à chaque appel Chat Completions après --llm-delay secondes
+(OPENAI_BASE_URL pointe dessus: aucune clé ni coût réel). L'application est lancée sous gunicorn
+avec gunicorn.conf.py, une fois par mode, avec --workers processus (1 par défaut: la capacité
+mesurée est celle d'un CPU), puis reçoit --requests POST /summarize (textes tous différents,
+donc ni cache ni coalescence) par --concurrency clients simultanés, chacun connecté avec son
+propre compte (les limites de débit sont par utilisateur) et envoyant ses requêtes l'une après
+l'autre.
+Modes:
+  - sync     GUNICORN_WORKER_CLASS=sync, un thread: une requête par processus (ancien Procfile)
+  - gthread  GUNICORN_THREADS threads par processus (--threads, 16 par défaut)
+Pour chaque mode: débit, latences p50/p95/max et requêtes servies en même temps
+(débit x délai OpenAI).
+
+--abusers N ajoute N clients partageant un seul compte qui envoient /summarize en boucle, sans
+pause, pendant toute la mesure: les latences des autres clients doivent rester stables, l'abuseur
+recevant des 429 (--no-rate-limit pour comparer sans limites de débit).
+
+Usage: python scripts/load_test.py [--modes sync gthread] [--requests 64] [--concurrency 32]
+                                   [--llm-delay 2] [--workers 1] [--threads 16]
+                                   [--abusers 0] [--no-rate-limit]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.cookiejar import CookieJar
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ('analyse document résultat section important données rapport projet client marché '
+         'stratégie croissance équipe objectif performance risque budget qualité service produit').split()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def fake_openai(delay):
+    """Serveur Chat Completions minimal, chaque réponse attendue delay secondes"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(delay)
+            body = json.dumps({
+                'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': int(time.time()),
+                'model': 'gpt-4o-mini',
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': 'Résumé de test.'}}],
+                'usage': {'prompt_tokens': 100, 'completion_tokens': 10, 'total_tokens': 110},
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_app(mode, args, openai_url, workdir):
+    port = free_port()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='sk-load-test',
+        OPENAI_BASE_URL=openai_url,
+        STORAGE_BACKEND='sqlite',
+        SQLITE_PATH=os.path.join(workdir, 'load.db'),
+        WRITE_BEHIND_ENABLED='0',
+        PRECOMPUTE_ENABLED='0',
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, f'metrics-{mode}'),
+        # Résultats partagés entre workers: propres à chaque mode, sinon le second les relirait
+        SINGLEFLIGHT_DIR=os.path.join(workdir, f'singleflight-{mode}'),
+        RATE_LIMIT_DB=os.path.join(workdir, f'ratelimit-{mode}.db'),
+        RATE_LIMIT_ENABLED='0' if args.no_rate_limit else '1',
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_WORKER_CLASS=mode,
+        GUNICORN_THREADS=str(args.threads if mode == 'gthread' else 1),
+        GUNICORN_TIMEOUT=str(max(120, int(args.llm_delay * 4))),
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'{base_url}/health', timeout=1).read()
+            return process, base_url
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn ({mode}) n'a pas démarré")
+
+
+class Client:
+    """Client HTTP avec son propre compte (cookie de session)"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        name = uuid.uuid4().hex[:12]
+        self.post('/auth/register', {'username': name, 'email': f'{name}@example.com', 'password': 'load-test'}, 60)
+
+    def post(self, path, payload, timeout):
+        request = urllib.request.Request(f'{self.base_url}{path}', data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with self.opener.open(request, timeout=timeout) as response:
+            return json.loads(response.read())
+
+    def summarize(self, index, timeout):
+        """(statut, latence): ok, limited (429) ou error"""
+        # Texte unique par requête, assez long pour passer par OpenAI (au-delà de target_words)
+        text = f"Document {index}. " + ' '.join(WORDS[(index + i) % len(WORDS)] for i in range(300))
+        start = time.perf_counter()
+        try:
+            result = self.post('/summarize', {'text': text, 'target_words': 50, 'filename': f'doc-{index}.txt'}, timeout)
+            status = 'ok' if result.get('method') == 'openai' else 'error'
+        except urllib.error.HTTPError as e:
+            status = 'limited' if e.code == 429 else 'error'
+        except Exception:
+            status = 'error'
+        return status, time.perf_counter() - start
+
+
+def abuse(client, counts, stop):
+    """Envoie /summarize en boucle jusqu'à stop, en ignorant Retry-After"""
+    index = 0
+    while not stop.is_set():
+        status, _ = client.summarize(-1000000 - index, timeout=60)
+        counts[status] = counts.get(status, 0) + 1
+        index += 1
+
+
+def run_mode(mode, args, openai_url, workdir):
+    process, base_url = start_app(mode, args, openai_url, workdir)
+    stop = threading.Event()
+    abuse_counts = {}
+    try:
+        clients = [Client(base_url) for _ in range(args.concurrency)]
+        clients[0].summarize(-1, timeout=60)  # chauffe: import du SDK OpenAI
+        abuser = Client(base_url) if args.abusers else None
+        abusers = [threading.Thread(target=abuse, args=(abuser, abuse_counts, stop), daemon=True)
+                   for _ in range(args.abusers)]
+        for thread in abusers:
+            thread.start()
+
+        def run_client(k):
+            return [clients[k].summarize(i, args.timeout) for i in range(k, args.requests, args.concurrency)]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = [result for batch in pool.map(run_client, range(args.concurrency)) for result in batch]
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in abusers:
+            thread.join()
+    finally:
+        stop.set()
+        process.terminate()
+        process.wait(timeout=30)
+
+    latencies = sorted(latency for status, latency in results if status == 'ok')
+    throughput = len(latencies) / elapsed
+    return {
+        'mode': mode,
+        'ok': len(latencies),
+        'limited': sum(1 for status, _ in results if status == 'limited'),
+        'errors': sum(1 for status, _ in results if status == 'error'),
+        'elapsed': elapsed,
+        'throughput': throughput,
+        'p50': statistics.median(latencies) if latencies else 0,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] if latencies else 0,
+        'max': latencies[-1] if latencies else 0,
+        'concurrent': throughput * args.llm_delay,
+        'abuse': abuse_counts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['sync', 'gthread'], choices=['sync', 'gthread'])
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--llm-delay', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=300, help='délai client par requête (s)')
+    parser.add_argument('--abusers', type=int, default=0, help='clients d\'un même compte envoyant en boucle')
+    parser.add_argument('--no-rate-limit', action='store_true', help='désactive les limites de débit (RATE_LIMIT_ENABLED=0)')
+    args = parser.parse_args()
+
+    server = fake_openai(args.llm_delay)
+    openai_url = f'http://127.0.0.1:{server.server_address[1]}/v1'
+    print(f"{args.requests} requêtes /summarize, {args.concurrency} clients, OpenAI simulé à {args.llm_delay:g} s, "
+          f"{args.workers} worker(s) ({os.cpu_count()} CPU), {args.abusers} abuseur(s), "
+          f"limites de débit {'désactivées' if args.no_rate_limit else 'actives'}")
+    print(f"{'mode':<8} {'ok':>4} {'429':>4} {'err':>4} {'durée (s)':>10} {'req/s':>7} {'p50 (s)':>8} {'p95 (s)':>8} "
+          f"{'max (s)':>8} {'simultanées':>12}")
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for mode in args.modes:
+                row = run_mode(mode, args, openai_url, workdir)
+                print(f"{row['mode']:<8} {row['ok']:>4} {row['limited']:>4} {row['errors']:>4} {row['elapsed']:>10.1f} "
+                      f"{row['throughput']:>7.2f} {row['p50']:>8.1f} {row['p95']:>8.1f} {row['max']:>8.1f} "
+                      f"{row['concurrent']:>12.1f}")
+                if args.abusers:
+                    abuse_counts = row['abuse']
+                    print(f"{'':<8} abuseur: {abuse_counts.get('ok', 0)} servies, {abuse_counts.get('limited', 0)} "
+                          f"refusées (429), {abuse_counts.get('error', 0)} erreurs")
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
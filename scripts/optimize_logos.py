@@ -0,0 +1,71 @@
+"""
+Produit les variantes allégées des logos (N.min.svg, N_blanc.min.svg, N_noire.min.svg).
+
+Les logos d'origine sont des images PNG 890x863 embarquées dans un SVG (l'image et son masque
+de transparence), avec un manifeste C2PA de 16 Ko. La variante fusionne l'image et son masque en
+un seul PNG à palette avec transparence, recadré sur la zone visible et réduit à --size pixels
+de large (le logo est affiché entre 24 et 60 px: 192 px couvrent les écrans haute densité),
+sans métadonnées.
+
+Usage: python scripts/optimize_logos.py [--size 192]
+"""
+import argparse
+import base64
+import io
+import os
+import re
+import sys
+
+from PIL import Image
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOGOS = ('N.svg', 'N_blanc.svg', 'N_noire.svg')
+
+_VIEWBOX = re.compile(r'viewBox="([\d.\s-]+)"')
+_IMAGE = re.compile(r'<image[^>]*href="data:image/png;base64,([^"]+)"')
+_TRANSFORM = re.compile(r'<g transform="matrix\(([^)]+)\)"><image')
+
+
+def optimize(svg, size):
+    """SVG allégé équivalent à svg (masque appliqué, image redimensionnée à size px de large)"""
+    _, _, width, height = (float(value) for value in _VIEWBOX.search(svg).group(1).split())
+    mask, image = (Image.open(io.BytesIO(base64.b64decode(data))) for data in _IMAGE.findall(svg))
+    a, _, _, d, e, f = (float(value) for value in _TRANSFORM.search(svg).group(1).split(','))
+
+    # Masque de luminance: la luminance du masque devient la transparence de l'image
+    logo = image.convert('RGB')
+    logo.putalpha(mask.convert('L'))
+
+    # Zone du viewBox en pixels de l'image (matrice de placement inversée)
+    box = (round(-e / a), round(-f / d), round((width - e) / a), round((height - f) / d))
+    logo = logo.crop(box)
+    logo = logo.resize((size, round(size * height / width)), Image.LANCZOS)
+    # Palette de 256 couleurs (transparence comprise): invisible à la taille d'affichage
+    logo = logo.quantize(256, method=Image.Quantize.FASTOCTREE)
+
+    buffer = io.BytesIO()
+    logo.save(buffer, 'PNG', optimize=True)
+    data = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width:g} {height:g}">'
+            f'<image width="{width:g}" height="{height:g}" href="data:image/png;base64,{data}"/></svg>')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=192)
+    args = parser.parse_args()
+
+    for name in LOGOS:
+        with open(os.path.join(ROOT, name), encoding='utf-8') as source:
+            svg = source.read()
+        optimized = optimize(svg, args.size)
+        target = name.replace('.svg', '.min.svg')
+        with open(os.path.join(ROOT, target), 'w', encoding='utf-8') as output:
+            output.write(optimized)
+        print(f"{name}: {len(svg) / 1024:.0f} Ko -> {target}: {len(optimized) / 1024:.1f} Ko")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
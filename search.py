@@ -0,0 +1,97 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+
+# Recherche plein texte dans l'historique: découpage en termes et classement BM25,
+# communs aux backends de stockage (voir search_history dans storage_*)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MAX_TERMS_PER_ENTRY = 200   # termes distincts indexés par entrée (les plus fréquents)
+MAX_TERM_LENGTH = 40
+MAX_QUERY_TERMS = 8
+MAX_PREFIX_EXPANSIONS = 10  # termes de l'index retenus pour chaque préfixe de la requête
+
+# Au-delà de EXACT_SCORING_LIMIT occurrences à évaluer, seules les CHAMPION_LIST_SIZE meilleures
+# occurrences de chaque terme (par impact) sont lues; les RESCORE_CANDIDATES entrées les mieux
+# placées sont ensuite notées exactement: coût borné pour les termes fréquents et préfixes courts
+EXACT_SCORING_LIMIT = 5000
+CHAMPION_LIST_SIZE = 200
+RESCORE_CANDIDATES = 200
+
+STOP_WORDS = frozenset('''
+    au aux avec ce ces cette dans de des du elle en est et il ils je la le les leur lui ma mais me
+    meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sont sur ta te
+    tes toi ton tu un une vos votre vous sans ete etre avoir fait plus comme aussi tout tous
+    an and are as at be by for from has have in is it its of on or that the this to was were will with
+'''.split())
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """Minuscules sans accents: « Été » et « ete » donnent le même terme"""
+    decomposed = unicodedata.normalize('NFKD', (text or '').lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    """Termes indexables d'un texte (mots vides et mots d'une lettre exclus)"""
+    return [
+        word for word in _WORD.findall(normalize(text))
+        if len(word) > 1 and len(word) <= MAX_TERM_LENGTH and word not in STOP_WORDS
+    ]
+
+
+def index_terms(text):
+    """Fréquences des termes d'une entrée (au plus MAX_TERMS_PER_ENTRY) et longueur du document"""
+    tokens = tokenize(text)
+    return dict(Counter(tokens).most_common(MAX_TERMS_PER_ENTRY)), len(tokens)
+
+
+def query_terms(query):
+    """Préfixes recherchés: chaque terme de la requête doit être le début d'un terme indexé"""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+def idf(df, n_docs):
+    """Poids d'un terme présent dans df documents sur n_docs (toujours positif)"""
+    return math.log(1 + (max(n_docs, df) - df + 0.5) / (df + 0.5))
+
+
+def impact(tf, dl, avgdl):
+    """Part du score BM25 propre au document (fréquence du terme normalisée par la longueur)"""
+    return tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / (avgdl or 1)))
+
+
+def bm25(tf, df, dl, n_docs, avgdl):
+    """Score BM25 d'un terme dans un document"""
+    return idf(df, n_docs) * impact(tf, dl, avgdl)
+
+
+def rank(matches, n_docs, avgdl, limit, accept=None):
+    """
+    Classe les documents à partir des listes d'occurrences.
+    matches: {préfixe: {terme: {clé du document: (tf, longueur)}}}. Un document doit
+    contenir chaque préfixe (ET); son score est la somme BM25 des termes trouvés.
+    accept(clé), si fourni, filtre les documents. Retourne [(clé, score)] du meilleur au moins bon.
+    """
+    scores = None
+    for terms in matches.values():
+        prefix_scores = {}
+        for postings in terms.values():
+            df = len(postings)
+            for key, (tf, dl) in postings.items():
+                prefix_scores[key] = prefix_scores.get(key, 0) + bm25(tf, df, dl, n_docs, avgdl)
+        if scores is None:
+            scores = prefix_scores
+        else:
+            scores = {key: score + prefix_scores[key] for key, score in scores.items() if key in prefix_scores}
+        if not scores:
+            return []
+    if accept:
+        scores = {key: score for key, score in (scores or {}).items() if accept(key)}
+    return heapq.nlargest(limit, (scores or {}).items(), key=lambda item: item[1])
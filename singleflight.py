@@ -0,0 +1,143 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescence limitée aux threads du processus
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalescence des appels identiques en cours ("single-flight").
+
+    Dans un worker, le premier thread qui demande une clé calcule le résultat; les threads
+    suivants attendent et reçoivent une copie du même résultat. Entre workers gunicorn d'une
+    même machine, un verrou fichier (flock) par clé désigne un seul calculateur; le résultat
+    est déposé dans un fichier JSON que les autres workers lisent au lieu de recalculer.
+    """
+
+    def __init__(self, name: str, lock_dir: str = None, result_ttl: float = 300,
+                 wait_timeout: float = 120):
+        self.name = name
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self.lock_dir = lock_dir or os.environ.get(
+            'SINGLEFLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'nectar-singleflight')
+        )
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        if fcntl is not None:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def do(self, key: str, compute, cacheable=lambda result: True):
+        """Exécute compute() une seule fois pour tous les appels simultanés de même clé"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.SINGLEFLIGHT.labels(self.name, 'thread_follower').inc()
+            if not call.done.wait(self.wait_timeout):
+                return compute()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = self._do_across_processes(key, compute, cacheable)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    # ==================== ENTRE PROCESSUS ====================
+
+    def _do_across_processes(self, key, compute, cacheable):
+        if fcntl is None:
+            metrics.SINGLEFLIGHT.labels(self.name, 'leader').inc()
+            return compute()
+
+        self._maybe_cleanup()
+        lock_path = os.path.join(self.lock_dir, f"{key}.lock")
+        result_path = os.path.join(self.lock_dir, f"{key}.json")
+
+        with open(lock_path, 'a') as lock_file:
+            if not self._acquire(lock_file):
+                # Le calculateur d'un autre worker est bloqué: on calcule nous-mêmes
+                return compute()
+            try:
+                shared = self._read_result(result_path)
+                if shared is not None:
+                    metrics.SINGLEFLIGHT.labels(self.name, 'process_follower').inc()
+                    return shared
+
+                metrics.SINGLEFLIGHT.labels(self.name, 'leader').inc()
+                result = compute()
+                if cacheable(result):
+                    self._write_result(result_path, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _acquire(self, lock_file) -> bool:
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.05)
+
+    def _read_result(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) > self.result_ttl:
+                return None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_result(self, path, result):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.lock_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            print(f"Erreur single-flight ({self.name}): {e}")
+
+    def _maybe_cleanup(self):
+        """Supprime, au plus une fois par minute, les résultats et verrous expirés"""
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        try:
+            for entry in os.scandir(self.lock_dir):
+                if now - entry.stat().st_mtime > self.result_ttl:
+                    os.remove(entry.path)
+        except OSError:
+            pass
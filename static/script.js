@@ -1,5 +1,7 @@
 // ==================== STATE ====================
 let extractedText = '';
+let documentOutline = [];
+let precomputeId = null;
 let currentSummary = '';
 let currentUser = null;
 
@@ -154,21 +156,29 @@ fileInput.addEventListener('change', (e) => {
 });
 removeFile.addEventListener('click', resetFile);
 
+// Au-delà de cette taille, envoi par morceaux: pas de limite de 16 Mo, reprise après une coupure
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const CHUNK_RETRIES = 5;
+
 function handleFileUpload(file) {
-    const formData = new FormData();
-    formData.append('file', file);
+    const options = {
+        // Précalcul spéculatif du résumé avec les réglages actuels (si activé côté serveur)
+        precompute: '1',
+        target_words: wordSlider.value,
+        style: document.getElementById('summaryStyle').value
+    };
+    cancelPrecompute();
     
     showLoading('Extraction du texte...');
     
-    fetch('/upload', {
-        method: 'POST',
-        body: formData
-    })
-    .then(res => res.json())
+    const request = file.size > CHUNKED_UPLOAD_THRESHOLD ? uploadInChunks(file, options) : uploadAtOnce(file, options);
+    request
     .then(data => {
         hideLoading();
         if (data.success) {
             extractedText = data.text;
+            documentOutline = data.outline || [];
+            precomputeId = data.precompute_id || null;
             originalText.value = data.text;
             fileName.textContent = file.name;
             fileSize.textContent = formatFileSize(file.size);
@@ -187,8 +197,76 @@ function handleFileUpload(file) {
     });
 }
 
+function uploadAtOnce(file, options) {
+    const formData = new FormData();
+    formData.append('file', file);
+    Object.entries(options).forEach(([key, value]) => formData.append(key, value));
+    return fetch('/upload', { method: 'POST', body: formData }).then(res => res.json());
+}
+
+async function sha256Hex(blob) {
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+}
+
+// Envoi par morceaux: chaque morceau porte sa somme SHA-256; après une erreur, le serveur
+// indique la dernière position validée et l'envoi reprend à partir de là
+async function uploadInChunks(file, options) {
+    const init = await fetch('/upload/init', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    }).then(res => res.json());
+    if (!init.success) return init;
+    
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+        showLoading(`Envoi du document... ${Math.floor(offset * 100 / file.size)} %`);
+        const chunk = file.slice(offset, offset + init.chunk_size);
+        try {
+            const res = await fetch(`/upload/${init.upload_id}/chunk`, {
+                method: 'PUT',
+                headers: { 'Upload-Offset': String(offset), 'X-Chunk-SHA256': await sha256Hex(chunk) },
+                body: chunk
+            });
+            const data = await res.json();
+            // Erreur sans position (upload inconnu...): pas de reprise possible
+            if (data.offset === undefined) return data;
+            // Morceau rejeté (somme différente, position périmée): renvoyé depuis la position indiquée
+            if (!res.ok && ++failures > CHUNK_RETRIES) return data;
+            if (res.ok) failures = 0;
+            offset = data.offset;
+        } catch (err) {
+            if (++failures > CHUNK_RETRIES) throw err;
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            const status = await fetch(`/upload/${init.upload_id}`).then(res => res.json()).catch(() => null);
+            if (status && status.success) offset = status.offset;
+        }
+    }
+    
+    showLoading('Extraction du texte...');
+    return fetch(`/upload/${init.upload_id}/finalize`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(options)
+    }).then(res => res.json());
+}
+
+function cancelPrecompute() {
+    if (precomputeId) {
+        navigator.sendBeacon(`/precompute/${precomputeId}/cancel`);
+        precomputeId = null;
+    }
+}
+
+// Quitter la page annule le précalcul en cours
+window.addEventListener('pagehide', cancelPrecompute);
+
 function resetFile() {
+    cancelPrecompute();
     extractedText = '';
+    documentOutline = [];
     originalText.value = '';
     fileInput.value = '';
     uploadBox.classList.remove('hidden');
@@ -499,7 +577,7 @@ document.getElementById('summarizeSections').addEventListener('click', () => {
     fetch('/summarize-sections', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ text, words_per_section: 50 })
+        body: JSON.stringify({ text, words_per_section: 50, outline: documentOutline })
     })
     .then(res => res.json())
     .then(data => {
@@ -577,7 +655,7 @@ async function loadHistory() {
                         <span class="history-filename">${item.filename || 'Sans titre'}</span>
                         <span class="history-date">${formatDate(item.created_at)}</span>
                     </div>
-                    <div class="history-preview">${item.summary ? item.summary.substring(0, 80) + '...' : ''}</div>
+                    <div class="history-preview">${item.preview ? item.preview.substring(0, 80) + '...' : ''}</div>
                     <div class="history-meta">
                         <span>${item.original_words || 0} → ${item.summary_words || 0} mots</span>
                         <span class="history-badge">${item.style || 'paragraph'}</span>
@@ -0,0 +1,1846 @@
+import atexit
+import itertools
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from werkzeug.security import generate_password_hash, check_password_hash
+import json
+import os
+import zlib
+from urllib.parse import quote
+
+import metrics
+import search
+from cache import ResultCache
+from database import (
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_COLLECTIONS,
+    HISTORY_COLLECTIONS,
+    ORIGINAL_TEXT_FIELDS,
+    ROLLUP_FIELDS,
+    SEARCH_COLLECTIONS,
+    STATS_COUNTERS,
+    SUMMARY_LIST_FIELDS,
+    analysis_preview,
+    archive_entry,
+    archive_page,
+    blob_report,
+    compute_compression_rate,
+    decode_cursor,
+    encode_cursor,
+    export_item,
+    fold_rollups,
+    format_stats,
+    get_timestamp,
+    invalidate_pages,
+    invalidate_user,
+    make_preview,
+    merge_delta,
+    pack_archive_parts,
+    pack_text,
+    rollup_delta,
+    search_item,
+    search_text,
+    split_chunks,
+    summary_delta,
+    unpack_archive,
+    unpack_text,
+)
+
+# Client Firestore, créé au premier accès (voir get_db) pour ne pas ralentir le démarrage
+_db = None
+_db_lock = threading.Lock()
+
+# Canaux gRPC: FIRESTORE_CHANNELS clients (une connexion HTTP/2 chacun) répartis entre les threads,
+# pings keepalive pour détecter au plus tôt une connexion coupée (load balancer, NAT)
+FIRESTORE_CHANNELS = max(1, int(os.environ.get('FIRESTORE_CHANNELS', 1)))
+FIRESTORE_KEEPALIVE_MS = int(os.environ.get('FIRESTORE_KEEPALIVE_MS', 30000))
+FIRESTORE_KEEPALIVE_TIMEOUT_MS = int(os.environ.get('FIRESTORE_KEEPALIVE_TIMEOUT_MS', 10000))
+_clients = []
+_thread_client = threading.local()
+_next_client = itertools.count()
+
+
+# Initialisation Firebase
+def get_firebase_credentials():
+    """Récupère les credentials Firebase depuis fichier ou variables d'environnement"""
+    from firebase_admin import credentials
+    
+    # 1. Essayer avec le fichier local
+    if os.path.exists('firebase-credentials.json'):
+        return credentials.Certificate('firebase-credentials.json'), "fichier local"
+    
+    # 2. Essayer avec FIREBASE_CREDENTIALS (JSON complet)
+    firebase_creds_json = os.environ.get("FIREBASE_CREDENTIALS")
+    if firebase_creds_json:
+        try:
+            creds_dict = json.loads(firebase_creds_json)
+            return credentials.Certificate(creds_dict), "FIREBASE_CREDENTIALS JSON"
+        except json.JSONDecodeError:
+            print("Erreur: FIREBASE_CREDENTIALS n'est pas un JSON valide")
+    
+    # 3. Fallback: variables individuelles
+    firebase_config = {
+        "type": "service_account",
+        "project_id": os.environ.get("FIREBASE_PROJECT_ID", ""),
+        "private_key_id": os.environ.get("FIREBASE_PRIVATE_KEY_ID", ""),
+        "private_key": os.environ.get("FIREBASE_PRIVATE_KEY", "").replace('\\n', '\n'),
+        "client_email": os.environ.get("FIREBASE_CLIENT_EMAIL", ""),
+        "client_id": os.environ.get("FIREBASE_CLIENT_ID", ""),
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+        "client_x509_cert_url": os.environ.get("FIREBASE_CERT_URL", "")
+    }
+    return credentials.Certificate(firebase_config), "variables individuelles"
+
+
+def channel_options():
+    """Options des canaux gRPC Firestore (keepalive, connexions distinctes par client)"""
+    return [
+        ('grpc.keepalive_time_ms', FIRESTORE_KEEPALIVE_MS),
+        ('grpc.keepalive_timeout_ms', FIRESTORE_KEEPALIVE_TIMEOUT_MS),
+        ('grpc.keepalive_permit_without_calls', 1),
+        ('grpc.http2.max_pings_without_data', 0),
+        # Sans pool local, des canaux aux options identiques partagent la même connexion
+        ('grpc.use_local_subchannel_pool', 1),
+    ]
+
+
+def _create_client(app):
+    """
+    Client Firestore sur son propre canal gRPC. La bibliothèque ne permet pas de passer les options
+    du canal: l'API GAPIC est construite ici comme dans BaseClient._firestore_api_helper.
+    """
+    from google.cloud import firestore
+    from google.cloud.firestore_v1.services.firestore import client as firestore_client
+    from google.cloud.firestore_v1.services.firestore.transports import grpc as firestore_grpc
+    
+    client = firestore.Client(credentials=app.credential.get_credential(), project=app.project_id)
+    if client._emulator_host is None:
+        transport = firestore_grpc.FirestoreGrpcTransport
+        channel = transport.create_channel(client._target, credentials=client._credentials,
+                                           options=channel_options())
+        client._transport = transport(host=client._target, channel=channel)
+        client._firestore_api_internal = firestore_client.FirestoreClient(
+            transport=client._transport, client_options=client._client_options)
+        firestore_client._client_info = client._client_info
+    return client
+
+
+def get_db():
+    """
+    Retourne le client Firestore, en initialisant Firebase au premier appel.
+    Avec FIRESTORE_CHANNELS > 1, chaque thread garde le même client (transactions et lots
+    restent sur un canal), les threads étant répartis à tour de rôle entre les canaux.
+    """
+    global _db, _clients
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                import firebase_admin
+                
+                try:
+                    cred, source = get_firebase_credentials()
+                    firebase_admin.initialize_app(cred)
+                    print(f"Firebase initialisé avec {source}")
+                except ValueError:
+                    # App déjà initialisée
+                    pass
+                except Exception as e:
+                    print(f"Erreur initialisation Firebase: {e}")
+                
+                app = firebase_admin.get_app()
+                if not app.project_id:
+                    raise ValueError("ID de projet Firebase manquant (FIREBASE_PROJECT_ID)")
+                _clients = [_create_client(app) for _ in range(FIRESTORE_CHANNELS)]
+                _db = _clients[0]
+    if len(_clients) < 2:
+        return _db
+    client = getattr(_thread_client, 'client', None)
+    if client is None:
+        client = _thread_client.client = _clients[next(_next_client) % len(_clients)]
+    return client
+
+
+# ==================== LECTURES PARALLÈLES ====================
+
+# Requêtes indépendantes d'un même appel lancées ensemble (voir gather): la durée est celle
+# de la plus lente et non leur somme. Les clients Firestore sont sûrs entre threads.
+FIRESTORE_READ_THREADS = int(os.environ.get('FIRESTORE_READ_THREADS', 16))
+_read_pool = None
+_read_pool_lock = threading.Lock()
+_in_read_pool = threading.local()
+
+
+def _run_read(func):
+    _in_read_pool.active = True
+    return func()
+
+
+def gather(*calls):
+    """
+    Exécute les fonctions sans argument calls en parallèle et retourne leurs résultats dans l'ordre
+    (la première exception est relancée). Appelé depuis une lecture déjà parallèle, ou avec un
+    seul appel, tout s'exécute dans le thread courant: pas de blocage du pool sur lui-même.
+    """
+    global _read_pool
+    if len(calls) < 2 or FIRESTORE_READ_THREADS < 2 or getattr(_in_read_pool, 'active', False):
+        return [call() for call in calls]
+    if _read_pool is None:
+        with _read_pool_lock:
+            if _read_pool is None:
+                _read_pool = ThreadPoolExecutor(max_workers=FIRESTORE_READ_THREADS, thread_name_prefix='firestore-read')
+    futures = [_read_pool.submit(_run_read, call) for call in calls]
+    return [future.result() for future in futures]
+
+
+# ==================== PAGINATION ====================
+
+def _query_page(collection, user_id, limit, start_after=None, filters=(), fields=None):
+    """
+    Page de documents d'un utilisateur, du plus récent au plus ancien.
+    Le tri et la limite sont faits par Firestore (index composite user_id + created_at,
+    voir firestore.indexes.json): le nombre de lectures ne dépend que de `limit`.
+    fields limite les champs transférés (projection); created_at y est toujours ajouté.
+    Retourne (documents, curseur de la page suivante ou None).
+    """
+    query = get_db().collection(collection).where('user_id', '==', user_id)
+    for field, value in filters:
+        query = query.where(field, '==', value)
+    if fields:
+        query = query.select(list(dict.fromkeys(['created_at', *fields])))
+    query = query.order_by('created_at', direction='DESCENDING').order_by('__name__', direction='DESCENDING')
+    if start_after:
+        query = query.start_after(list(start_after))
+    
+    # Un document de plus pour savoir s'il existe une page suivante
+    docs = list(query.limit(limit + 1).stream())
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor(docs[-1].get('created_at'), docs[-1].id)
+
+
+
+def _count(collection, user_id):
+    """Nombre de documents de l'utilisateur (requête d'agrégation count(): une lecture par lot de 1000)"""
+    return get_db().collection(collection).where('user_id', '==', user_id).count().get()[0][0].value
+
+
+# ==================== AGRÉGATS PAR UTILISATEUR ====================
+
+def _stats_ref(user_id):
+    """Document user_stats/{user_id}: compteurs tenus à jour à chaque écriture"""
+    return get_db().collection('user_stats').document(user_id)
+
+
+def _stats_update(delta):
+    """Convertit un delta en incréments Firestore, appliqués côté serveur sans lecture"""
+    from firebase_admin import firestore
+    
+    update = {}
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            update[key] = {k: firestore.Increment(v) for k, v in value.items()}
+        else:
+            update[key] = firestore.Increment(value)
+    update['updated_at'] = get_timestamp()
+    return update
+
+
+def _create_with_stats(collection, data, delta, batch=None):
+    """
+    Crée un document et met à jour user_stats et user_rollups dans le même commit atomique.
+    Avec batch (BatchWriter ou file d'écriture différée), l'écriture lui est confiée
+    et l'ID pré-généré est retourné immédiatement.
+    L'entrée n'est ajoutée à l'index de recherche qu'une fois le document validé
+    (ici, ou au commit du lot), en arrière-plan.
+    """
+    if batch is not None:
+        return batch.set(collection, data, delta)
+    
+    client = get_db()
+    doc_ref = client.collection(collection).document()
+    write_batch = client.batch()
+    write_batch.set(doc_ref, data)
+    write_batch.set(_stats_ref(data['user_id']), _stats_update(delta), merge=True)
+    rollup = rollup_delta(collection, data)
+    if rollup:
+        write_batch.set(_rollup_ref(data['user_id']), _rollup_update(rollup), merge=True)
+    write_batch.commit()
+    invalidate_pages(data['user_id'], [collection])
+    _index_after_commit(collection, doc_ref.id, data)
+    return doc_ref.id
+
+
+def _delete_with_stats(collection, doc_id, user_id, delta_for):
+    """
+    Supprime un document de l'utilisateur et retire sa contribution de user_stats et user_rollups,
+    ainsi que sa référence au blob de son texte complet (blob_id).
+    La lecture et les écritures forment une transaction: deux suppressions
+    simultanées du même document ne décrémentent qu'une fois.
+    Retourne le contenu du document supprimé, ou None s'il n'existait pas.
+    """
+    from firebase_admin import firestore
+    
+    client = get_db()
+    doc_ref = client.collection(collection).document(doc_id)
+    
+    @firestore.transactional
+    def run(transaction):
+        doc = doc_ref.get(transaction=transaction)
+        if not doc.exists or doc.to_dict().get('user_id') != user_id:
+            return None
+        transaction.delete(doc_ref)
+        transaction.set(_stats_ref(user_id), _stats_update(delta_for(doc.to_dict())), merge=True)
+        rollup = rollup_delta(collection, doc.to_dict(), sign=-1)
+        if rollup:
+            transaction.set(_rollup_ref(user_id), _rollup_update(rollup), merge=True)
+        if doc.to_dict().get('blob_id'):
+            transaction.set(_blob_ref(doc.to_dict()['blob_id']), _release_update(1), merge=True)
+        return doc.to_dict()
+    
+    deleted = run(client.transaction())
+    if deleted is not None:
+        invalidate_pages(user_id, [collection])
+    return deleted
+
+
+class BatchWriter:
+    """
+    Regroupe des créations de documents et les valide par lots Firestore
+    (un seul aller-retour par lot au lieu d'un add() par document).
+    Les deltas de user_stats et user_rollups sont cumulés par utilisateur et écrits dans le même lot.
+    S'utilise comme context manager: le reliquat est validé à la sortie.
+    """
+    
+    MAX_BATCH_SIZE = 500  # Limite Firestore d'opérations par lot
+    
+    def __init__(self, size=100):
+        # Chaque document peut ajouter une écriture user_stats et une user_rollups au lot
+        self.size = min(size, self.MAX_BATCH_SIZE // 3)
+        self._pending = []
+        self._stats = {}  # user_id -> delta cumulé
+        self._rollups = {}  # user_id -> delta par jour cumulé
+        self._pages = set()  # (user_id, collection) dont les pages en cache sont à renouveler
+        self.written = 0
+    
+    def set(self, collection, data, stats_delta=None):
+        """Ajoute un document au lot et retourne son ID (généré localement, sans requête)"""
+        doc_ref = get_db().collection(collection).document()
+        self._pending.append((collection, doc_ref, data))
+        if stats_delta:
+            merge_delta(self._stats.setdefault(data['user_id'], {}), stats_delta)
+        merge_delta(self._rollups.setdefault(data['user_id'], {}), rollup_delta(collection, data))
+        self._pages.add((data['user_id'], collection))
+        if len(self._pending) >= self.size:
+            try:
+                self.flush()
+            except Exception as e:
+                # Les documents restent en attente et seront retentés au prochain flush
+                print(f"Erreur BatchWriter.flush: {e}")
+        return doc_ref.id
+    
+    def put_blob(self, text):
+        """Texte complet d'un document du lot: écrit tout de suite (il doit exister avant le document)"""
+        return put_blob(text)
+    
+    @metrics.track_db
+    def flush(self):
+        """Valide les documents en attente et leurs agrégats en un seul commit"""
+        if not self._pending:
+            return
+        batch = get_db().batch()
+        for _, doc_ref, data in self._pending:
+            batch.set(doc_ref, data)
+        for user_id, delta in self._stats.items():
+            batch.set(_stats_ref(user_id), _stats_update(delta), merge=True)
+        for user_id, delta in self._rollups.items():
+            if delta:
+                batch.set(_rollup_ref(user_id), _rollup_update(delta), merge=True)
+        batch.commit()
+        for user_id, collection in self._pages:
+            invalidate_pages(user_id, [collection])
+        for collection, doc_ref, data in self._pending:
+            _index_after_commit(collection, doc_ref.id, data)
+        self.written += len(self._pending)
+        self._pending = []
+        self._stats = {}
+        self._rollups = {}
+        self._pages = set()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+
+@metrics.track_db
+def commit_records(records):
+    """
+    Valide des enregistrements {collection, id, data, stats} en un seul lot, avec leurs agrégats
+    (user_stats et user_rollups).
+    create() échoue (AlreadyExists) si un document a déjà été écrit: le lot entier est alors
+    annulé, ce qui évite de compter deux fois un enregistrement rejoué après un redémarrage.
+    Les erreurs sont propagées à l'appelant, qui décide de réessayer.
+    """
+    client = get_db()
+    batch = client.batch()
+    stats, rollups = {}, {}
+    for record in records:
+        batch.create(client.collection(record['collection']).document(record['id']), record['data'])
+        if record.get('stats'):
+            merge_delta(stats.setdefault(record['data']['user_id'], {}), record['stats'])
+        merge_delta(rollups.setdefault(record['data']['user_id'], {}), rollup_delta(record['collection'], record['data']))
+    for user_id, delta in stats.items():
+        batch.set(_stats_ref(user_id), _stats_update(delta), merge=True)
+    for user_id, delta in rollups.items():
+        if delta:
+            batch.set(_rollup_ref(user_id), _rollup_update(delta), merge=True)
+    batch.commit()
+    for user_id, collection in {(record['data']['user_id'], record['collection']) for record in records}:
+        invalidate_pages(user_id, [collection])
+    for record in records:
+        _index_after_commit(record['collection'], record['id'], record['data'])
+
+
+# ==================== USERS ====================
+
+def _unique_key(value):
+    """ID du document de clé unique (email, nom d'utilisateur): insensible à la casse, sans '/'"""
+    key = quote(value.strip().lower(), safe='@')
+    return key if key.strip('.') else key.replace('.', '%2E')
+
+
+@metrics.track_db
+def create_user(username, email, password):
+    """
+    Crée un nouvel utilisateur.
+    Les documents de clés uniques user_emails/{email} et usernames/{nom} sont créés dans la
+    même transaction que l'utilisateur: deux inscriptions simultanées ne peuvent pas réussir.
+    Ils ne contiennent que user_id: users/{id} reste la seule copie du mot de passe et du statut.
+    """
+    from firebase_admin import firestore
+    
+    password_hash = generate_password_hash(password)
+    
+    try:
+        client = get_db()
+        user_ref = client.collection('users').document()
+        email_ref = client.collection('user_emails').document(_unique_key(email))
+        username_ref = client.collection('usernames').document(_unique_key(username))
+        user_data = {
+            'username': username,
+            'email': email,
+            'password_hash': password_hash,
+            'is_active': True,
+            'created_at': get_timestamp()
+        }
+        
+        @firestore.transactional
+        def run(transaction):
+            # Les deux clés sont lues en un seul aller-retour
+            taken = {doc.id for doc in transaction.get_all([email_ref, username_ref]) if doc.exists}
+            if email_ref.id in taken:
+                return {'success': False, 'error': 'Cet email est déjà utilisé'}
+            if username_ref.id in taken:
+                return {'success': False, 'error': 'Ce nom d\'utilisateur est déjà pris'}
+            
+            transaction.create(user_ref, user_data)
+            transaction.create(email_ref, {'user_id': user_ref.id})
+            transaction.create(username_ref, {'user_id': user_ref.id})
+            # Agrégats complets dès l'inscription: rien à reconstruire (compteurs absents = 0)
+            transaction.create(_stats_ref(user_ref.id), {'rebuilt_at': user_data['created_at']})
+            return {'success': True, 'user_id': user_ref.id}
+        
+        return run(client.transaction())
+    
+    except Exception as e:
+        metrics.DB_ERRORS.labels('create_user').inc()
+        return {'success': False, 'error': f'Erreur lors de la création du compte: {str(e)}'}
+
+
+@metrics.track_db
+def authenticate_user(email, password):
+    """Authentifie un utilisateur (lectures directes de user_emails/{email} puis de users/{id})"""
+    try:
+        client = get_db()
+        key = client.collection('user_emails').document(_unique_key(email)).get(field_paths=['user_id'])
+        if key.exists:
+            user_id = key.get('user_id')
+            doc = client.collection('users').document(user_id).get()
+            if not doc.exists:
+                return {'success': False, 'error': 'Email ou mot de passe incorrect'}
+            user = doc.to_dict()
+        else:
+            # Compte antérieur aux clés uniques: requête puis création de sa clé (voir backfill_user_keys)
+            users = list(client.collection('users').where('email', '==', email).limit(1).get())
+            if not users:
+                return {'success': False, 'error': 'Email ou mot de passe incorrect'}
+            user, user_id = users[0].to_dict(), users[0].id
+            _backfill_user(user_id, user)
+        
+        if user.get('is_active', True) and check_password_hash(user['password_hash'], password):
+            return {
+                'success': True,
+                'user': {
+                    'id': user_id,
+                    'username': user['username'],
+                    'email': user['email'],
+                    'created_at': user['created_at']
+                }
+            }
+        
+        return {'success': False, 'error': 'Email ou mot de passe incorrect'}
+    
+    except Exception as e:
+        metrics.DB_ERRORS.labels('authenticate_user').inc()
+        return {'success': False, 'error': f'Erreur d\'authentification: {str(e)}'}
+
+
+def _backfill_user(user_id, user):
+    """
+    Crée les clés uniques d'un utilisateur existant; retourne les clés déjà prises par un autre.
+    Une clé de l'utilisateur qui contient plus que user_id (ancienne copie du compte) est réduite.
+    """
+    client = get_db()
+    conflicts = []
+    for collection, value in (('user_emails', user['email']), ('usernames', user['username'])):
+        ref = client.collection(collection).document(_unique_key(value))
+        try:
+            ref.create({'user_id': user_id})
+        except Exception:
+            existing = ref.get()
+            if not existing.exists:
+                raise
+            if existing.to_dict().get('user_id') != user_id:
+                conflicts.append(f"{collection}/{ref.id}")
+            elif len(existing.to_dict()) > 1:
+                ref.set({'user_id': user_id})
+    return conflicts
+
+
+@metrics.track_db
+def backfill_user_keys():
+    """
+    Crée user_emails/{email} et usernames/{nom} pour les comptes créés avant les clés uniques
+    (et retire des clés existantes toute copie du compte autre que user_id).
+    Idempotent; retourne {'users': n, 'conflicts': [...]} (doublons existants à traiter à la main).
+    """
+    users, conflicts = 0, []
+    for doc in get_db().collection('users').stream():
+        conflicts.extend(_backfill_user(doc.id, doc.to_dict()))
+        users += 1
+    return {'users': users, 'conflicts': conflicts}
+
+
+@metrics.track_db
+def get_user_by_id(user_id):
+    """Récupère un utilisateur par son ID"""
+    try:
+        doc = get_db().collection('users').document(user_id).get()
+        if doc.exists:
+            user = doc.to_dict()
+            return {
+                'id': doc.id,
+                'username': user['username'],
+                'email': user['email'],
+                'created_at': user['created_at'],
+                'plan': user.get('plan')
+            }
+        return None
+    except Exception:
+        metrics.DB_ERRORS.labels('get_user_by_id').inc()
+        return None
+
+
+@metrics.track_db
+def set_user_plan(user_id, plan):
+    """Change l'offre d'un utilisateur (durées de conservation, voir database.RETENTION_POLICIES)"""
+    from google.api_core.exceptions import NotFound
+    
+    try:
+        get_db().collection('users').document(user_id).update({'plan': plan})
+        invalidate_user(user_id)
+        return True
+    except NotFound:
+        return False
+    except Exception as e:
+        metrics.DB_ERRORS.labels('set_user_plan').inc()
+        print(f"Erreur set_user_plan: {e}")
+        return False
+
+
+# ==================== TEXTES COMPLETS ====================
+
+BLOB_BATCH_CHUNKS = 8  # morceaux par commit (limite Firestore: 10 Mio par requête)
+
+# Les blobs sont immuables (ID = empreinte du contenu): aucune invalidation nécessaire
+_blob_cache = ResultCache('blobs', max_entries=64, ttl=3600)
+
+
+def _blob_ref(blob_id):
+    return get_db().collection('blobs').document(blob_id)
+
+
+@metrics.track_db
+def put_blob(text):
+    """
+    Stocke un texte une seule fois par contenu: blobs/{sha256} (compressé zlib), découpé en
+    sous-documents blobs/{sha256}/chunks/{n} au-delà de BLOB_CHUNK_BYTES. Un texte déjà
+    présent n'est pas réécrit: seul son compteur de références est incrémenté.
+    Retourne l'ID du blob; les erreurs sont propagées (voir save_summary).
+    """
+    from firebase_admin import firestore
+    from google.api_core.exceptions import AlreadyExists
+    
+    blob_id, size, data = pack_text(text)
+    ref = _blob_ref(blob_id)
+    if not ref.get(field_paths=['size']).exists:
+        chunks = split_chunks(data)
+        meta = {
+            'size': size,
+            'stored_size': len(data),
+            'chunks': len(chunks),
+            'refs': 1,
+            'created_at': get_timestamp()
+        }
+        if len(chunks) == 1:
+            meta['data'] = chunks[0]
+        else:
+            # Les morceaux d'abord: le document principal n'est visible qu'une fois complet
+            for start in range(0, len(chunks), BLOB_BATCH_CHUNKS):
+                batch = get_db().batch()
+                for n, chunk in enumerate(chunks[start:start + BLOB_BATCH_CHUNKS], start):
+                    batch.set(ref.collection('chunks').document(f'{n:05d}'), {'data': chunk})
+                batch.commit()
+        try:
+            ref.create(meta)
+            metrics.BLOB_BYTES.labels('raw').inc(size)
+            metrics.BLOB_BYTES.labels('stored').inc(len(data))
+            return blob_id
+        except AlreadyExists:
+            pass  # même texte enregistré entre-temps par une autre requête
+    
+    ref.update({'refs': firestore.Increment(1)})
+    metrics.BLOB_BYTES.labels('deduplicated').inc(size)
+    return blob_id
+
+
+@metrics.track_db
+def get_blob(blob_id):
+    """Texte complet d'un blob (None s'il n'existe pas)"""
+    text = _blob_cache.get(blob_id)
+    if text is not None:
+        return text
+    try:
+        ref = _blob_ref(blob_id)
+        doc = ref.get()
+        if not doc.exists:
+            return None
+        meta = doc.to_dict()
+        if 'data' in meta:
+            data = meta['data']
+        else:
+            chunks = ref.collection('chunks').order_by('__name__').stream()
+            data = b''.join(chunk.get('data') for chunk in chunks)
+        text = unpack_text(data)
+        _blob_cache.set(blob_id, text)
+        return text
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_blob').inc()
+        print(f"Erreur get_blob: {e}")
+        return None
+
+
+def _release_update(count=1):
+    """Décrément du compteur de références; set(merge) ne peut pas échouer sur un blob absent"""
+    from firebase_admin import firestore
+    
+    return {'refs': firestore.Increment(-count)}
+
+
+@metrics.track_db
+def release_blob(blob_id):
+    """Retire une référence à un blob (supprimé ensuite par gc_blobs s'il n'est plus référencé)"""
+    try:
+        _blob_ref(blob_id).set(_release_update(), merge=True)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('release_blob').inc()
+        print(f"Erreur release_blob: {e}")
+
+
+@metrics.track_db
+def get_blob_stats():
+    """Taux de compression et gain de la déduplication (lecture des seules tailles des blobs)"""
+    try:
+        blobs = get_db().collection('blobs').select(['size', 'stored_size', 'refs']).stream()
+        return blob_report((doc.get('size'), doc.get('stored_size'), doc.get('refs')) for doc in blobs)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_blob_stats').inc()
+        print(f"Erreur get_blob_stats: {e}")
+        return None
+
+
+@metrics.track_db
+def gc_blobs():
+    """
+    Supprime les blobs qui ne sont plus référencés (refs <= 0) et leurs morceaux.
+    Le compteur est relu dans une transaction: un blob référencé entre-temps est conservé.
+    Retourne le nombre de blobs supprimés, ou None en cas d'erreur.
+    """
+    from firebase_admin import firestore
+    
+    try:
+        client = get_db()
+        
+        @firestore.transactional
+        def remove(transaction, ref):
+            doc = ref.get(field_paths=['refs'], transaction=transaction)
+            if not doc.exists or (doc.to_dict().get('refs') or 0) > 0:
+                return False
+            transaction.delete(ref)
+            return True
+        
+        deleted = 0
+        for doc in client.collection('blobs').where('refs', '<=', 0).select([]).stream():
+            if remove(client.transaction(), doc.reference):
+                chunk_refs = [chunk.reference for chunk in doc.reference.collection('chunks').select([]).stream()]
+                for start in range(0, len(chunk_refs), DELETE_PAGE_SIZE):
+                    batch = client.batch()
+                    for chunk_ref in chunk_refs[start:start + DELETE_PAGE_SIZE]:
+                        batch.delete(chunk_ref)
+                    batch.commit()
+                deleted += 1
+        return deleted
+    except Exception as e:
+        metrics.DB_ERRORS.labels('gc_blobs').inc()
+        print(f"Erreur gc_blobs: {e}")
+        return None
+
+
+def _put_original(text, batch=None):
+    """Texte complet d'un enregistrement d'historique: via le lot s'il y en a un"""
+    return batch.put_blob(text) if batch is not None else put_blob(text)
+
+
+def _load_original(data, field):
+    """Charge le texte complet référencé par blob_id (documents antérieurs: texte tronqué en place)"""
+    if data.get('blob_id') and field not in data:
+        data[field] = get_blob(data['blob_id'])
+    return data
+
+
+# ==================== SUMMARIES ====================
+
+@metrics.track_db
+def save_summary(user_id, filename, original_text, summary, original_words, summary_words, 
+                 target_words, style, method, model, batch=None):
+    """Sauvegarde un résumé dans Firestore (ou le confie au lot fourni)"""
+    compression_rate = compute_compression_rate(original_words, summary_words)
+    
+    try:
+        summary_data = {
+            'user_id': user_id,
+            'filename': filename,
+            'blob_id': _put_original(original_text, batch),
+            'original_chars': len(original_text),
+            'summary': summary,
+            'preview': make_preview(summary),
+            'original_words': original_words,
+            'summary_words': summary_words,
+            'target_words': target_words,
+            'style': style,
+            'method': method,
+            'model': model,
+            'compression_rate': compression_rate,
+            'created_at': get_timestamp()
+        }
+        
+        return _create_with_stats('summaries', summary_data, summary_delta(summary_data), batch)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_summary').inc()
+        print(f"Erreur save_summary: {e}")
+        return None
+
+
+@metrics.track_db
+def get_summaries(user_id, limit=20, cursor=None):
+    """
+    Récupère une page de l'historique des résumés: {'items': [...], 'next_cursor': ...}.
+    Seuls les champs de SUMMARY_LIST_FIELDS sont lus; le contenu complet s'obtient
+    avec get_summary_by_id.
+    """
+    start_after = decode_cursor(cursor)
+    try:
+        docs, next_cursor = _query_page('summaries', user_id, limit, start_after, fields=SUMMARY_LIST_FIELDS)
+        
+        results = []
+        for doc in docs:
+            data = doc.to_dict()
+            results.append({
+                'id': doc.id,
+                'created_at': data.get('created_at'),
+                **{field: data.get(field) for field in SUMMARY_LIST_FIELDS}
+            })
+        
+        _backfill_previews(results)
+        return {'items': results, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_summaries').inc()
+        print(f"Erreur get_summaries: {e}")
+        import traceback
+        traceback.print_exc()
+        return {'items': [], 'next_cursor': None}
+
+
+def _backfill_previews(items):
+    """Résumés antérieurs au champ preview: calculé une fois, puis enregistré sur le document"""
+    missing = [item for item in items if item.get('preview') is None]
+    if not missing:
+        return
+    try:
+        client = get_db()
+        refs = [client.collection('summaries').document(item['id']) for item in missing]
+        summaries = {doc.id: (doc.to_dict() or {}).get('summary')
+                     for doc in client.get_all(refs, field_paths=['summary']) if doc.exists}
+        batch = client.batch()
+        for item, ref in zip(missing, refs):
+            item['preview'] = make_preview(summaries.get(item['id']))
+            batch.update(ref, {'preview': item['preview']})
+        batch.commit()
+    except Exception as e:
+        print(f"Erreur _backfill_previews: {e}")
+
+
+@metrics.track_db
+def get_summary_by_id(summary_id, user_id):
+    """Récupère un résumé par son ID"""
+    try:
+        doc = get_db().collection('summaries').document(summary_id).get()
+        if doc.exists:
+            data = doc.to_dict()
+            if data.get('user_id') == user_id:
+                data['id'] = doc.id
+                return _load_original(data, 'original_text')
+            return None
+        data = _get_archived('summaries', summary_id, user_id)
+        return _load_original(data, 'original_text') if data else None
+    except Exception:
+        metrics.DB_ERRORS.labels('get_summary_by_id').inc()
+        return None
+
+
+@metrics.track_db
+def delete_summary(summary_id, user_id):
+    """Supprime un résumé"""
+    try:
+        data = _delete_with_stats('summaries', summary_id, user_id,
+                                  lambda data: summary_delta(data, sign=-1))
+        if data is None:
+            return False
+        _submit_search_task(user_id, _unindex_entry, user_id, 'summaries', summary_id)
+        return True
+    except Exception:
+        metrics.DB_ERRORS.labels('delete_summary').inc()
+        return False
+
+
+# ==================== TRANSLATIONS ====================
+
+@metrics.track_db
+def save_translation(user_id, source_text, translated_text, target_language, batch=None):
+    """Sauvegarde une traduction"""
+    try:
+        translation_data = {
+            'user_id': user_id,
+            'blob_id': _put_original(source_text, batch),
+            'source_preview': make_preview(source_text),
+            'source_chars': len(source_text),
+            'translated_text': translated_text,
+            'target_language': target_language,
+            'created_at': get_timestamp()
+        }
+        
+        return _create_with_stats('translations', translation_data, {STATS_COUNTERS['translations']: 1}, batch)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_translation').inc()
+        print(f"Erreur save_translation: {e}")
+        return None
+
+
+@metrics.track_db
+def get_translations(user_id, limit=20, cursor=None):
+    """Récupère une page de l'historique des traductions (aperçu du texte source, pas le texte complet)"""
+    start_after = decode_cursor(cursor)
+    try:
+        docs, next_cursor = _query_page('translations', user_id, limit, start_after,
+                                        fields=['source_preview', 'source_text', 'translated_text', 'target_language'])
+        
+        results = []
+        for doc in docs:
+            data = doc.to_dict()
+            results.append({
+                'id': doc.id,
+                'created_at': data.get('created_at'),
+                'source_preview': data.get('source_preview') or make_preview(data.get('source_text')),
+                'translated_text': data.get('translated_text'),
+                'target_language': data.get('target_language')
+            })
+        
+        return {'items': results, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_translations').inc()
+        print(f"Erreur get_translations: {e}")
+        return {'items': [], 'next_cursor': None}
+
+
+# ==================== ANALYSES ====================
+
+@metrics.track_db
+def save_analysis(user_id, analysis_type, source_text, result, batch=None):
+    """Sauvegarde une analyse"""
+    try:
+        analysis_data = {
+            'user_id': user_id,
+            'analysis_type': analysis_type,
+            'source_text_preview': source_text[:200],
+            'result': result,
+            'preview': analysis_preview(result),
+            'created_at': get_timestamp()
+        }
+        
+        return _create_with_stats('analyses', analysis_data, {STATS_COUNTERS['analyses']: 1}, batch)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_analysis').inc()
+        print(f"Erreur save_analysis: {e}")
+        return None
+
+
+@metrics.track_db
+def get_analyses(user_id, analysis_type=None, limit=20, cursor=None):
+    """Récupère une page de l'historique des analyses (filtrable par type), sans le résultat complet"""
+    start_after = decode_cursor(cursor)
+    filters = [('analysis_type', analysis_type)] if analysis_type else []
+    try:
+        docs, next_cursor = _query_page('analyses', user_id, limit, start_after, filters,
+                                        fields=['analysis_type', 'source_text_preview', 'preview'])
+        
+        results = []
+        for doc in docs:
+            data = doc.to_dict()
+            results.append({
+                'id': doc.id,
+                'created_at': data.get('created_at'),
+                'analysis_type': data.get('analysis_type'),
+                'source_text_preview': data.get('source_text_preview'),
+                'preview': data.get('preview')
+            })
+        
+        return {'items': results, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_analyses').inc()
+        print(f"Erreur get_analyses: {e}")
+        return {'items': [], 'next_cursor': None}
+
+
+@metrics.track_db
+def get_analysis_by_id(analysis_id, user_id):
+    """Récupère une analyse complète (avec result) par son ID"""
+    try:
+        doc = get_db().collection('analyses').document(analysis_id).get()
+        if doc.exists:
+            data = doc.to_dict()
+            if data.get('user_id') == user_id:
+                data['id'] = doc.id
+                return data
+            return None
+        return _get_archived('analyses', analysis_id, user_id)
+    except Exception:
+        metrics.DB_ERRORS.labels('get_analysis_by_id').inc()
+        return None
+
+
+# ==================== Q&A ====================
+
+@metrics.track_db
+def save_qa(user_id, document_preview, question, answer, batch=None):
+    """Sauvegarde une Q&A"""
+    try:
+        qa_data = {
+            'user_id': user_id,
+            'document_preview': document_preview[:200],
+            'question': question,
+            'answer': answer,
+            'created_at': get_timestamp()
+        }
+        
+        return _create_with_stats('qa_history', qa_data, {STATS_COUNTERS['qa_history']: 1}, batch)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_qa').inc()
+        print(f"Erreur save_qa: {e}")
+        return None
+
+
+@metrics.track_db
+def get_qa_history(user_id, limit=20, cursor=None):
+    """Récupère une page de l'historique des Q&A"""
+    start_after = decode_cursor(cursor)
+    try:
+        docs, next_cursor = _query_page('qa_history', user_id, limit, start_after)
+        
+        results = []
+        for doc in docs:
+            data = doc.to_dict()
+            results.append({
+                'id': doc.id,
+                'created_at': data.get('created_at'),
+                'document_preview': data.get('document_preview'),
+                'question': data.get('question'),
+                'answer': data.get('answer')
+            })
+        
+        return {'items': results, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_qa_history').inc()
+        print(f"Erreur get_qa_history: {e}")
+        return {'items': [], 'next_cursor': None}
+
+
+# ==================== FAVORITES ====================
+
+@metrics.track_db
+def save_favorite(user_id, title, content, content_type='summary'):
+    """Sauvegarde un favori"""
+    try:
+        favorite_data = {
+            'user_id': user_id,
+            'title': title,
+            'content': content,
+            'content_type': content_type,
+            'created_at': get_timestamp()
+        }
+        
+        return _create_with_stats('favorites', favorite_data, {STATS_COUNTERS['favorites']: 1})
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_favorite').inc()
+        print(f"Erreur save_favorite: {e}")
+        return None
+
+
+@metrics.track_db
+def get_favorites(user_id, limit=50, cursor=None):
+    """Récupère une page des favoris"""
+    start_after = decode_cursor(cursor)
+    try:
+        docs, next_cursor = _query_page('favorites', user_id, limit, start_after)
+        
+        results = []
+        for doc in docs:
+            data = doc.to_dict()
+            results.append({
+                'id': doc.id,
+                'created_at': data.get('created_at'),
+                'title': data.get('title'),
+                'content': data.get('content'),
+                'content_type': data.get('content_type')
+            })
+        
+        return {'items': results, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_favorites').inc()
+        print(f"Erreur get_favorites: {e}")
+        return {'items': [], 'next_cursor': None}
+
+
+@metrics.track_db
+def delete_favorite(favorite_id, user_id):
+    """Supprime un favori"""
+    try:
+        return _delete_with_stats('favorites', favorite_id, user_id,
+                                  lambda data: {'total_favorites': -1}) is not None
+    except Exception:
+        metrics.DB_ERRORS.labels('delete_favorite').inc()
+        return False
+
+
+# ==================== EXPORT ====================
+
+@metrics.track_db
+def export_page(collection, user_id, limit=100, cursor=None):
+    """
+    Page complète d'une collection pour l'export: tous les champs, textes complets chargés
+    (en parallèle), entrées archivées comprises (après celles de la collection). Retourne {'items': [...], 'next_cursor': ...}, ou None en cas d'erreur:
+    l'export s'interrompt plutôt que d'omettre des documents.
+    """
+    start_after = decode_cursor(cursor)
+    try:
+        docs, next_cursor = _query_page(collection, user_id, limit, start_after)
+        documents = [dict(doc.to_dict(), id=doc.id) for doc in docs]
+        if next_cursor is None and collection in ARCHIVE_COLLECTIONS:
+            # Collection épuisée: l'export se poursuit dans les archives (entrées plus anciennes)
+            after = (documents[-1]['created_at'], documents[-1]['id']) if documents else start_after
+            months = _archived_months(collection, user_id, until=after[0][:7] if after else None)
+            archived, next_cursor = archive_page(months, limit - len(documents), after)
+            documents += archived
+        items = [export_item(data['id'], data) for data in documents]
+        
+        # Documents antérieurs aux blobs: le texte est déjà en place
+        field = ORIGINAL_TEXT_FIELDS.get(collection)
+        missing = [(item, data['blob_id']) for item, data in zip(items, documents)
+                   if field and data.get('blob_id') and field not in data]
+        if missing:
+            texts = gather(*[partial(get_blob, blob_id) for _, blob_id in missing])
+            for (item, _), text in zip(missing, texts):
+                item[field] = text
+        
+        return {'items': items, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('export_page').inc()
+        print(f"Erreur export_page: {e}")
+        return None
+
+
+# ==================== STATISTICS ====================
+
+@metrics.track_db
+def get_global_stats(user_id):
+    """Récupère les statistiques d'utilisation (une seule lecture: user_stats/{user_id})"""
+    try:
+        doc = _stats_ref(user_id).get()
+        stats = doc.to_dict() if doc.exists else None
+        if stats and stats.get('rebuilt_at'):
+            return format_stats(stats)
+        
+        # Utilisateur antérieur aux agrégats: reconstruction à la première consultation. Sans la
+        # marque rebuilt_at, le document peut n'être que partiel: créé par les incréments (merge)
+        # d'une écriture postérieure aux agrégats, il ne compte pas l'historique plus ancien
+        return format_stats(rebuild_user_stats(user_id) or {})
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_global_stats').inc()
+        print(f"Erreur get_global_stats: {e}")
+        return format_stats({})
+
+
+@metrics.track_db
+def rebuild_user_stats(user_id):
+    """
+    Recalcule user_stats/{user_id} depuis les collections brutes (rattrapage ou réparation).
+    Les résumés sont lus avec projection sur les seuls champs agrégés, les autres
+    collections sont simplement comptées (requêtes d'agrégation count()), toutes lancées ensemble.
+    Une écriture concurrente pendant le recalcul peut être perdue: à lancer hors pointe.
+    """
+    def summaries():
+        return [doc.to_dict() for doc in (get_db().collection('summaries')
+                                          .where('user_id', '==', user_id)
+                                          .select(['original_words', 'compression_rate', 'style'])
+                                          .stream())]
+    
+    counted = [collection for collection in STATS_COUNTERS if collection != 'summaries']
+    try:
+        docs, manifest, *counts = gather(summaries, partial(_archive_manifest, user_id),
+                                         *[partial(_count, collection, user_id) for collection in counted])
+        stats = {}
+        for data in docs:
+            merge_delta(stats, summary_delta(data))
+        for collection, value in zip(counted, counts):
+            stats[STATS_COUNTERS[collection]] = value
+        
+        # Les entrées archivées font toujours partie de l'historique (décomptes lus sur le manifeste)
+        for entry in _iter_archived(user_id, 'summaries', manifest):
+            merge_delta(stats, summary_delta(entry))
+        for collection in ARCHIVE_COLLECTIONS:
+            if collection != 'summaries':
+                stats[STATS_COUNTERS[collection]] += _archived_count(manifest, collection)
+        
+        for counter in STATS_COUNTERS.values():
+            stats.setdefault(counter, 0)
+        stats.setdefault('total_words_processed', 0)
+        stats.setdefault('compression_sum', 0)
+        stats.setdefault('style_counts', {})
+        stats['updated_at'] = stats['rebuilt_at'] = get_timestamp()
+        
+        _stats_ref(user_id).set(stats)
+        return stats
+    except Exception as e:
+        metrics.DB_ERRORS.labels('rebuild_user_stats').inc()
+        print(f"Erreur rebuild_user_stats: {e}")
+        return None
+
+
+def iter_user_ids():
+    """IDs de tous les utilisateurs (projection vide: aucun champ lu)"""
+    for doc in get_db().collection('users').select([]).stream():
+        yield doc.id
+
+
+# ==================== STATISTIQUES PAR JOUR ====================
+
+def _rollup_ref(user_id):
+    """
+    Document user_rollups/{user_id}: {'days': {AAAA-MM-JJ: métriques}, 'months': {AAAA-MM: métriques},
+    'compacted_before'}. Toute la série en une lecture; la compaction le garde loin de la limite de 1 Mio.
+    """
+    return get_db().collection('user_rollups').document(user_id)
+
+
+def _rollup_update(delta):
+    """Convertit un delta par jour (voir database.rollup_delta) en incréments Firestore imbriqués"""
+    from firebase_admin import firestore
+    
+    def increments(values):
+        return {key: increments(value) if isinstance(value, dict) else firestore.Increment(value)
+                for key, value in values.items()}
+    
+    return {'days': increments(delta)}
+
+
+@metrics.track_db
+def get_rollups(user_id, start=None, end=None):
+    """
+    Statistiques de l'utilisateur touchant [start, end] (AAAA-MM-JJ, bornes facultatives), en une lecture:
+    {'days': {jour: métriques}, 'months': {mois: métriques}, 'compacted_before': date ou None}
+    """
+    def in_range(period):
+        return (not start or period >= start[:7]) and (not end or period <= end)
+    
+    try:
+        data = _rollup_ref(user_id).get().to_dict() or {}
+        return {
+            'days': {day: values for day, values in (data.get('days') or {}).items() if in_range(day)},
+            'months': {month: values for month, values in (data.get('months') or {}).items() if in_range(month)},
+            'compacted_before': data.get('compacted_before')
+        }
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_rollups').inc()
+        print(f"Erreur get_rollups: {e}")
+        return None
+
+
+@metrics.track_db
+def compact_rollups(user_id, before):
+    """
+    Cumule dans leur mois les jours antérieurs à before (AAAA-MM-JJ), en transaction: un incrément
+    concurrent fait rejouer la compaction. Retourne le nombre de jours repliés.
+    """
+    from firebase_admin import firestore
+    
+    client = get_db()
+    ref = _rollup_ref(user_id)
+    
+    @firestore.transactional
+    def run(transaction):
+        doc = ref.get(transaction=transaction)
+        if not doc.exists:
+            return 0
+        data = doc.to_dict()
+        days, months = data.get('days') or {}, data.get('months') or {}
+        folded = fold_rollups(days, months, before)
+        compacted_before = max(before, data.get('compacted_before') or before)
+        if folded or compacted_before != data.get('compacted_before'):
+            transaction.set(ref, {'days': days, 'months': months, 'compacted_before': compacted_before})
+        return folded
+    
+    try:
+        return run(client.transaction())
+    except Exception as e:
+        metrics.DB_ERRORS.labels('compact_rollups').inc()
+        print(f"Erreur compact_rollups: {e}")
+        return None
+
+
+@metrics.track_db
+def rebuild_rollups(user_id):
+    """
+    Recalcule user_rollups/{user_id} depuis les collections (projection sur les champs comptés,
+    lues en parallèle), en respectant la dernière compaction. Retourne {'days': n, 'months': n}.
+    Une écriture concurrente pendant le recalcul peut être perdue: à lancer hors pointe.
+    """
+    def read(collection, fields):
+        return lambda: [doc.to_dict() for doc in
+                        get_db().collection(collection).where('user_id', '==', user_id).select(fields).stream()]
+    
+    try:
+        ref = _rollup_ref(user_id)
+        current, manifest, *collections = gather(
+            lambda: ref.get(field_paths=['compacted_before']).to_dict() or {},
+            partial(_archive_manifest, user_id),
+            *[read(collection, fields) for collection, fields in ROLLUP_FIELDS.items()])
+        days, months = {}, {}
+        for collection, docs in zip(ROLLUP_FIELDS, collections):
+            for data in docs:
+                merge_delta(days, rollup_delta(collection, data))
+            if collection in ARCHIVE_COLLECTIONS:
+                for entry in _iter_archived(user_id, collection, manifest):
+                    merge_delta(days, rollup_delta(collection, entry))
+        
+        compacted_before = current.get('compacted_before')
+        if compacted_before:
+            fold_rollups(days, months, compacted_before)
+        ref.set({'days': days, 'months': months, 'compacted_before': compacted_before})
+        return {'days': len(days), 'months': len(months)}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('rebuild_rollups').inc()
+        print(f"Erreur rebuild_rollups: {e}")
+        return None
+
+
+# ==================== RECHERCHE ====================
+
+# Documents par terme (selon la clé de l'entrée): les listes d'occurrences des termes
+# fréquents restent loin de la limite de 1 Mio par document
+SEARCH_TERM_SHARDS = 4
+
+_search_pool = None
+_search_pool_lock = threading.Lock()
+_search_queues = {}  # user_id -> tâches d'index en attente (présent tant qu'un thread les exécute)
+
+
+def _search_ref(user_id):
+    """
+    Index de recherche de l'utilisateur:
+      search_index/{user_id}                      nombre d'entrées et longueur totale (BM25)
+      search_index/{user_id}/terms/{terme}~{n}    {'term', 'postings': {clé: [tf, longueur]}}
+      search_index/{user_id}/entries/{clé}        champs affichés, longueur et termes de l'entrée
+    avec clé = {collection}:{doc_id}
+    """
+    return get_db().collection('search_index').document(user_id)
+
+
+def _posting_key(collection, doc_id):
+    return f'{collection}:{doc_id}'
+
+
+def _term_doc_id(term, key):
+    return f'{term}~{zlib.crc32(key.encode("utf-8")) % SEARCH_TERM_SHARDS}'
+
+
+def _submit_search_task(user_id, func, *args):
+    """
+    Mise à jour de l'index en arrière-plan: l'enregistrement n'attend pas ses écritures d'index.
+    Les tâches d'un même utilisateur s'exécutent une à une, dans l'ordre de soumission
+    (un retrait ne peut pas passer devant l'ajout de la même entrée).
+    Pendant l'arrêt du processus (dernier flush de l'écriture différée), la tâche est exécutée ici.
+    """
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            _search_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='search-index')
+            atexit.register(_drain_search_pool)
+        queue = _search_queues.get(user_id)
+        if queue is not None:
+            queue.append((func, args))
+            return
+        _search_queues[user_id] = deque([(func, args)])
+        try:
+            _search_pool.submit(_run_search_tasks, user_id)
+            return
+        except RuntimeError:
+            pass  # Pool arrêté
+    _run_search_tasks(user_id)
+
+
+def _run_search_tasks(user_id):
+    while True:
+        with _search_pool_lock:
+            queue = _search_queues[user_id]
+            if not queue:
+                del _search_queues[user_id]
+                return
+            func, args = queue.popleft()
+        try:
+            func(*args)
+        except Exception as e:
+            metrics.DB_ERRORS.labels(func.__name__).inc()
+            print(f"Erreur {func.__name__}: {e}")
+
+
+def _drain_search_pool():
+    """À l'arrêt du processus: termine les tâches d'index en attente au lieu de les perdre"""
+    if _search_pool is not None:
+        _search_pool.shutdown(wait=True)
+
+
+def _index_after_commit(collection, doc_id, data):
+    """Planifie l'indexation d'un document qui vient d'être validé (collections indexées seulement)"""
+    if collection in SEARCH_COLLECTIONS:
+        _submit_search_task(data['user_id'], _index_committed, collection, doc_id, data)
+
+
+def _index_committed(collection, doc_id, data):
+    """Indexe le document s'il existe encore: une suppression validée entre-temps n'est pas annulée"""
+    if not get_db().collection(collection).document(doc_id).get(field_paths=['user_id']).exists:
+        return
+    _index_entry(data['user_id'], collection, doc_id, data)
+
+
+def _index_entry(user_id, collection, doc_id, data):
+    """Ajoute une entrée à l'index de l'utilisateur en un seul commit (au plus 202 écritures)"""
+    from firebase_admin import firestore
+    
+    terms, length = search.index_terms(search_text(collection, data))
+    if not terms:
+        return
+    key = _posting_key(collection, doc_id)
+    root = _search_ref(user_id)
+    batch = get_db().batch()
+    for term, tf in terms.items():
+        batch.set(root.collection('terms').document(_term_doc_id(term, key)),
+                  {'term': term, 'postings': {key: [tf, length]}}, merge=True)
+    batch.set(root.collection('entries').document(key), {
+        'collection': collection,
+        'doc_id': doc_id,
+        'created_at': data.get('created_at'),
+        'item': search_item(collection, data),
+        'length': length,
+        'terms': list(terms)
+    })
+    batch.set(root, {'entries': firestore.Increment(1), 'total_length': firestore.Increment(length)}, merge=True)
+    batch.commit()
+
+
+def _unindex_entry(user_id, collection, doc_id):
+    """Retire une entrée de l'index (ses termes sont lus sur son document entries/{clé})"""
+    from firebase_admin import firestore
+    
+    key = _posting_key(collection, doc_id)
+    root = _search_ref(user_id)
+    entry_ref = root.collection('entries').document(key)
+    entry = entry_ref.get(field_paths=['terms', 'length'])
+    if not entry.exists:
+        return
+    entry = entry.to_dict()
+    batch = get_db().batch()
+    for term in entry.get('terms') or []:
+        batch.set(root.collection('terms').document(_term_doc_id(term, key)),
+                  {'postings': {key: firestore.DELETE_FIELD}}, merge=True)
+    batch.delete(entry_ref)
+    batch.set(root, {'entries': firestore.Increment(-1),
+                     'total_length': firestore.Increment(-(entry.get('length') or 0))}, merge=True)
+    batch.commit()
+
+
+def _delete_collection(collection_ref):
+    """Supprime tous les documents d'une collection par pages de DELETE_PAGE_SIZE références"""
+    query = collection_ref.select([]).limit(DELETE_PAGE_SIZE)
+    while True:
+        refs = [doc.reference for doc in query.stream()]
+        if not refs:
+            return
+        batch = get_db().batch()
+        for ref in refs:
+            batch.delete(ref)
+        batch.commit()
+        if len(refs) < DELETE_PAGE_SIZE:
+            return
+
+
+def _delete_search_index(user_id):
+    root = _search_ref(user_id)
+    _delete_collection(root.collection('entries'))
+    _delete_collection(root.collection('terms'))
+    root.delete()
+
+
+def _expand_prefix(terms_ref, prefix):
+    """Listes d'occurrences des termes commençant par prefix: {terme: {clé: (tf, longueur)}}"""
+    docs = (terms_ref
+            .where('term', '>=', prefix)
+            .where('term', '<', prefix + '\uf8ff')
+            .limit(search.MAX_PREFIX_EXPANSIONS * SEARCH_TERM_SHARDS)
+            .stream())
+    terms = {}
+    for doc in docs:
+        data = doc.to_dict()
+        postings = terms.setdefault(data['term'], {})
+        for key, (tf, length) in (data.get('postings') or {}).items():
+            postings[key] = (tf, length)
+    return terms
+
+
+@metrics.track_db
+def search_history(user_id, query, collections=None, limit=20):
+    """
+    Recherche classée (BM25) dans l'historique de l'utilisateur, chaque terme de la requête
+    étant un préfixe. Lit l'index (quelques documents par terme) puis les entrées retenues,
+    jamais les collections d'historique. Retourne {'items': [...]} du plus pertinent au moins pertinent.
+    """
+    prefixes = search.query_terms(query)
+    if not prefixes:
+        return {'items': []}
+    try:
+        root = _search_ref(user_id)
+        terms_ref = root.collection('terms')
+        stats_doc, *expanded = gather(root.get, *[partial(_expand_prefix, terms_ref, prefix) for prefix in prefixes])
+        matches = dict(zip(prefixes, expanded))
+        stats = stats_doc.to_dict() or {}
+        
+        n_docs = stats.get('entries') or 0
+        avgdl = (stats.get('total_length') or 0) / n_docs if n_docs else 0
+        accept = (lambda key: key.split(':', 1)[0] in collections) if collections else None
+        ranked = search.rank(matches, n_docs, avgdl, limit, accept)
+        if not ranked:
+            return {'items': []}
+        
+        refs = [root.collection('entries').document(key) for key, _ in ranked]
+        entries = {doc.id: doc.to_dict() for doc in get_db().get_all(
+            refs, field_paths=['collection', 'doc_id', 'created_at', 'item']) if doc.exists}
+        items = []
+        for key, score in ranked:
+            entry = entries.get(key)
+            if entry:
+                items.append({
+                    'id': entry['doc_id'],
+                    'collection': entry['collection'],
+                    'created_at': entry.get('created_at'),
+                    **(entry.get('item') or {}),
+                    'score': round(score, 3)
+                })
+        return {'items': items}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('search_history').inc()
+        print(f"Erreur search_history: {e}")
+        return {'items': []}
+
+
+@metrics.track_db
+def rebuild_search_index(user_id):
+    """Reconstruit l'index de recherche de l'utilisateur depuis ses collections et archives; retourne le nombre d'entrées"""
+    try:
+        _delete_search_index(user_id)
+        indexed = 0
+        for collection in SEARCH_COLLECTIONS:
+            for doc in get_db().collection(collection).where('user_id', '==', user_id).stream():
+                _index_entry(user_id, collection, doc.id, doc.to_dict())
+                indexed += 1
+            if collection in ARCHIVE_COLLECTIONS:
+                for entry in _iter_archived(user_id, collection):
+                    _index_entry(user_id, collection, entry['id'], entry)
+                    indexed += 1
+        return indexed
+    except Exception as e:
+        metrics.DB_ERRORS.labels('rebuild_search_index').inc()
+        print(f"Erreur rebuild_search_index: {e}")
+        return None
+
+
+# ==================== ARCHIVES ====================
+
+def _archive_ref(user_id):
+    """
+    Archives de l'utilisateur (voir archive_history):
+      history_archives/{user_id}                                {'collections': {collection: {mois: décomptes}}}
+      history_archives/{user_id}/parts/{collection}_{mois}_{n}  {'ids', 'entries', 'data'}: entrées en JSON zlib
+    Le manifeste donne, par mois, le nombre d'entrées, de parts et d'octets compressés.
+    """
+    return get_db().collection('history_archives').document(user_id)
+
+
+def _part_ref(user_id, collection, period, part):
+    return _archive_ref(user_id).collection('parts').document(f'{collection}_{period}_{part}')
+
+
+def _archive_manifest(user_id, transaction=None):
+    doc = _archive_ref(user_id).get(transaction=transaction)
+    return ((doc.to_dict() or {}).get('collections') or {}) if doc.exists else {}
+
+
+def _archived_count(manifest, collection):
+    return sum(month.get('entries', 0) for month in (manifest.get(collection) or {}).values())
+
+
+def _archived_months(collection, user_id, until=None, manifest=None):
+    """
+    Entrées archivées par mois, du plus récent au plus ancien (jusqu'au mois until compris):
+    [(AAAA-MM, entrées)], les parts d'un mois lues en un seul get_all au moment où il est parcouru
+    """
+    months = (_archive_manifest(user_id) if manifest is None else manifest).get(collection) or {}
+    for period in sorted(months, reverse=True):
+        if until and period > until:
+            continue
+        refs = [_part_ref(user_id, collection, period, part) for part in range(months[period].get('parts', 0))]
+        entries = []
+        for doc in get_db().get_all(refs, field_paths=['data']):
+            if doc.exists:
+                entries.extend(unpack_archive(doc.get('data')))
+        yield period, entries
+
+
+def _iter_archived(user_id, collection, manifest=None):
+    """Toutes les entrées archivées d'une collection, avec leur user_id"""
+    for _, entries in _archived_months(collection, user_id, manifest=manifest):
+        for entry in entries:
+            yield dict(entry, user_id=user_id)
+
+
+def _get_archived(collection, doc_id, user_id):
+    """Entrée archivée de l'utilisateur par son ID (index automatique sur le tableau ids), ou None"""
+    parts = _archive_ref(user_id).collection('parts').where('ids', 'array_contains', doc_id).limit(1).stream()
+    for part in parts:
+        if part.get('collection') != collection:
+            continue
+        entry = next((entry for entry in unpack_archive(part.get('data')) if entry['id'] == doc_id), None)
+        if entry:
+            return dict(entry, user_id=user_id, archived=True)
+    return None
+
+
+def _archive_month(user_id, collection, period, refs):
+    """
+    Archive des documents d'un même mois en une transaction: relecture des documents et de la
+    dernière part du mois, puis écriture des parts, du manifeste et suppression des documents.
+    Une transaction par mois borne sa taille (au plus deux parts réécrites, limite de 10 Mio par commit).
+    """
+    from firebase_admin import firestore
+    
+    client = get_db()
+    root = _archive_ref(user_id)
+    
+    @firestore.transactional
+    def run(transaction):
+        month = (_archive_manifest(user_id, transaction).get(collection) or {}).get(period) or {}
+        parts = month.get('parts', 0)
+        existing, rewritten_bytes = [], 0
+        if parts:
+            last = _part_ref(user_id, collection, period, parts - 1).get(transaction=transaction)
+            if last.exists:
+                existing, rewritten_bytes = unpack_archive(last.get('data')), len(last.get('data'))
+        docs = [doc for doc in transaction.get_all(refs) if doc.exists and doc.get('user_id') == user_id]
+        entries = [archive_entry(doc.id, doc.to_dict()) for doc in docs]
+        if not entries:
+            return 0
+        
+        # La dernière part est complétée, puis redécoupée si elle dépasse la taille d'une part
+        first_part = max(parts - 1, 0)
+        packed = pack_archive_parts(existing + entries)
+        for offset, (part_entries, data) in enumerate(packed):
+            transaction.set(_part_ref(user_id, collection, period, first_part + offset), {
+                'collection': collection,
+                'period': period,
+                'part': first_part + offset,
+                'ids': [entry['id'] for entry in part_entries],
+                'entries': len(part_entries),
+                'data': data,
+                'updated_at': get_timestamp()
+            })
+        for doc in docs:
+            transaction.delete(doc.reference)
+        transaction.set(root, {
+            'collections': {collection: {period: {
+                'entries': month.get('entries', 0) + len(entries),
+                'parts': first_part + len(packed),
+                'bytes': month.get('bytes', 0) - rewritten_bytes + sum(len(data) for _, data in packed),
+            }}},
+            'updated_at': get_timestamp()
+        }, merge=True)
+        return len(entries)
+    
+    archived = run(client.transaction())
+    if archived:
+        invalidate_pages(user_id, [collection])
+    return archived
+
+
+@metrics.track_db
+def archive_history(user_id, collection, before, limit=ARCHIVE_BATCH_SIZE):
+    """
+    Déplace au plus limit entrées de collection antérieures à before (AAAA-MM-JJ) dans les archives
+    de leur mois (une transaction par mois). Agrégats, statistiques par jour, index de recherche et
+    références aux textes complets sont inchangés: l'entrée fait toujours partie de l'historique.
+    Retourne {AAAA-MM: entrées archivées} (vide: plus rien à archiver), ou None en cas d'erreur.
+    """
+    try:
+        docs = (get_db().collection(collection)
+                .where('user_id', '==', user_id)
+                .where('created_at', '<', before)
+                .order_by('created_at', direction='ASCENDING')
+                .select(['created_at'])
+                .limit(limit)
+                .stream())
+        # Les plus anciennes d'abord: après un lot partiel, les entrées restées en collection sont
+        # toutes plus récentes que les archives, ce que supposent archive_page et l'export
+        months = {}
+        for doc in docs:
+            months.setdefault(doc.get('created_at')[:7], []).append(doc.reference)
+        return {period: _archive_month(user_id, collection, period, refs) for period, refs in months.items()}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('archive_history').inc()
+        print(f"Erreur archive_history: {e}")
+        return None
+
+
+@metrics.track_db
+def preview_archive(user_id, collection, before):
+    """Entrées de collection antérieures à before, par mois: ce qu'archive_history déplacerait"""
+    try:
+        docs = (get_db().collection(collection)
+                .where('user_id', '==', user_id)
+                .where('created_at', '<', before)
+                .order_by('created_at', direction='ASCENDING')
+                .select(['created_at'])
+                .stream())
+        return dict(Counter(doc.get('created_at')[:7] for doc in docs))
+    except Exception as e:
+        metrics.DB_ERRORS.labels('preview_archive').inc()
+        print(f"Erreur preview_archive: {e}")
+        return None
+
+
+@metrics.track_db
+def get_archives(user_id):
+    """Archives de l'utilisateur: {collection: {AAAA-MM: {'entries', 'parts', 'bytes'}}} (une lecture)"""
+    try:
+        return _archive_manifest(user_id)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_archives').inc()
+        print(f"Erreur get_archives: {e}")
+        return None
+
+
+def _delete_archives(user_id):
+    """Supprime les archives de l'utilisateur et libère leurs textes complets; retourne {collection: entrées}"""
+    manifest = _archive_manifest(user_id)
+    releases = Counter()
+    for collection in ARCHIVE_COLLECTIONS:
+        for entry in _iter_archived(user_id, collection, manifest):
+            if entry.get('blob_id'):
+                releases[entry['blob_id']] += 1
+    blob_ids = list(releases)
+    for start in range(0, len(blob_ids), DELETE_PAGE_SIZE):
+        batch = get_db().batch()
+        for blob_id in blob_ids[start:start + DELETE_PAGE_SIZE]:
+            batch.set(_blob_ref(blob_id), _release_update(releases[blob_id]), merge=True)
+        batch.commit()
+    _delete_collection(_archive_ref(user_id).collection('parts'))
+    _archive_ref(user_id).delete()
+    return {collection: _archived_count(manifest, collection) for collection in manifest}
+
+
+# ==================== EFFACEMENT DE L'HISTORIQUE ====================
+
+DELETE_PAGE_SIZE = 500  # Limite Firestore d'opérations par lot
+
+# Collections dont les documents référencent un texte complet (voir put_blob)
+BLOB_COLLECTIONS = ('summaries', 'translations')
+
+
+def _delete_user_docs(collection, user_id, progress=None):
+    """
+    Supprime les documents d'un utilisateur par pages: la requête ne lit que les
+    références (et blob_id) et chaque page est supprimée en un seul commit.
+    Relancer la fonction après une interruption reprend là où elle s'était arrêtée.
+    """
+    client = get_db()
+    # Résumés et traductions: blob_id est lu pour libérer les textes complets dans le même commit
+    with_blobs = collection in BLOB_COLLECTIONS
+    page_size = DELETE_PAGE_SIZE // 2 if with_blobs else DELETE_PAGE_SIZE
+    query = (client.collection(collection)
+             .where('user_id', '==', user_id)
+             .select(['blob_id'] if with_blobs else [])
+             .limit(page_size))
+    deleted = 0
+    while True:
+        docs = list(query.stream())
+        if not docs:
+            break
+        batch = client.batch()
+        releases = Counter()
+        for doc in docs:
+            batch.delete(doc.reference)
+            blob_id = (doc.to_dict() or {}).get('blob_id')
+            if blob_id:
+                releases[blob_id] += 1
+        for blob_id, count in releases.items():
+            batch.set(_blob_ref(blob_id), _release_update(count), merge=True)
+        batch.commit()
+        deleted += len(docs)
+        if progress:
+            progress(collection, deleted)
+        if len(docs) < page_size:
+            break
+    return deleted
+
+
+@metrics.track_db
+def count_history(user_id):
+    """Nombre de documents d'historique par collection (requêtes count() en parallèle), entrées archivées comprises"""
+    try:
+        manifest, *counts = gather(partial(_archive_manifest, user_id),
+                                   *[partial(_count, collection, user_id) for collection in HISTORY_COLLECTIONS])
+        return {
+            collection: value + _archived_count(manifest, collection)
+            for collection, value in zip(HISTORY_COLLECTIONS, counts)
+        }
+    except Exception as e:
+        metrics.DB_ERRORS.labels('count_history').inc()
+        print(f"Erreur count_history: {e}")
+        return None
+
+
+@metrics.track_db
+def clear_all_history(user_id, progress=None):
+    """
+    Efface tout l'historique d'un utilisateur, les collections en parallèle.
+    progress(collection, supprimés), si fourni, est appelé après chaque lot (depuis plusieurs threads).
+    Retourne {collection: nombre supprimé}, ou None en cas d'erreur.
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=len(HISTORY_COLLECTIONS) + 1, thread_name_prefix='clear') as pool:
+            futures = {name: pool.submit(_delete_user_docs, name, user_id, progress)
+                       for name in HISTORY_COLLECTIONS}
+            index_future = pool.submit(_delete_search_index, user_id)
+            archives_future = pool.submit(_delete_archives, user_id)
+            deleted = {name: future.result() for name, future in futures.items()}
+            index_future.result()
+            merge_delta(deleted, archives_future.result())
+        
+        # Remise à zéro des compteurs vidés (les favoris sont conservés)
+        reset = {STATS_COUNTERS[name]: 0 for name in HISTORY_COLLECTIONS}
+        reset.update({'total_words_processed': 0, 'compression_sum': 0, 'style_counts': {},
+                      'updated_at': get_timestamp()})
+        _stats_ref(user_id).set(reset, merge=list(reset))
+        _rollup_ref(user_id).delete()
+        
+        return deleted
+    except Exception as e:
+        metrics.DB_ERRORS.labels('clear_all_history').inc()
+        print(f"Erreur clear_all_history: {e}")
+        return None
+    finally:
+        # Aussi après un effacement partiel
+        invalidate_pages(user_id, HISTORY_COLLECTIONS)
+
+
+@metrics.track_db
+def get_clear_job(user_id):
+    """État du dernier effacement en arrière-plan (history_jobs/{user_id}) ou None"""
+    try:
+        doc = get_db().collection('history_jobs').document(user_id).get()
+        return doc.to_dict() if doc.exists else None
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_clear_job').inc()
+        print(f"Erreur get_clear_job: {e}")
+        return None
+
+
+@metrics.track_db
+def save_clear_job(user_id, data):
+    """Met à jour l'état d'effacement de l'utilisateur (fusion des champs)"""
+    try:
+        data = dict(data, updated_at=get_timestamp())
+        get_db().collection('history_jobs').document(user_id).set(data, merge=True)
+        return True
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_clear_job').inc()
+        print(f"Erreur save_clear_job: {e}")
+        return False
+
+
+def init_db():
+    """Initialise le client Firestore à l'avance (préchauffage) - pas de schéma à créer"""
+    get_db()
+    print("Firebase Firestore prêt - pas besoin d'initialisation de schéma")
+
@@ -0,0 +1,1483 @@
+import heapq
+import json
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import database
+import metrics
+import search
+from database import (
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_COLLECTIONS,
+    HISTORY_COLLECTIONS,
+    ORIGINAL_TEXT_FIELDS,
+    ROLLUP_FIELDS,
+    SEARCH_COLLECTIONS,
+    STATS_COUNTERS,
+    SUMMARY_LIST_FIELDS,
+    analysis_preview,
+    archive_entry,
+    archive_page,
+    blob_report,
+    compute_compression_rate,
+    decode_cursor,
+    encode_cursor,
+    export_item,
+    fold_rollups,
+    format_stats,
+    get_timestamp,
+    group_by_month,
+    make_preview,
+    merge_delta,
+    new_doc_id,
+    pack_archive_parts,
+    pack_text,
+    rollup_delta,
+    search_item,
+    search_text,
+    summary_delta,
+    unpack_archive,
+    unpack_text,
+)
+
+# Backend local: un fichier SQLite en mode WAL (lectures concurrentes pendant les écritures),
+# une connexion par thread. Même interface et mêmes formats de retour que storage_firestore.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE COLLATE NOCASE,
+    email TEXT NOT NULL UNIQUE COLLATE NOCASE,
+    password_hash TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    plan TEXT,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    filename TEXT,
+    original_text TEXT,
+    blob_id TEXT,
+    original_chars INTEGER,
+    summary TEXT,
+    preview TEXT,
+    original_words INTEGER,
+    summary_words INTEGER,
+    target_words INTEGER,
+    style TEXT,
+    method TEXT,
+    model TEXT,
+    compression_rate REAL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_summaries_user_created ON summaries (user_id, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS translations (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    source_text TEXT,
+    blob_id TEXT,
+    source_preview TEXT,
+    source_chars INTEGER,
+    translated_text TEXT,
+    target_language TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_translations_user_created ON translations (user_id, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS analyses (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    analysis_type TEXT,
+    source_text_preview TEXT,
+    result TEXT,
+    preview TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_user_created ON analyses (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_analyses_user_type_created ON analyses (user_id, analysis_type, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS qa_history (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    document_preview TEXT,
+    question TEXT,
+    answer TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_qa_history_user_created ON qa_history (user_id, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS favorites (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT,
+    content TEXT,
+    content_type TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites (user_id, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id TEXT PRIMARY KEY,
+    total_summaries INTEGER NOT NULL DEFAULT 0,
+    total_words_processed INTEGER NOT NULL DEFAULT 0,
+    compression_sum REAL NOT NULL DEFAULT 0,
+    total_translations INTEGER NOT NULL DEFAULT 0,
+    total_analyses INTEGER NOT NULL DEFAULT 0,
+    total_qa INTEGER NOT NULL DEFAULT 0,
+    total_favorites INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS user_style_counts (
+    user_id TEXT NOT NULL,
+    style TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, style)
+);
+
+CREATE TABLE IF NOT EXISTS history_jobs (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS search_entries (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    created_at TEXT,
+    item TEXT,
+    length INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_search_entries_doc ON search_entries (collection, doc_id);
+CREATE INDEX IF NOT EXISTS idx_search_entries_user ON search_entries (user_id);
+
+-- Index inversé par utilisateur: un préfixe est une plage de la clé (user_id, term);
+-- la longueur de l'entrée est recopiée pour calculer BM25 sans jointure, et impact
+-- (search.impact à l'indexation) ordonne les meilleures occurrences de chaque terme
+CREATE TABLE IF NOT EXISTS search_postings (
+    user_id TEXT NOT NULL,
+    term TEXT NOT NULL,
+    entry_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    impact REAL NOT NULL,
+    PRIMARY KEY (user_id, term, entry_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_search_postings_entry ON search_postings (entry_id);
+CREATE INDEX IF NOT EXISTS idx_search_postings_impact ON search_postings (user_id, term, impact DESC);
+
+-- Nombre d'entrées contenant chaque terme, et totaux par utilisateur (idf et longueur moyenne de BM25)
+CREATE TABLE IF NOT EXISTS search_terms (
+    user_id TEXT NOT NULL,
+    term TEXT NOT NULL,
+    df INTEGER NOT NULL,
+    PRIMARY KEY (user_id, term)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS search_stats (
+    user_id TEXT PRIMARY KEY,
+    entries INTEGER NOT NULL DEFAULT 0,
+    total_length INTEGER NOT NULL DEFAULT 0
+);
+
+-- Statistiques par jour (AAAA-MM-JJ) ou par mois compacté (AAAA-MM), une ligne par métrique;
+-- les répartitions sont aplaties ('languages.en', 'styles.bullets')
+CREATE TABLE IF NOT EXISTS user_rollups (
+    user_id TEXT NOT NULL,
+    period TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value NUMERIC NOT NULL,
+    PRIMARY KEY (user_id, period, metric)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_rollup_compactions (
+    user_id TEXT PRIMARY KEY,
+    compacted_before TEXT NOT NULL
+);
+
+-- Archives mensuelles des entrées sorties des tables d'historique (voir archive_history): JSON
+-- compressé zlib, en parts d'au plus ARCHIVE_PART_BYTES; history_archive_ids situe chaque entrée
+CREATE TABLE IF NOT EXISTS history_archives (
+    user_id TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    period TEXT NOT NULL,
+    part INTEGER NOT NULL,
+    entries INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, collection, period, part)
+);
+
+CREATE TABLE IF NOT EXISTS history_archive_ids (
+    collection TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    period TEXT NOT NULL,
+    part INTEGER NOT NULL,
+    PRIMARY KEY (collection, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_history_archive_ids_user ON history_archive_ids (user_id);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    id TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 1,
+    data BLOB NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+# Colonnes enregistrées pour chaque collection (hors id); les valeurs dict/list sont en JSON
+COLUMNS = {
+    'summaries': ['user_id', 'filename', 'original_text', 'blob_id', 'original_chars', 'summary', 'preview',
+                  'original_words', 'summary_words', 'target_words', 'style', 'method', 'model',
+                  'compression_rate', 'created_at'],
+    'translations': ['user_id', 'source_text', 'blob_id', 'source_preview', 'source_chars', 'translated_text',
+                     'target_language', 'created_at'],
+    'analyses': ['user_id', 'analysis_type', 'source_text_preview', 'result', 'preview', 'created_at'],
+    'qa_history': ['user_id', 'document_preview', 'question', 'answer', 'created_at'],
+    'favorites': ['user_id', 'title', 'content', 'content_type', 'created_at'],
+}
+JSON_COLUMNS = {'result'}
+
+# Colonnes ajoutées après coup à d'autres tables (voir _add_missing_columns)
+ADDED_COLUMNS = {'users': ['plan']}
+
+# Tables dont les lignes référencent un texte complet (voir put_blob)
+BLOB_COLLECTIONS = ('summaries', 'translations')
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_initialized_paths = set()
+
+
+def get_conn():
+    """Connexion SQLite du thread courant (schéma créé à la première ouverture du fichier)"""
+    path = database.sqlite_path
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != path:
+        # isolation_level=None: transactions explicites (voir _transaction)
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with _schema_lock:
+            if path not in _initialized_paths:
+                conn.executescript(SCHEMA)
+                _add_missing_columns(conn)
+                _initialized_paths.add(path)
+        _local.conn = conn
+        _local.path = path
+    return conn
+
+
+def _add_missing_columns(conn):
+    """Fichiers créés par une version antérieure du schéma: ajoute les colonnes manquantes"""
+    for table, columns in {**COLUMNS, **ADDED_COLUMNS}.items():
+        existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+        for column in columns:
+            if column not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+
+
+@contextmanager
+def _transaction():
+    """Transaction d'écriture: BEGIN IMMEDIATE prend le verrou d'écriture dès le début"""
+    conn = get_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _row_to_dict(row):
+    data = dict(row)
+    for column in JSON_COLUMNS & data.keys():
+        if data[column] is not None:
+            data[column] = json.loads(data[column])
+    return data
+
+
+# ==================== AGRÉGATS PAR UTILISATEUR ====================
+
+def _apply_delta(conn, user_id, delta):
+    """Applique un delta d'agrégats (voir database.summary_delta) dans la transaction courante"""
+    conn.execute('INSERT INTO user_stats (user_id) VALUES (?) ON CONFLICT (user_id) DO NOTHING', (user_id,))
+    counters = {key: value for key, value in delta.items() if not isinstance(value, dict)}
+    if counters:
+        assignments = ', '.join(f'{key} = {key} + ?' for key in counters)
+        conn.execute(f'UPDATE user_stats SET {assignments}, updated_at = ? WHERE user_id = ?',
+                     [*counters.values(), get_timestamp(), user_id])
+    for style, count in (delta.get('style_counts') or {}).items():
+        conn.execute(
+            'INSERT INTO user_style_counts (user_id, style, count) VALUES (?, ?, ?) '
+            'ON CONFLICT (user_id, style) DO UPDATE SET count = count + excluded.count',
+            (user_id, style, count)
+        )
+
+
+def _insert(conn, collection, doc_id, data, delta=None):
+    columns = ['id', *COLUMNS[collection]]
+    values = [doc_id] + [
+        json.dumps(data.get(column), ensure_ascii=False) if column in JSON_COLUMNS else data.get(column)
+        for column in COLUMNS[collection]
+    ]
+    conn.execute(f"INSERT INTO {collection} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", values)
+    if delta:
+        _apply_delta(conn, data['user_id'], delta)
+    _apply_rollup(conn, data['user_id'], rollup_delta(collection, data))
+    if collection in SEARCH_COLLECTIONS:
+        _index_entry(conn, collection, doc_id, data)
+
+
+def _create_with_stats(collection, data, delta, batch=None):
+    """Crée un document et met à jour ses agrégats dans la même transaction (ou le confie au lot)"""
+    if batch is not None:
+        return batch.set(collection, data, delta)
+
+    doc_id = new_doc_id()
+    with _transaction() as conn:
+        _insert(conn, collection, doc_id, data, delta)
+    database.invalidate_pages(data['user_id'], [collection])
+    return doc_id
+
+
+def _delete_with_stats(collection, doc_id, user_id, delta_for):
+    """
+    Supprime un document de l'utilisateur et retire sa contribution des agrégats (et sa
+    référence au texte complet). Retourne le contenu supprimé, ou None s'il n'existait pas.
+    """
+    with _transaction() as conn:
+        row = conn.execute(f'SELECT * FROM {collection} WHERE id = ? AND user_id = ?', (doc_id, user_id)).fetchone()
+        if row is None:
+            return None
+        data = dict(row)
+        conn.execute(f'DELETE FROM {collection} WHERE id = ?', (doc_id,))
+        _apply_delta(conn, user_id, delta_for(data))
+        _apply_rollup(conn, user_id, rollup_delta(collection, data, sign=-1))
+        _unindex_entry(conn, collection, doc_id)
+        if data.get('blob_id'):
+            conn.execute('UPDATE blobs SET refs = refs - 1 WHERE id = ?', (data['blob_id'],))
+    database.invalidate_pages(user_id, [collection])
+    return data
+
+
+class BatchWriter:
+    """
+    Regroupe des créations de documents dans une seule transaction SQLite.
+    S'utilise comme context manager: le reliquat est validé à la sortie.
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self._pending = []
+        self._blobs = []  # textes complets (pack_text), écrits dans la même transaction
+        self.written = 0
+
+    def set(self, collection, data, stats_delta=None):
+        """Ajoute un document au lot et retourne son ID"""
+        doc_id = new_doc_id()
+        self._pending.append((collection, doc_id, data, stats_delta))
+        if len(self._pending) >= self.size:
+            try:
+                self.flush()
+            except Exception as e:
+                # Les documents restent en attente et seront retentés au prochain flush
+                print(f"Erreur BatchWriter.flush: {e}")
+        return doc_id
+
+    def put_blob(self, text):
+        """Ajoute le texte complet d'un document au lot et retourne l'ID de son blob"""
+        packed = pack_text(text)
+        self._blobs.append(packed)
+        return packed[0]
+
+    @metrics.track_db
+    def flush(self):
+        """Valide les documents en attente et leurs agrégats en une transaction"""
+        if not self._pending and not self._blobs:
+            return
+        with _transaction() as conn:
+            for packed in self._blobs:
+                _store_blob(conn, *packed)
+            for collection, doc_id, data, stats_delta in self._pending:
+                _insert(conn, collection, doc_id, data, stats_delta)
+        for user_id, collection in {(data['user_id'], collection) for collection, _, data, _ in self._pending}:
+            database.invalidate_pages(user_id, [collection])
+        self.written += len(self._pending)
+        self._pending = []
+        self._blobs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+
+# ==================== PAGINATION ====================
+
+def _query_page(collection, user_id, limit, start_after=None, filters=(), fields=None):
+    """
+    Page de documents d'un utilisateur, du plus récent au plus ancien, par position
+    (created_at, id): l'index (user_id, created_at, id) évite tout tri et tout OFFSET.
+    Retourne (lignes, curseur de la page suivante ou None).
+    """
+    columns = ', '.join(dict.fromkeys(['id', 'created_at', *(fields or COLUMNS[collection])]))
+    sql = f'SELECT {columns} FROM {collection} WHERE user_id = ?'
+    params = [user_id]
+    for field, value in filters:
+        sql += f' AND {field} = ?'
+        params.append(value)
+    if start_after:
+        sql += ' AND (created_at, id) < (?, ?)'
+        params.extend(start_after)
+    sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+
+    rows = [_row_to_dict(row) for row in get_conn().execute(sql, params)]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+
+def _get_owned(collection, doc_id, user_id):
+    row = get_conn().execute(f'SELECT * FROM {collection} WHERE id = ? AND user_id = ?', (doc_id, user_id)).fetchone()
+    return _row_to_dict(row) if row else None
+
+
+# ==================== TEXTES COMPLETS ====================
+
+@metrics.track_db
+def put_blob(text):
+    """
+    Stocke un texte une seule fois par contenu (table blobs, clé SHA-256, compressé zlib).
+    Un texte déjà présent n'est pas réécrit: seul son compteur de références augmente.
+    SQLite n'a pas de limite de taille de ligne utile ici: pas de découpage en morceaux.
+    """
+    packed = pack_text(text)
+    with _transaction() as conn:
+        _store_blob(conn, *packed)
+    return packed[0]
+
+
+def _store_blob(conn, blob_id, size, data):
+    """Insère un blob ou incrémente ses références, dans la transaction courante"""
+    if conn.execute('UPDATE blobs SET refs = refs + 1 WHERE id = ?', (blob_id,)).rowcount:
+        metrics.BLOB_BYTES.labels('deduplicated').inc(size)
+        return
+    conn.execute('INSERT INTO blobs (id, size, stored_size, refs, data, created_at) VALUES (?, ?, ?, 1, ?, ?)',
+                 (blob_id, size, len(data), data, get_timestamp()))
+    metrics.BLOB_BYTES.labels('raw').inc(size)
+    metrics.BLOB_BYTES.labels('stored').inc(len(data))
+
+
+@metrics.track_db
+def get_blob(blob_id):
+    """Texte complet d'un blob (None s'il n'existe pas)"""
+    try:
+        row = get_conn().execute('SELECT data FROM blobs WHERE id = ?', (blob_id,)).fetchone()
+        return unpack_text(row['data']) if row else None
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_blob').inc()
+        print(f"Erreur get_blob: {e}")
+        return None
+
+
+@metrics.track_db
+def release_blob(blob_id):
+    """Retire une référence à un blob (supprimé ensuite par gc_blobs s'il n'est plus référencé)"""
+    try:
+        with _transaction() as conn:
+            conn.execute('UPDATE blobs SET refs = refs - 1 WHERE id = ?', (blob_id,))
+    except Exception as e:
+        metrics.DB_ERRORS.labels('release_blob').inc()
+        print(f"Erreur release_blob: {e}")
+
+
+@metrics.track_db
+def get_blob_stats():
+    """Taux de compression et gain de la déduplication"""
+    try:
+        return blob_report(get_conn().execute('SELECT size, stored_size, refs FROM blobs'))
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_blob_stats').inc()
+        print(f"Erreur get_blob_stats: {e}")
+        return None
+
+
+@metrics.track_db
+def gc_blobs():
+    """Supprime les blobs qui ne sont plus référencés; retourne leur nombre (None en cas d'erreur)"""
+    try:
+        with _transaction() as conn:
+            return conn.execute('DELETE FROM blobs WHERE refs <= 0').rowcount
+    except Exception as e:
+        metrics.DB_ERRORS.labels('gc_blobs').inc()
+        print(f"Erreur gc_blobs: {e}")
+        return None
+
+
+def _put_original(text, batch=None):
+    """Texte complet d'un enregistrement d'historique: via le lot s'il y en a un"""
+    return batch.put_blob(text) if batch is not None else put_blob(text)
+
+
+def _load_original(data, field):
+    """Charge le texte complet référencé par blob_id (lignes antérieures: texte tronqué en place)"""
+    if data is not None and data.get('blob_id') and not data.get(field):
+        data[field] = get_blob(data['blob_id'])
+    return data
+
+
+# ==================== USERS ====================
+
+@metrics.track_db
+def create_user(username, email, password):
+    """Crée un nouvel utilisateur (unicité garantie par les contraintes UNIQUE, en une requête)"""
+    password_hash = generate_password_hash(password)
+
+    try:
+        user_id = new_doc_id()
+        with _transaction() as conn:
+            conn.execute(
+                'INSERT INTO users (id, username, email, password_hash, is_active, created_at) VALUES (?, ?, ?, ?, 1, ?)',
+                (user_id, username, email, password_hash, get_timestamp())
+            )
+        return {'success': True, 'user_id': user_id}
+
+    except sqlite3.IntegrityError as e:
+        if 'users.email' in str(e):
+            return {'success': False, 'error': 'Cet email est déjà utilisé'}
+        return {'success': False, 'error': 'Ce nom d\'utilisateur est déjà pris'}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('create_user').inc()
+        return {'success': False, 'error': f'Erreur lors de la création du compte: {str(e)}'}
+
+
+@metrics.track_db
+def authenticate_user(email, password):
+    """Authentifie un utilisateur"""
+    try:
+        user = get_conn().execute('SELECT * FROM users WHERE email = ? AND is_active = 1', (email,)).fetchone()
+        if user and check_password_hash(user['password_hash'], password):
+            return {
+                'success': True,
+                'user': {
+                    'id': user['id'],
+                    'username': user['username'],
+                    'email': user['email'],
+                    'created_at': user['created_at']
+                }
+            }
+
+        return {'success': False, 'error': 'Email ou mot de passe incorrect'}
+
+    except Exception as e:
+        metrics.DB_ERRORS.labels('authenticate_user').inc()
+        return {'success': False, 'error': f'Erreur d\'authentification: {str(e)}'}
+
+
+@metrics.track_db
+def get_user_by_id(user_id):
+    """Récupère un utilisateur par son ID"""
+    try:
+        user = get_conn().execute('SELECT id, username, email, created_at, plan FROM users WHERE id = ?',
+                                  (user_id,)).fetchone()
+        return dict(user) if user else None
+    except Exception:
+        metrics.DB_ERRORS.labels('get_user_by_id').inc()
+        return None
+
+
+@metrics.track_db
+def set_user_plan(user_id, plan):
+    """Change l'offre d'un utilisateur (durées de conservation, voir database.RETENTION_POLICIES)"""
+    try:
+        with _transaction() as conn:
+            updated = conn.execute('UPDATE users SET plan = ? WHERE id = ?', (plan, user_id)).rowcount
+        database.invalidate_user(user_id)
+        return updated > 0
+    except Exception as e:
+        metrics.DB_ERRORS.labels('set_user_plan').inc()
+        print(f"Erreur set_user_plan: {e}")
+        return False
+
+
+def backfill_user_keys():
+    """Rien à migrer: l'unicité repose sur les index UNIQUE de la table users"""
+    users = get_conn().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    return {'users': users, 'conflicts': []}
+
+
+@metrics.track_db
+def iter_user_ids():
+    """IDs de tous les utilisateurs"""
+    return [row['id'] for row in get_conn().execute('SELECT id FROM users')]
+
+
+# ==================== SUMMARIES ====================
+
+@metrics.track_db
+def save_summary(user_id, filename, original_text, summary, original_words, summary_words,
+                 target_words, style, method, model, batch=None):
+    """Sauvegarde un résumé (ou le confie au lot fourni)"""
+    try:
+        summary_data = {
+            'user_id': user_id,
+            'filename': filename,
+            'blob_id': _put_original(original_text, batch),
+            'original_chars': len(original_text),
+            'summary': summary,
+            'preview': make_preview(summary),
+            'original_words': original_words,
+            'summary_words': summary_words,
+            'target_words': target_words,
+            'style': style,
+            'method': method,
+            'model': model,
+            'compression_rate': compute_compression_rate(original_words, summary_words),
+            'created_at': get_timestamp()
+        }
+
+        return _create_with_stats('summaries', summary_data, summary_delta(summary_data), batch)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_summary').inc()
+        print(f"Erreur save_summary: {e}")
+        return None
+
+
+@metrics.track_db
+def get_summaries(user_id, limit=20, cursor=None):
+    """Récupère une page de l'historique des résumés (champs de liste uniquement)"""
+    start_after = decode_cursor(cursor)
+    try:
+        rows, next_cursor = _query_page('summaries', user_id, limit, start_after, fields=SUMMARY_LIST_FIELDS)
+        return {'items': rows, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_summaries').inc()
+        print(f"Erreur get_summaries: {e}")
+        return {'items': [], 'next_cursor': None}
+
+
+@metrics.track_db
+def get_summary_by_id(summary_id, user_id):
+    """Récupère un résumé par son ID"""
+    try:
+        data = _get_owned('summaries', summary_id, user_id) or _get_archived('summaries', summary_id, user_id)
+        return _load_original(data, 'original_text')
+    except Exception:
+        metrics.DB_ERRORS.labels('get_summary_by_id').inc()
+        return None
+
+
+@metrics.track_db
+def delete_summary(summary_id, user_id):
+    """Supprime un résumé"""
+    try:
+        return _delete_with_stats('summaries', summary_id, user_id,
+                                  lambda data: summary_delta(data, sign=-1)) is not None
+    except Exception:
+        metrics.DB_ERRORS.labels('delete_summary').inc()
+        return False
+
+
+# ==================== TRANSLATIONS ====================
+
+@metrics.track_db
+def save_translation(user_id, source_text, translated_text, target_language, batch=None):
+    """Sauvegarde une traduction"""
+    try:
+        translation_data = {
+            'user_id': user_id,
+            'blob_id': _put_original(source_text, batch),
+            'source_preview': make_preview(source_text),
+            'source_chars': len(source_text),
+            'translated_text': translated_text,
+            'target_language': target_language,
+            'created_at': get_timestamp()
+        }
+
+        return _create_with_stats('translations', translation_data, {STATS_COUNTERS['translations']: 1}, batch)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_translation').inc()
+        print(f"Erreur save_translation: {e}")
+        return None
+
+
+@metrics.track_db
+def get_translations(user_id, limit=20, cursor=None):
+    """Récupère une page de l'historique des traductions (aperçu du texte source, pas le texte complet)"""
+    start_after = decode_cursor(cursor)
+    try:
+        rows, next_cursor = _query_page('translations', user_id, limit, start_after,
+                                        fields=['source_preview', 'source_text', 'translated_text', 'target_language'])
+        for row in rows:
+            legacy_text = row.pop('source_text')
+            row['source_preview'] = row['source_preview'] or make_preview(legacy_text)
+        return {'items': rows, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_translations').inc()
+        print(f"Erreur get_translations: {e}")
+        return {'items': [], 'next_cursor': None}
+
+
+# ==================== ANALYSES ====================
+
+@metrics.track_db
+def save_analysis(user_id, analysis_type, source_text, result, batch=None):
+    """Sauvegarde une analyse"""
+    try:
+        analysis_data = {
+            'user_id': user_id,
+            'analysis_type': analysis_type,
+            'source_text_preview': source_text[:200],
+            'result': result,
+            'preview': analysis_preview(result),
+            'created_at': get_timestamp()
+        }
+
+        return _create_with_stats('analyses', analysis_data, {STATS_COUNTERS['analyses']: 1}, batch)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_analysis').inc()
+        print(f"Erreur save_analysis: {e}")
+        return None
+
+
+@metrics.track_db
+def get_analyses(user_id, analysis_type=None, limit=20, cursor=None):
+    """Récupère une page de l'historique des analyses (filtrable par type), sans le résultat complet"""
+    start_after = decode_cursor(cursor)
+    filters = [('analysis_type', analysis_type)] if analysis_type else []
+    try:
+        rows, next_cursor = _query_page('analyses', user_id, limit, start_after, filters,
+                                        fields=['analysis_type', 'source_text_preview', 'preview'])
+        return {'items': rows, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_analyses').inc()
+        print(f"Erreur get_analyses: {e}")
+        return {'items': [], 'next_cursor': None}
+
+
+@metrics.track_db
+def get_analysis_by_id(analysis_id, user_id):
+    """Récupère une analyse complète (avec result) par son ID"""
+    try:
+        return _get_owned('analyses', analysis_id, user_id) or _get_archived('analyses', analysis_id, user_id)
+    except Exception:
+        metrics.DB_ERRORS.labels('get_analysis_by_id').inc()
+        return None
+
+
+# ==================== Q&A ====================
+
+@metrics.track_db
+def save_qa(user_id, document_preview, question, answer, batch=None):
+    """Sauvegarde une Q&A"""
+    try:
+        qa_data = {
+            'user_id': user_id,
+            'document_preview': document_preview[:200],
+            'question': question,
+            'answer': answer,
+            'created_at': get_timestamp()
+        }
+
+        return _create_with_stats('qa_history', qa_data, {STATS_COUNTERS['qa_history']: 1}, batch)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_qa').inc()
+        print(f"Erreur save_qa: {e}")
+        return None
+
+
+@metrics.track_db
+def get_qa_history(user_id, limit=20, cursor=None):
+    """Récupère une page de l'historique des Q&A"""
+    start_after = decode_cursor(cursor)
+    try:
+        rows, next_cursor = _query_page('qa_history', user_id, limit, start_after,
+                                        fields=['document_preview', 'question', 'answer'])
+        return {'items': rows, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_qa_history').inc()
+        print(f"Erreur get_qa_history: {e}")
+        return {'items': [], 'next_cursor': None}
+
+
+# ==================== FAVORITES ====================
+
+@metrics.track_db
+def save_favorite(user_id, title, content, content_type='summary'):
+    """Sauvegarde un favori"""
+    try:
+        favorite_data = {
+            'user_id': user_id,
+            'title': title,
+            'content': content,
+            'content_type': content_type,
+            'created_at': get_timestamp()
+        }
+
+        return _create_with_stats('favorites', favorite_data, {STATS_COUNTERS['favorites']: 1})
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_favorite').inc()
+        print(f"Erreur save_favorite: {e}")
+        return None
+
+
+@metrics.track_db
+def get_favorites(user_id, limit=50, cursor=None):
+    """Récupère une page des favoris"""
+    start_after = decode_cursor(cursor)
+    try:
+        rows, next_cursor = _query_page('favorites', user_id, limit, start_after,
+                                        fields=['title', 'content', 'content_type'])
+        return {'items': rows, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_favorites').inc()
+        print(f"Erreur get_favorites: {e}")
+        return {'items': [], 'next_cursor': None}
+
+
+@metrics.track_db
+def delete_favorite(favorite_id, user_id):
+    """Supprime un favori"""
+    try:
+        return _delete_with_stats('favorites', favorite_id, user_id,
+                                  lambda data: {'total_favorites': -1}) is not None
+    except Exception:
+        metrics.DB_ERRORS.labels('delete_favorite').inc()
+        return False
+
+
+# ==================== EXPORT ====================
+
+@metrics.track_db
+def export_page(collection, user_id, limit=100, cursor=None):
+    """
+    Page complète d'une collection pour l'export: tous les champs, textes complets chargés,
+    entrées archivées comprises (après celles de la table). Retourne {'items': [...], 'next_cursor': ...}, ou None en cas d'erreur:
+    l'export s'interrompt plutôt que d'omettre des documents.
+    """
+    start_after = decode_cursor(cursor)
+    try:
+        rows, next_cursor = _query_page(collection, user_id, limit, start_after)
+        if next_cursor is None and collection in ARCHIVE_COLLECTIONS:
+            # Table épuisée: l'export se poursuit dans les archives (entrées plus anciennes)
+            after = (rows[-1]['created_at'], rows[-1]['id']) if rows else start_after
+            months = _archived_months(get_conn(), collection, user_id, until=after[0][:7] if after else None)
+            archived, next_cursor = archive_page(months, limit - len(rows), after)
+            rows += archived
+        field = ORIGINAL_TEXT_FIELDS.get(collection)
+        items = [export_item(row['id'], _load_original(row, field) if field else row) for row in rows]
+        return {'items': items, 'next_cursor': next_cursor}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('export_page').inc()
+        print(f"Erreur export_page: {e}")
+        return None
+
+
+# ==================== STATISTICS ====================
+
+def _read_stats(conn, user_id):
+    row = conn.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+    if row is None:
+        return None
+    stats = dict(row)
+    stats['style_counts'] = dict(conn.execute(
+        'SELECT style, count FROM user_style_counts WHERE user_id = ?', (user_id,)
+    ).fetchall())
+    return stats
+
+
+@metrics.track_db
+def get_global_stats(user_id):
+    """Récupère les statistiques d'utilisation (lecture des agrégats user_stats)"""
+    try:
+        stats = _read_stats(get_conn(), user_id)
+        if stats is None:
+            stats = rebuild_user_stats(user_id) or {}
+        return format_stats(stats)
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_global_stats').inc()
+        print(f"Erreur get_global_stats: {e}")
+        return format_stats({})
+
+
+@metrics.track_db
+def rebuild_user_stats(user_id):
+    """Recalcule les agrégats de l'utilisateur depuis les tables (dans une transaction)"""
+    try:
+        with _transaction() as conn:
+            stats = {}
+            for row in conn.execute('SELECT original_words, compression_rate, style FROM summaries WHERE user_id = ?',
+                                    (user_id,)):
+                merge_delta(stats, summary_delta(dict(row)))
+            for collection, counter in STATS_COUNTERS.items():
+                if collection != 'summaries':
+                    stats[counter] = conn.execute(f'SELECT COUNT(*) FROM {collection} WHERE user_id = ?',
+                                                  (user_id,)).fetchone()[0]
+            # Les entrées archivées font toujours partie de l'historique
+            for collection in ARCHIVE_COLLECTIONS:
+                for entry in _iter_archived(conn, user_id, collection):
+                    if collection == 'summaries':
+                        merge_delta(stats, summary_delta(entry))
+                    else:
+                        stats[STATS_COUNTERS[collection]] += 1
+
+            for counter in STATS_COUNTERS.values():
+                stats.setdefault(counter, 0)
+            stats.setdefault('total_words_processed', 0)
+            stats.setdefault('compression_sum', 0)
+            stats.setdefault('style_counts', {})
+            stats['updated_at'] = get_timestamp()
+
+            conn.execute('DELETE FROM user_stats WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM user_style_counts WHERE user_id = ?', (user_id,))
+            _apply_delta(conn, user_id, {key: value for key, value in stats.items() if key != 'updated_at'})
+        return stats
+    except Exception as e:
+        metrics.DB_ERRORS.labels('rebuild_user_stats').inc()
+        print(f"Erreur rebuild_user_stats: {e}")
+        return None
+
+
+# ==================== STATISTIQUES PAR JOUR ====================
+
+def _apply_rollup(conn, user_id, delta):
+    """Ajoute un delta par jour (voir database.rollup_delta) dans la transaction courante"""
+    rows = []
+    for period, values in delta.items():
+        for metric, value in values.items():
+            if isinstance(value, dict):
+                rows.extend((user_id, period, f'{metric}.{key}', count) for key, count in value.items())
+            else:
+                rows.append((user_id, period, metric, value))
+    conn.executemany(
+        'INSERT INTO user_rollups (user_id, period, metric, value) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT (user_id, period, metric) DO UPDATE SET value = value + excluded.value',
+        rows
+    )
+
+
+def _compaction_date(conn, user_id):
+    row = conn.execute('SELECT compacted_before FROM user_rollup_compactions WHERE user_id = ?', (user_id,)).fetchone()
+    return row['compacted_before'] if row else None
+
+
+@metrics.track_db
+def get_rollups(user_id, start=None, end=None):
+    """
+    Statistiques de l'utilisateur touchant [start, end] (AAAA-MM-JJ, bornes facultatives), en une requête:
+    {'days': {jour: métriques}, 'months': {mois: métriques}, 'compacted_before': date ou None}
+    """
+    try:
+        conn = get_conn()
+        sql = 'SELECT period, metric, value FROM user_rollups WHERE user_id = ?'
+        params = [user_id]
+        if start:
+            sql += ' AND period >= ?'  # mois compacté de start compris
+            params.append(start[:7])
+        if end:
+            sql += ' AND period <= ?'
+            params.append(end)
+        days, months = {}, {}
+        for row in conn.execute(sql, params):
+            values = (days if len(row['period']) == 10 else months).setdefault(row['period'], {})
+            metric, _, key = row['metric'].partition('.')
+            if key:
+                values.setdefault(metric, {})[key] = row['value']
+            else:
+                values[metric] = row['value']
+        return {'days': days, 'months': months, 'compacted_before': _compaction_date(conn, user_id)}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_rollups').inc()
+        print(f"Erreur get_rollups: {e}")
+        return None
+
+
+@metrics.track_db
+def compact_rollups(user_id, before):
+    """Cumule dans leur mois les jours antérieurs à before (AAAA-MM-JJ); retourne le nombre de jours repliés"""
+    try:
+        with _transaction() as conn:
+            folded = conn.execute(
+                'SELECT COUNT(DISTINCT period) FROM user_rollups WHERE user_id = ? AND length(period) = 10 AND period < ?',
+                (user_id, before)
+            ).fetchone()[0]
+            if folded:
+                conn.execute(
+                    'INSERT INTO user_rollups (user_id, period, metric, value) '
+                    'SELECT user_id, substr(period, 1, 7), metric, SUM(value) FROM user_rollups '
+                    'WHERE user_id = ? AND length(period) = 10 AND period < ? GROUP BY substr(period, 1, 7), metric '
+                    'ON CONFLICT (user_id, period, metric) DO UPDATE SET value = value + excluded.value',
+                    (user_id, before)
+                )
+                conn.execute('DELETE FROM user_rollups WHERE user_id = ? AND length(period) = 10 AND period < ?',
+                             (user_id, before))
+            conn.execute(
+                'INSERT INTO user_rollup_compactions (user_id, compacted_before) VALUES (?, ?) '
+                'ON CONFLICT (user_id) DO UPDATE SET compacted_before = MAX(compacted_before, excluded.compacted_before)',
+                (user_id, before)
+            )
+        return folded
+    except Exception as e:
+        metrics.DB_ERRORS.labels('compact_rollups').inc()
+        print(f"Erreur compact_rollups: {e}")
+        return None
+
+
+@metrics.track_db
+def rebuild_rollups(user_id):
+    """
+    Recalcule les statistiques par jour depuis les tables (utilisateurs antérieurs, réparation),
+    en respectant la dernière compaction. Retourne {'days': n, 'months': n}.
+    """
+    try:
+        with _transaction() as conn:
+            days, months = {}, {}
+            for collection, fields in ROLLUP_FIELDS.items():
+                for row in conn.execute(f"SELECT {', '.join(fields)} FROM {collection} WHERE user_id = ?", (user_id,)):
+                    merge_delta(days, rollup_delta(collection, dict(row)))
+                if collection in ARCHIVE_COLLECTIONS:
+                    for entry in _iter_archived(conn, user_id, collection):
+                        merge_delta(days, rollup_delta(collection, entry))
+            compacted_before = _compaction_date(conn, user_id)
+            if compacted_before:
+                fold_rollups(days, months, compacted_before)
+            conn.execute('DELETE FROM user_rollups WHERE user_id = ?', (user_id,))
+            _apply_rollup(conn, user_id, {**days, **months})
+        return {'days': len(days), 'months': len(months)}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('rebuild_rollups').inc()
+        print(f"Erreur rebuild_rollups: {e}")
+        return None
+
+
+# ==================== RECHERCHE ====================
+
+def _index_entry(conn, collection, doc_id, data):
+    """Ajoute une entrée à l'index de recherche, dans la transaction de son insertion"""
+    terms, length = search.index_terms(search_text(collection, data))
+    if not terms:
+        return
+    entry_id = conn.execute(
+        'INSERT INTO search_entries (user_id, collection, doc_id, created_at, item, length) VALUES (?, ?, ?, ?, ?, ?)',
+        (data['user_id'], collection, doc_id, data.get('created_at'),
+         json.dumps(search_item(collection, data), ensure_ascii=False), length)
+    ).lastrowid
+    stats = conn.execute('SELECT entries, total_length FROM search_stats WHERE user_id = ?',
+                         (data['user_id'],)).fetchone()
+    avgdl = stats['total_length'] / stats['entries'] if stats and stats['entries'] > 0 else length
+    conn.executemany(
+        'INSERT INTO search_postings (user_id, term, entry_id, tf, length, impact) VALUES (?, ?, ?, ?, ?, ?)',
+        [(data['user_id'], term, entry_id, tf, length, search.impact(tf, length, avgdl)) for term, tf in terms.items()]
+    )
+    _update_search_counts(conn, data['user_id'], list(terms), length, sign=1)
+
+
+def _update_search_counts(conn, user_id, terms, length, sign):
+    conn.executemany(
+        'INSERT INTO search_terms (user_id, term, df) VALUES (?, ?, ?) '
+        'ON CONFLICT (user_id, term) DO UPDATE SET df = df + excluded.df',
+        [(user_id, term, sign) for term in terms]
+    )
+    conn.execute(
+        'INSERT INTO search_stats (user_id, entries, total_length) VALUES (?, ?, ?) '
+        'ON CONFLICT (user_id) DO UPDATE SET entries = entries + excluded.entries, '
+        'total_length = total_length + excluded.total_length',
+        (user_id, sign, sign * length)
+    )
+
+
+def _unindex_entry(conn, collection, doc_id):
+    row = conn.execute('SELECT id, user_id, length FROM search_entries WHERE collection = ? AND doc_id = ?',
+                       (collection, doc_id)).fetchone()
+    if row:
+        terms = [term for (term,) in conn.execute('SELECT term FROM search_postings WHERE entry_id = ?', (row['id'],))]
+        _update_search_counts(conn, row['user_id'], terms, row['length'], sign=-1)
+        conn.execute('DELETE FROM search_postings WHERE entry_id = ?', (row['id'],))
+        conn.execute('DELETE FROM search_entries WHERE id = ?', (row['id'],))
+
+
+def _delete_search_index(conn, user_id):
+    for table in ('search_postings', 'search_entries', 'search_terms', 'search_stats'):
+        conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+
+
+def _expand_prefix(conn, user_id, prefix):
+    """Termes commençant par prefix et leur nombre d'entrées: [(terme, df)]"""
+    return [(row['term'], row['df']) for row in conn.execute(
+        "SELECT term, df FROM search_terms WHERE user_id = ? AND term >= ? AND term < ? AND df > 0 "
+        "ORDER BY term LIMIT ?", (user_id, prefix, prefix + '\uffff', search.MAX_PREFIX_EXPANSIONS))]
+
+
+def _candidate_entries(conn, user_id, groups, n_docs):
+    """
+    Entrées à noter (None: toutes celles qui contiennent les termes).
+    - Un préfixe peu fréquent: ses entrées (exact, puisque tous les préfixes sont requis).
+    - Sinon, listes de champions: les meilleures occurrences de chaque terme par impact, cumulées
+      (idf * impact) par entrée; les mieux placées sont retenues. Approximation: une entrée
+      moyenne pour chaque terme pris isolément peut manquer au classement.
+    """
+    group_sizes = [sum(df for _, df in expansions) for expansions in groups]
+    if sum(group_sizes) <= search.EXACT_SCORING_LIMIT:
+        return None
+    rarest = min(range(len(groups)), key=group_sizes.__getitem__)
+    if group_sizes[rarest] <= search.RESCORE_CANDIDATES:
+        terms = [term for term, _ in groups[rarest]]
+        return [row[0] for row in conn.execute(
+            f"SELECT DISTINCT entry_id FROM search_postings WHERE user_id = ? "
+            f"AND term IN ({', '.join('?' * len(terms))})", (user_id, *terms))]
+    estimates = {}
+    for expansions in groups:
+        for term, df in expansions:
+            weight = search.idf(df, n_docs)
+            for entry_id, impact in conn.execute(
+                    'SELECT entry_id, impact FROM search_postings WHERE user_id = ? AND term = ? '
+                    'ORDER BY impact DESC LIMIT ?', (user_id, term, search.CHAMPION_LIST_SIZE)):
+                estimates[entry_id] = estimates.get(entry_id, 0) + weight * impact
+    return heapq.nlargest(search.RESCORE_CANDIDATES, estimates, key=estimates.get)
+
+
+@metrics.track_db
+def search_history(user_id, query, collections=None, limit=20):
+    """
+    Recherche classée (BM25, statistiques propres à l'utilisateur) dans son historique,
+    chaque terme de la requête étant un préfixe. Les poids des termes (idf) sont calculés
+    ici, le score de chaque entrée par SQLite: seules les `limit` meilleures sont lues.
+    Retourne {'items': [...]} du plus pertinent au moins pertinent.
+    """
+    prefixes = search.query_terms(query)
+    if not prefixes:
+        return {'items': []}
+    try:
+        conn = get_conn()
+        stats = conn.execute('SELECT entries, total_length FROM search_stats WHERE user_id = ?', (user_id,)).fetchone()
+        n_docs, total_length = (stats['entries'], stats['total_length']) if stats else (0, 0)
+        groups = [_expand_prefix(conn, user_id, prefix) for prefix in prefixes]
+        if not all(groups):
+            return {'items': []}  # un préfixe sans correspondance: aucun résultat (ET)
+        weights = [(term, search.idf(df, n_docs), group)
+                   for group, expansions in enumerate(groups) for term, df in expansions]
+        candidates = _candidate_entries(conn, user_id, groups, n_docs)
+
+        avgdl = total_length / n_docs if n_docs else 1
+        term_score = 'q.idf * p.tf * (? + 1) / (p.tf + ? * (1 - ? + ? * p.length / ?))'
+        single = len(weights) == 1  # une ligne par entrée: pas de regroupement
+        sql = (
+            f"WITH q(term, idf, grp) AS (VALUES {', '.join(['(?, ?, ?)'] * len(weights))}) "
+            f"SELECT p.entry_id, {term_score if single else f'SUM({term_score})'} AS score "
+        )
+        params = [value for weight in weights for value in weight]
+        params += [search.BM25_K1, search.BM25_K1, search.BM25_B, search.BM25_B, avgdl]
+        if candidates is None:
+            sql += 'FROM q JOIN search_postings p ON p.user_id = ? AND p.term = q.term '
+            params.append(user_id)
+        else:
+            # CROSS JOIN impose l'ordre: une recherche par clé primaire par (terme, candidat)
+            sql += ('FROM q CROSS JOIN json_each(?) c CROSS JOIN search_postings p '
+                    'ON p.user_id = ? AND p.term = q.term AND p.entry_id = c.value ')
+            params += [json.dumps(candidates), user_id]
+        if collections:
+            sql += (f"JOIN search_entries f ON f.id = p.entry_id "
+                    f"AND f.collection IN ({', '.join('?' * len(collections))}) ")
+            params.extend(collections)
+        if not single:
+            sql += 'GROUP BY p.entry_id HAVING COUNT(DISTINCT q.grp) = ? '
+            params.append(len(prefixes))
+        sql += 'ORDER BY score DESC LIMIT ?'
+        params.append(limit)
+        ranked = conn.execute(sql, params).fetchall()
+        if not ranked:
+            return {'items': []}
+
+        entries = {row['id']: row for row in conn.execute(
+            f"SELECT id, collection, doc_id, created_at, item FROM search_entries "
+            f"WHERE id IN ({', '.join('?' * len(ranked))})", [row['entry_id'] for row in ranked])}
+        items = []
+        for row in ranked:
+            entry = entries[row['entry_id']]
+            items.append({
+                'id': entry['doc_id'],
+                'collection': entry['collection'],
+                'created_at': entry['created_at'],
+                **json.loads(entry['item'] or '{}'),
+                'score': round(row['score'], 3)
+            })
+        return {'items': items}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('search_history').inc()
+        print(f"Erreur search_history: {e}")
+        return {'items': []}
+
+
+@metrics.track_db
+def rebuild_search_index(user_id):
+    """Reconstruit l'index de recherche de l'utilisateur depuis ses tables et archives; retourne le nombre d'entrées"""
+    try:
+        with _transaction() as conn:
+            _delete_search_index(conn, user_id)
+            indexed = 0
+            for collection in SEARCH_COLLECTIONS:
+                rows = conn.execute(f'SELECT * FROM {collection} WHERE user_id = ?', (user_id,)).fetchall()
+                for row in rows:
+                    _index_entry(conn, collection, row['id'], _row_to_dict(row))
+                    indexed += 1
+                if collection in ARCHIVE_COLLECTIONS:
+                    for entry in _iter_archived(conn, user_id, collection):
+                        _index_entry(conn, collection, entry['id'], entry)
+                        indexed += 1
+        return indexed
+    except Exception as e:
+        metrics.DB_ERRORS.labels('rebuild_search_index').inc()
+        print(f"Erreur rebuild_search_index: {e}")
+        return None
+
+
+# ==================== ARCHIVES ====================
+
+def _archived_months(conn, collection, user_id, until=None):
+    """Entrées archivées par mois, du plus récent au plus ancien (jusqu'au mois until compris): [(AAAA-MM, entrées)]"""
+    sql = 'SELECT DISTINCT period FROM history_archives WHERE user_id = ? AND collection = ?'
+    params = [user_id, collection]
+    if until:
+        sql += ' AND period <= ?'
+        params.append(until)
+    periods = [row['period'] for row in conn.execute(sql + ' ORDER BY period DESC', params)]
+    for period in periods:
+        entries = []
+        for row in conn.execute('SELECT data FROM history_archives WHERE user_id = ? AND collection = ? AND period = ?',
+                                (user_id, collection, period)):
+            entries.extend(unpack_archive(row['data']))
+        yield period, entries
+
+
+def _iter_archived(conn, user_id, collection):
+    """Toutes les entrées archivées d'une collection, avec leur user_id"""
+    for _, entries in _archived_months(conn, collection, user_id):
+        for entry in entries:
+            yield dict(entry, user_id=user_id)
+
+
+def _get_archived(collection, doc_id, user_id):
+    """Entrée archivée de l'utilisateur par son ID (une part d'archive décompressée), ou None"""
+    conn = get_conn()
+    row = conn.execute(
+        'SELECT a.data FROM history_archive_ids i JOIN history_archives a ON a.user_id = i.user_id '
+        'AND a.collection = i.collection AND a.period = i.period AND a.part = i.part '
+        'WHERE i.collection = ? AND i.doc_id = ? AND i.user_id = ?',
+        (collection, doc_id, user_id)
+    ).fetchone()
+    if row is None:
+        return None
+    entry = next((entry for entry in unpack_archive(row['data']) if entry['id'] == doc_id), None)
+    return dict(entry, user_id=user_id, archived=True) if entry else None
+
+
+@metrics.track_db
+def archive_history(user_id, collection, before, limit=ARCHIVE_BATCH_SIZE):
+    """
+    Déplace au plus limit entrées de collection antérieures à before (AAAA-MM-JJ) dans les archives
+    de leur mois, en une transaction. Agrégats, statistiques par jour, index de recherche et
+    références aux textes complets sont inchangés: l'entrée fait toujours partie de l'historique.
+    Retourne {AAAA-MM: entrées archivées} (vide: plus rien à archiver), ou None en cas d'erreur.
+    """
+    try:
+        archived = {}
+        with _transaction() as conn:
+            rows = conn.execute(
+                f'SELECT * FROM {collection} WHERE user_id = ? AND created_at < ? ORDER BY created_at LIMIT ?',
+                (user_id, before, limit)
+            ).fetchall()
+            entries = [archive_entry(row['id'], _row_to_dict(row)) for row in rows]
+            for period, new_entries in group_by_month(entries).items():
+                # La dernière part du mois est complétée, puis redécoupée si elle dépasse la taille d'une part
+                last = conn.execute(
+                    'SELECT part, data FROM history_archives WHERE user_id = ? AND collection = ? AND period = ? '
+                    'ORDER BY part DESC LIMIT 1', (user_id, collection, period)
+                ).fetchone()
+                first_part = last['part'] if last else 0
+                existing = unpack_archive(last['data']) if last else []
+                for offset, (part_entries, data) in enumerate(pack_archive_parts(existing + new_entries)):
+                    conn.execute(
+                        'INSERT OR REPLACE INTO history_archives (user_id, collection, period, part, entries, data, '
+                        'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (user_id, collection, period, first_part + offset, len(part_entries), data, get_timestamp())
+                    )
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO history_archive_ids (collection, doc_id, user_id, period, part) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        [(collection, entry['id'], user_id, period, first_part + offset) for entry in part_entries]
+                    )
+                archived[period] = len(new_entries)
+            conn.executemany(f'DELETE FROM {collection} WHERE id = ?', [(row['id'],) for row in rows])
+        if rows:
+            database.invalidate_pages(user_id, [collection])
+        return archived
+    except Exception as e:
+        metrics.DB_ERRORS.labels('archive_history').inc()
+        print(f"Erreur archive_history: {e}")
+        return None
+
+
+@metrics.track_db
+def preview_archive(user_id, collection, before):
+    """Entrées de collection antérieures à before, par mois: ce qu'archive_history déplacerait"""
+    try:
+        rows = get_conn().execute(
+            f'SELECT substr(created_at, 1, 7) AS period, COUNT(*) AS entries FROM {collection} '
+            f'WHERE user_id = ? AND created_at < ? GROUP BY period', (user_id, before)
+        )
+        return {row['period']: row['entries'] for row in rows}
+    except Exception as e:
+        metrics.DB_ERRORS.labels('preview_archive').inc()
+        print(f"Erreur preview_archive: {e}")
+        return None
+
+
+@metrics.track_db
+def get_archives(user_id):
+    """Archives de l'utilisateur: {collection: {AAAA-MM: {'entries', 'parts', 'bytes'}}}"""
+    try:
+        archives = {}
+        for row in get_conn().execute(
+            'SELECT collection, period, SUM(entries) AS entries, COUNT(*) AS parts, SUM(length(data)) AS bytes '
+            'FROM history_archives WHERE user_id = ? GROUP BY collection, period', (user_id,)
+        ):
+            archives.setdefault(row['collection'], {})[row['period']] = {
+                'entries': row['entries'], 'parts': row['parts'], 'bytes': row['bytes']
+            }
+        return archives
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_archives').inc()
+        print(f"Erreur get_archives: {e}")
+        return None
+
+
+# ==================== EFFACEMENT DE L'HISTORIQUE ====================
+
+@metrics.track_db
+def count_history(user_id):
+    """Nombre de documents d'historique par collection, entrées archivées comprises"""
+    try:
+        conn = get_conn()
+        counts = {
+            collection: conn.execute(f'SELECT COUNT(*) FROM {collection} WHERE user_id = ?', (user_id,)).fetchone()[0]
+            for collection in HISTORY_COLLECTIONS
+        }
+        for row in conn.execute('SELECT collection, SUM(entries) FROM history_archives WHERE user_id = ? '
+                                'GROUP BY collection', (user_id,)):
+            counts[row[0]] += row[1]
+        return counts
+    except Exception as e:
+        metrics.DB_ERRORS.labels('count_history').inc()
+        print(f"Erreur count_history: {e}")
+        return None
+
+
+@metrics.track_db
+def clear_all_history(user_id, progress=None):
+    """
+    Efface tout l'historique d'un utilisateur en une transaction (un DELETE par table).
+    Retourne {collection: nombre supprimé}, ou None en cas d'erreur.
+    """
+    try:
+        deleted = {}
+        with _transaction() as conn:
+            for collection in BLOB_COLLECTIONS:
+                conn.execute(
+                    f'UPDATE blobs SET refs = refs - (SELECT COUNT(*) FROM {collection} '
+                    f'WHERE user_id = ? AND blob_id = blobs.id) '
+                    f'WHERE id IN (SELECT blob_id FROM {collection} WHERE user_id = ?)',
+                    (user_id, user_id)
+                )
+            _delete_search_index(conn, user_id)
+            for collection in HISTORY_COLLECTIONS:
+                deleted[collection] = conn.execute(f'DELETE FROM {collection} WHERE user_id = ?', (user_id,)).rowcount
+
+            # Archives: leurs entrées référencent aussi des textes complets
+            releases = Counter()
+            for collection in ARCHIVE_COLLECTIONS:
+                for entry in _iter_archived(conn, user_id, collection):
+                    deleted[collection] += 1
+                    if entry.get('blob_id'):
+                        releases[entry['blob_id']] += 1
+            conn.executemany('UPDATE blobs SET refs = refs - ? WHERE id = ?',
+                             [(count, blob_id) for blob_id, count in releases.items()])
+            conn.execute('DELETE FROM history_archives WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM history_archive_ids WHERE user_id = ?', (user_id,))
+
+            # Remise à zéro des compteurs vidés (les favoris sont conservés)
+            reset = ', '.join(f'{STATS_COUNTERS[name]} = 0' for name in HISTORY_COLLECTIONS)
+            conn.execute(f'UPDATE user_stats SET {reset}, total_words_processed = 0, compression_sum = 0, '
+                         f'updated_at = ? WHERE user_id = ?', (get_timestamp(), user_id))
+            conn.execute('DELETE FROM user_style_counts WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM user_rollups WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM user_rollup_compactions WHERE user_id = ?', (user_id,))
+        database.invalidate_pages(user_id, HISTORY_COLLECTIONS)
+
+        if progress:
+            for collection, count in deleted.items():
+                progress(collection, count)
+        return deleted
+    except Exception as e:
+        metrics.DB_ERRORS.labels('clear_all_history').inc()
+        print(f"Erreur clear_all_history: {e}")
+        return None
+
+
+def _merge_fields(target, data):
+    """Fusion récursive des champs, comme set(merge=True) de Firestore"""
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_fields(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+@metrics.track_db
+def get_clear_job(user_id):
+    """État du dernier effacement en arrière-plan ou None"""
+    try:
+        row = get_conn().execute('SELECT data FROM history_jobs WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+    except Exception as e:
+        metrics.DB_ERRORS.labels('get_clear_job').inc()
+        print(f"Erreur get_clear_job: {e}")
+        return None
+
+
+@metrics.track_db
+def save_clear_job(user_id, data):
+    """Met à jour l'état d'effacement de l'utilisateur (fusion des champs)"""
+    try:
+        with _transaction() as conn:
+            row = conn.execute('SELECT data FROM history_jobs WHERE user_id = ?', (user_id,)).fetchone()
+            job = _merge_fields(json.loads(row['data']) if row else {}, dict(data, updated_at=get_timestamp()))
+            conn.execute('INSERT OR REPLACE INTO history_jobs (user_id, data) VALUES (?, ?)',
+                         (user_id, json.dumps(job, ensure_ascii=False)))
+        return True
+    except Exception as e:
+        metrics.DB_ERRORS.labels('save_clear_job').inc()
+        print(f"Erreur save_clear_job: {e}")
+        return False
+
+
+def init_db():
+    """Ouvre la base SQLite et crée le schéma si nécessaire"""
+    get_conn()
+    print(f"Base SQLite prête ({database.sqlite_path}, mode WAL)")
@@ -0,0 +1,324 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import uuid
+
+import database as db
+import metrics
+import storage_firestore
+
+try:
+    import fcntl
+except ImportError:  # Windows: pas de reprise des spools d'autres processus
+    fcntl = None
+
+# Taille du spool au-delà de laquelle il est réécrit avec les seuls enregistrements en attente
+SPOOL_COMPACT_BYTES = 8 * 1024 * 1024
+
+
+def _is_transient(error) -> bool:
+    """Erreurs réseau ou de disponibilité Firestore: le lot est retenté tel quel"""
+    from google.api_core import exceptions
+
+    return isinstance(error, (
+        exceptions.ServiceUnavailable,
+        exceptions.DeadlineExceeded,
+        exceptions.InternalServerError,
+        exceptions.Aborted,
+        exceptions.ResourceExhausted,
+        exceptions.TooManyRequests,
+        ConnectionError,
+        TimeoutError,
+    ))
+
+
+def _is_already_exists(error) -> bool:
+    from google.api_core import exceptions
+
+    return isinstance(error, (exceptions.AlreadyExists, exceptions.Conflict))
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class WriteBehindQueue:
+    """
+    File d'écriture différée de l'historique.
+
+    set() attribue un ID de document, consigne l'enregistrement dans un fichier spool local
+    puis rend la main: la réponse API n'attend pas Firestore. Un thread valide les
+    enregistrements par lots (storage_firestore.commit_records) et note leur fin dans le spool,
+    journal en ajout seul (une ligne {"done": [...]} par lot, pas de réécriture).
+    Les textes complets (put_blob) passent par la même file, avant les documents qui les référencent:
+    chaque texte est écrit dans son propre fichier (blobs/), l'enregistrement n'en garde que le chemin.
+    Un texte stocké est noté fini aussitôt: un rejeu ne le compte pas deux fois (refs).
+
+    - File bornée: quand elle est pleine, set() attend put_timeout puis écrit lui-même
+      (contre-pression sur les requêtes plutôt que perte de données).
+    - Erreurs transitoires: le lot est retenté avec un délai exponentiel.
+    - Redémarrage: le spool d'un worker mort (verrou flock libéré) est repris par le
+      prochain worker qui démarre; create() rend le rejeu idempotent.
+    """
+
+    def __init__(self, spool_dir: str = None, flush_interval: float = 0.5, max_batch: int = 100,
+                 max_pending: int = 1000, put_timeout: float = 2.0, max_attempts: int = 5):
+        self.spool_dir = spool_dir or os.environ.get(
+            'WRITE_BEHIND_DIR', os.path.join(tempfile.gettempdir(), 'nectar-spool')
+        )
+        self.flush_interval = flush_interval
+        # Chaque enregistrement peut ajouter une écriture user_stats et une user_rollups (500 par lot)
+        self.max_batch = min(max_batch, 160)
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self.max_attempts = max_attempts
+
+        self._pending = []  # enregistrements non validés, dans l'ordre d'arrivée
+        self._cond = threading.Condition()
+        self._closed = False
+        self._backoff = 0.0
+
+        self._blob_dir = os.path.join(self.spool_dir, 'blobs')
+        os.makedirs(self._blob_dir, exist_ok=True)
+        self._spool = self._open_spool()
+        self._recover()
+
+        self._thread = threading.Thread(target=self._loop, name='write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def set(self, collection: str, data: dict, stats_delta: dict = None) -> str:
+        """Met un document en file et retourne son ID (même interface que BatchWriter)"""
+        record = {
+            'collection': collection,
+            'id': db.new_doc_id(),
+            'data': data,
+            'stats': stats_delta or None,
+            'attempts': 0
+        }
+        with self._cond:
+            queued = self._cond.wait_for(lambda: len(self._pending) < self.max_pending, self.put_timeout)
+            if queued:
+                self._append(record)
+                if len(self._pending) >= self.max_batch:
+                    self._cond.notify_all()
+
+        if not queued:
+            # File saturée (Firestore lent ou indisponible): écriture synchrone
+            metrics.WRITE_BEHIND_RECORDS.labels('sync_fallback').inc()
+            storage_firestore.commit_records([record])
+            return record['id']
+
+        metrics.WRITE_BEHIND_RECORDS.labels('queued').inc()
+        return record['id']
+
+    def put_blob(self, text: str) -> str:
+        """
+        Met en file le texte complet d'un document et retourne l'ID de son blob (empreinte,
+        calculée localement). Il précède le document dans la file: il est écrit avant lui.
+        """
+        blob_id = db.pack_text(text)[0]
+        record = {'collection': None, 'id': db.new_doc_id(), 'blob_id': blob_id, 'attempts': 0}
+        # Texte écrit hors verrou, avant l'enregistrement qui y renvoie
+        record['blob_path'] = self._write_blob(record['id'], text)
+        with self._cond:
+            queued = self._cond.wait_for(lambda: len(self._pending) < self.max_pending, self.put_timeout)
+            if queued:
+                self._append(record)
+
+        if not queued:
+            metrics.WRITE_BEHIND_RECORDS.labels('sync_fallback').inc()
+            _remove_file(record['blob_path'])
+            return storage_firestore.put_blob(text)
+
+        metrics.WRITE_BEHIND_RECORDS.labels('queued').inc()
+        return blob_id
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def close(self, timeout: float = 10.0):
+        """Arrête le thread après une dernière tentative de vidage (le reliquat reste dans le spool)"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            if not self._pending and not self._thread.is_alive():
+                self._spool.close()
+                os.remove(self._spool_path)
+
+    # ==================== VALIDATION ====================
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._backoff:
+                    self._cond.wait_for(lambda: self._closed, self._backoff)
+                else:
+                    self._cond.wait_for(
+                        lambda: self._closed or len(self._pending) >= self.max_batch,
+                        self.flush_interval
+                    )
+                batch = list(self._pending[:self.max_batch])
+                closed = self._closed
+            if batch:
+                self._flush(batch)
+            if closed:
+                # Dernier passage: on vide ce qui peut l'être sans attendre les délais de reprise
+                while batch and not self._backoff:
+                    with self._cond:
+                        batch = list(self._pending[:self.max_batch])
+                    if batch:
+                        self._flush(batch)
+                return
+
+    def _flush(self, batch):
+        try:
+            for record in batch:
+                if 'blob_path' in record and not record.get('stored'):
+                    self._store_blob(record)
+            documents = [record for record in batch if 'blob_path' not in record]
+            if documents:
+                storage_firestore.commit_records(documents)
+            done = documents
+            metrics.WRITE_BEHIND_RECORDS.labels('committed').inc(len(batch))
+        except Exception as e:
+            if _is_transient(e):
+                metrics.WRITE_BEHIND_RECORDS.labels('retried').inc(len(batch))
+                self._backoff = min(max(self._backoff * 2, 1.0), 60.0)
+                print(f"Erreur écriture différée (nouvel essai dans {self._backoff:.0f} s): {e}")
+                return
+            # Enregistrement déjà écrit ou invalide: on isole le fautif
+            done = self._commit_individually([record for record in batch if not record.get('stored')])
+
+        self._backoff = 0.0
+        self._remove(done)
+
+    def _store_blob(self, record):
+        """Stocke un texte mis en file et le note fini aussitôt, avant les documents du lot"""
+        with open(record['blob_path'], encoding='utf-8') as source:
+            storage_firestore.put_blob(source.read())
+        record['stored'] = True
+        self._remove([record])
+        _remove_file(record['blob_path'])
+
+    def _commit_individually(self, batch):
+        done = []
+        for record in batch:
+            try:
+                if 'blob_path' in record:
+                    self._store_blob(record)
+                    metrics.WRITE_BEHIND_RECORDS.labels('committed').inc()
+                    continue
+                storage_firestore.commit_records([record])
+                metrics.WRITE_BEHIND_RECORDS.labels('committed').inc()
+                done.append(record)
+            except Exception as e:
+                if _is_already_exists(e):
+                    # Rejeu d'un enregistrement validé juste avant un redémarrage
+                    done.append(record)
+                elif _is_transient(e):
+                    break
+                else:
+                    record['attempts'] += 1
+                    if record['attempts'] >= self.max_attempts:
+                        metrics.WRITE_BEHIND_RECORDS.labels('dropped').inc()
+                        print(f"Erreur écriture différée, enregistrement abandonné "
+                              f"({record['collection'] or 'blobs'}/{record.get('blob_id') or record['id']}): {e}")
+                        done.append(record)
+                        if 'blob_path' in record:
+                            _remove_file(record['blob_path'])
+        return done
+
+    # ==================== SPOOL ====================
+
+    def _open_spool(self):
+        """Crée le spool du processus, verrouillé avant d'être visible des autres workers"""
+        path = os.path.join(self.spool_dir, f"{os.getpid()}-{uuid.uuid4().hex}.jsonl")
+        spool = open(path + '.tmp', 'a+', encoding='utf-8')
+        if fcntl is not None:
+            fcntl.flock(spool, fcntl.LOCK_EX)
+        os.replace(path + '.tmp', path)
+        self._spool_path = path
+        return spool
+
+    def _write_blob(self, record_id, text):
+        path = os.path.join(self._blob_dir, f"{record_id}.txt")
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(text)
+        return path
+
+    def _append(self, record):
+        self._pending.append(record)
+        self._spool.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._spool.flush()
+
+    def _remove(self, done):
+        if not done:
+            return
+        ids = [record['id'] for record in done]
+        with self._cond:
+            removed = set(ids)
+            self._pending = [record for record in self._pending if record['id'] not in removed]
+            if not self._pending:
+                # Plus rien en attente: le spool repart de zéro (sur place, le fichier garde son verrou)
+                self._spool.seek(0)
+                self._spool.truncate()
+            elif self._spool.tell() > SPOOL_COMPACT_BYTES:
+                # File jamais vide sous charge continue: réécriture rare des seuls enregistrements en attente
+                self._spool.seek(0)
+                self._spool.truncate()
+                for record in self._pending:
+                    self._spool.write(json.dumps(record, ensure_ascii=False) + '\n')
+            else:
+                self._spool.write(json.dumps({'done': ids}) + '\n')
+            self._spool.flush()
+            self._cond.notify_all()
+
+    def _recover(self):
+        """Reprend les spools des workers arrêtés (leur verrou n'est plus tenu)"""
+        if fcntl is None:
+            return
+        for path in glob.glob(os.path.join(self.spool_dir, '*.jsonl')):
+            if path == self._spool_path:
+                continue
+            try:
+                with open(path, encoding='utf-8') as orphan:
+                    try:
+                        fcntl.flock(orphan, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # worker vivant
+                    # Enregistrements dans l'ordre d'arrivée, moins ceux notés finis
+                    records = {}
+                    for line in orphan:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue  # ligne tronquée par un arrêt brutal
+                        if 'done' in entry:
+                            for record_id in entry['done']:
+                                records.pop(record_id, None)
+                        elif 'blob' in entry:
+                            # Spool d'une version précédente: texte dans l'enregistrement
+                            if not entry.pop('stored', False):
+                                entry['blob_path'] = self._write_blob(entry['id'], entry.pop('blob'))
+                                records[entry['id']] = entry
+                        else:
+                            records[entry['id']] = entry
+                    with self._cond:
+                        for record in records.values():
+                            self._append(record)
+                    os.remove(path)
+                metrics.WRITE_BEHIND_RECORDS.labels('recovered').inc(len(records))
+            except OSError as e:
+                print(f"Erreur reprise du spool {path}: {e}")